@@ -1,11 +1,35 @@
 # pylint: disable=W0104
 # W0104: Statement seems to have no effect
 
+import sys
 
-from ftw.upgrade.progresslogger import ProgressLogger
-from ftw.upgrade.step import UpgradeStep
 
+# The public API (UpgradeStep, ProgressLogger) imports the Zope and Plone
+# stack. The "bin/upgrade" command line script is a plain HTTP client which
+# imports modules of this package as well, thus the public API is imported
+# lazily (PEP 562) where the Python version supports it, so that the script
+# starts without importing Zope.
+_LAZY_IMPORTS = {
+    'ProgressLogger': 'ftw.upgrade.progresslogger',
+    'UpgradeStep': 'ftw.upgrade.step',
+}
 
-UpgradeStep
 
-ProgressLogger
+if sys.version_info >= (3, 7):
+    def __getattr__(name):
+        if name not in _LAZY_IMPORTS:
+            raise AttributeError(
+                'module {0!r} has no attribute {1!r}'.format(__name__, name))
+
+        from importlib import import_module
+        value = getattr(import_module(_LAZY_IMPORTS[name]), name)
+        globals()[name] = value
+        return value
+
+else:
+    from ftw.upgrade.progresslogger import ProgressLogger
+    from ftw.upgrade.step import UpgradeStep
+
+    UpgradeStep
+
+    ProgressLogger
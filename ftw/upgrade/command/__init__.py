@@ -1,23 +1,13 @@
-from ftw.upgrade.command import combine_bundles
-from ftw.upgrade.command import create
-from ftw.upgrade.command import help
-from ftw.upgrade.command import install
-from ftw.upgrade.command import list_cmd
-from ftw.upgrade.command import plone_upgrade
-from ftw.upgrade.command import plone_upgrade_needed
-from ftw.upgrade.command import recook
-from ftw.upgrade.command import sites
-from ftw.upgrade.command import touch
-from ftw.upgrade.command import user
 from ftw.upgrade.command.formatter import FlexiFormatter
 from ftw.upgrade.command.terminal import TERMINAL
 from ftw.upgrade.command.utils import capture
+from importlib import import_module
 from pkg_resources import get_distribution
 
-import argcomplete
 import argparse
 import json
 import logging
+import os
 import sys
 
 
@@ -25,6 +15,23 @@ VERSION = get_distribution('ftw.upgrade').version
 logger = logging.getLogger('ftw.upgrade')
 
 
+# Mapping of the command names to the modules implementing the commands.
+# The "help" command is registered as last, since it lists the other commands.
+COMMANDS = (
+    ('combine_bundles', 'ftw.upgrade.command.combine_bundles'),
+    ('create', 'ftw.upgrade.command.create'),
+    ('install', 'ftw.upgrade.command.install'),
+    ('list', 'ftw.upgrade.command.list_cmd'),
+    ('plone_upgrade', 'ftw.upgrade.command.plone_upgrade'),
+    ('plone_upgrade_needed', 'ftw.upgrade.command.plone_upgrade_needed'),
+    ('recook', 'ftw.upgrade.command.recook'),
+    ('sites', 'ftw.upgrade.command.sites'),
+    ('touch', 'ftw.upgrade.command.touch'),
+    ('user', 'ftw.upgrade.command.user'),
+    ('help', 'ftw.upgrade.command.help'),
+)
+
+
 DOCS = """
 {t.bold}DESCRIPTION:{t.normal}
     The bin/upgrade script helps to create upgrade steps as well as to \
@@ -120,7 +127,8 @@ class UpgradeArgumentParser(argparse.ArgumentParser):
 
 class UpgradeCommand(object):
 
-    def __init__(self):
+    def __init__(self, argv=None):
+        self.argv = sys.argv[1:] if argv is None else argv
         self.parser = UpgradeArgumentParser(
             sys.argv[0],
             epilog=DOCS)
@@ -128,25 +136,16 @@ class UpgradeCommand(object):
         self.parser.add_argument('--version', action='version',
                                  version='%(prog)s {0}'.format(VERSION))
 
-        argcomplete.autocomplete(self.parser)
-
         commands = self.parser.add_subparsers(help='Command')
-        combine_bundles.setup_argparser(commands)
-        create.setup_argparser(commands)
-        install.setup_argparser(commands)
-        list_cmd.setup_argparser(commands)
-        plone_upgrade.setup_argparser(commands)
-        plone_upgrade_needed.setup_argparser(commands)
-        recook.setup_argparser(commands)
-        sites.setup_argparser(commands)
-        touch.setup_argparser(commands)
-        user.setup_argparser(commands)
-
-        # Register as last.
-        help.setup_argparser(commands)
+        for module in get_command_modules(self.argv):
+            module.setup_argparser(commands)
+
+        if '_ARGCOMPLETE' in os.environ:
+            import argcomplete
+            argcomplete.autocomplete(self.parser)
 
     def __call__(self):
-        args = self.parser.parse_args()
+        args = self.parser.parse_args(self.argv)
         configure_logging(args)
         setattr(args, 'parser', self.parser)
         if getattr(args, 'all_sites', False):
@@ -173,6 +172,23 @@ class UpgradeCommand(object):
             args.func(args)
 
 
+def get_command_modules(argv):
+    """Imports and returns the modules of the commands to register.
+    When a command is chosen, only the module of this command is imported,
+    so that the startup of the script does not import the dependencies of
+    all other commands.
+    All commands are needed for the help, the usage and the shell
+    completion.
+    """
+    modules = dict(COMMANDS)
+    chosen = next((arg for arg in argv if not arg.startswith('-')), None)
+    if chosen in modules and chosen != 'help' \
+       and '_ARGCOMPLETE' not in os.environ:
+        return [import_module(modules[chosen])]
+
+    return [import_module(module) for _name, module in COMMANDS]
+
+
 def configure_logging(args):
     # Extend the level names with colors.
     logging.addLevelName(
@@ -41,10 +41,14 @@ Each upgrade is identified by its API id of format "<dest>@<profileid>".
 The profiles are ordered topologically with the GS profile dependency graph. \
 Upgrades within each profile are ordered by the source / destination versions.
 
+{t.bold}PROFILING:{t.normal}
+    With the "--profiling" argument, each upgrade step is profiled with cProfile and the stats are written to a "upgrade-profile-*.pstats" file per upgrade step into the log directory of the instance.
+
 {t.bold}EXAMPLES:{t.normal}
 [quote]
 $ bin/upgrade install --site Plone --proposed
 $ bin/upgrade install --site Plone --proposed --auth admin:admin
+$ bin/upgrade install --site Plone --proposed --profiling
 $ bin/upgrade install --site Plone --proposed my.package:default other.package:default
 $ bin/upgrade install --site Plone --upgrades 3001@my.package:default \
 3002@my.package:default
@@ -118,6 +122,13 @@ def setup_argparser(commands):
                          dest='intermediate_commit',
                          action='store_true')
 
+    command.add_argument('--profiling',
+                         help='Profile each upgrade step and write the '
+                              'stats to the log directory.',
+                         default=False,
+                         dest='profiling',
+                         action='store_true')
+
 
 @with_api_requestor
 @error_handling
@@ -136,6 +147,10 @@ def install_command(args, requestor):
             print('ERROR: --intermediate-commit is not implemented for --profiles.',
                   file=sys.stderr)
             sys.exit(3)
+        if args.profiling:
+            print('ERROR: --profiling is not implemented for --profiles.',
+                  file=sys.stderr)
+            sys.exit(3)
         action = 'execute_profiles'
         params = [('profiles:list', name) for name in set(args.profiles)]
         if args.force_reinstall:
@@ -147,6 +162,8 @@ def install_command(args, requestor):
         params.append(('allow_outdated', True))
     if args.intermediate_commit:
         params.append(('intermediate_commit', True))
+    if args.profiling:
+        params.append(('profiling', True))
 
     with closing(requestor.POST(action, params=params,
                                 stream=True)) as response:
@@ -1,6 +1,6 @@
 from __future__ import print_function
 from binascii import hexlify
-from ftw.upgrade.utils import get_tempfile_authentication_directory
+from ftw.upgrade.tempfileauth import get_tempfile_authentication_directory
 from path import Path
 from requests.auth import AuthBase
 from requests.auth import HTTPBasicAuth
@@ -10,6 +10,7 @@ from ftw.upgrade.command.terminal import colorized_profile_versions
 from ftw.upgrade.command.terminal import print_table
 from ftw.upgrade.command.terminal import TERMINAL
 from ftw.upgrade.command.terminal import upgrade_id_with_flags
+from ftw.upgrade.formatting import format_duration
 
 
 DOCS = """
@@ -30,7 +31,9 @@ well as database and filesystem versions.
 
 {t.bold}LIST PROPOSED UPGRADES:{t.normal}
     Listing proposed upgrades lists all upgrades which are proposed for this \
-Plone site. Only profiles installed on this Plone site are respected.
+Plone site. Only profiles installed on this Plone site are respected. \
+When upgrades were already installed on this site (e.g. on a copy of the \
+database), the expected duration measured in these runs is listed as well.
 
 [quote]
     $ ./bin/upgrade list --site Plone --upgrades
@@ -80,8 +83,12 @@ def list_command(args, requestor):
 
 
 def format_proposed_upgrades(response):
+    upgrades = response.json()
+    with_durations = any(upgrade.get('expected_duration') is not None
+                         for upgrade in upgrades)
+
     proposed = []
-    for upgrade in response.json():
+    for upgrade in upgrades:
         is_deferrable = upgrade.get('deferrable', False)
 
         omit_flags = ('proposed', 'orphan') if is_deferrable else ('proposed',)
@@ -89,10 +96,22 @@ def format_proposed_upgrades(response):
         table_row = [upgrade_id_with_flags(upgrade, omit_flags=omit_flags),
                      TERMINAL.bold(upgrade.get('title')),
                      ]
+        if with_durations:
+            table_row.append(format_expected_duration(upgrade))
         proposed.append(table_row)
 
     print(TERMINAL.bold('Proposed upgrades:'))
-    print_table(proposed, ['ID:', 'Title:'])
+    if with_durations:
+        print_table(proposed, ['ID:', 'Title:', 'Expected duration:'])
+    else:
+        print_table(proposed, ['ID:', 'Title:'])
+
+
+def format_expected_duration(upgrade):
+    duration = upgrade.get('expected_duration')
+    if duration is None:
+        return '-'
+    return format_duration(duration)
 
 
 def format_profiles(response):
@@ -0,0 +1,96 @@
+from BTrees.OOBTree import OOBTree
+from ftw.upgrade.deferred import get_deferred_reindexing
+from zope.annotation import IAnnotations
+
+import logging
+import transaction
+
+
+ANNOTATION_KEY = 'ftw.upgrade:cursors'
+
+
+class IterationCursor(object):
+    """The iteration cursor stores the position of the last item of a
+    committed batch in an annotation of the Plone site, so that an
+    interrupted iteration can be resumed after this position.
+    The cursors are identified by a ``key``.
+    """
+
+    def __init__(self, portal, key):
+        self.portal = portal
+        self.key = key
+
+    def get(self):
+        """Returns the stored position or None.
+        """
+        storage = self._get_storage()
+        if storage is None:
+            return None
+        return storage.get(self.key, None)
+
+    def set(self, position):
+        self._get_storage(create=True)[self.key] = position
+
+    def clear(self):
+        storage = self._get_storage()
+        if storage is not None and self.key in storage:
+            del storage[self.key]
+
+    def _get_storage(self, create=False):
+        annotations = IAnnotations(self.portal)
+        if ANNOTATION_KEY not in annotations and create:
+            annotations[ANNOTATION_KEY] = OOBTree()
+        return annotations.get(ANNOTATION_KEY, None)
+
+
+class CommitIterator(object):
+    """An iterator that commits the transaction every n items.
+
+    The iterator expects an iterable of ``(position, item)`` tuples, ordered
+    by position, and yields the items.
+    Before committing, the position of the last item is stored in the
+    ``cursor``, so that a rerun can skip the items of the committed batches.
+    When the iteration is complete, the cursor is cleared.
+
+    The commits happen in the middle of the upgrade step: they commit all
+    changes of the current transaction, including the changes of the
+    upgrade step before the iteration and of previous upgrade steps in the
+    same transaction, but the upgrade step is not marked as installed.
+    The deferred reindex requests (see ``DeferredReindexing``) are flushed
+    before each commit, so that the committed batches are reindexed.
+    When the consumer leaves the iteration early, the cursor is kept until
+    the upgrade step is completed (see ``UpgradeStep._clear_cursors``),
+    since an early closed iteration cannot be told apart from an iteration
+    interrupted by an error, whose cursor is needed for resuming.
+    """
+
+    def __init__(self, positioned_items, batch_size, cursor, logger=None):
+        self.positioned_items = positioned_items
+        self.batch_size = batch_size
+        self.cursor = cursor
+        self.logger = logger
+
+        if self.logger is None:
+            self.logger = logging.getLogger('ftw.upgrade')
+
+        if not batch_size or batch_size < 1:
+            raise ValueError("Batch size must be a positive value")
+
+    def __iter__(self):
+        for i, (position, item) in enumerate(self.positioned_items, 1):
+            yield item
+
+            if i % self.batch_size == 0:
+                deferred_reindexing = get_deferred_reindexing()
+                if deferred_reindexing is not None:
+                    deferred_reindexing.flush()
+                self.cursor.set(position)
+                transaction.get().note(
+                    u'Committed batch at {0} items'.format(i))
+                transaction.commit()
+                self.logger.info("Committed batch at %s items" % i)
+
+        self.cursor.clear()
+
+    def __len__(self):
+        return self.positioned_items.__len__()
@@ -0,0 +1,154 @@
+from collections import OrderedDict
+from ftw.upgrade.metrics import count_metric
+from ftw.upgrade.reindexer import reindex_object
+from plone.uuid.interfaces import IUUID
+from Products.CMFCore.utils import getToolByName
+from Products.ZCatalog.ProgressHandler import ZLogHandler
+
+import logging
+import threading
+
+
+LOG = logging.getLogger('ftw.upgrade')
+
+_active = threading.local()
+
+
+class DeferredReindexing(object):
+    """Collects the reindex requests of the upgrade steps of an upgrade run,
+    so that they are executed only once when flushed.
+
+    The reindex requests of an object are merged into a single reindex of
+    all requested indexes.
+    The rebuilds of indexes are merged into a single pass over the catalog,
+    which also covers the reindex requests of the rebuilt indexes.
+
+    Upgrade steps defer their requests to the collector which is active in
+    the current thread (see ``get_deferred_reindexing``).
+
+    The objects are remembered by UID and path, so that objects which are
+    moved or renamed before the flush are found by their UID.
+    Objects which are not found anymore are logged.
+    """
+
+    def __init__(self, portal, logger=None):
+        self.portal = portal
+        self.catalog = getToolByName(portal, 'portal_catalog')
+        self.logger = logger or LOG
+        self._previous = None
+        self._objects = OrderedDict()
+        self._indexes = []
+        self._requests = 0
+
+    def __enter__(self):
+        self._previous = get_deferred_reindexing()
+        _active.reindexing = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _active.reindexing = self._previous
+
+    def reindex_object(self, obj, idxs=None):
+        """Defers the reindex of the indexes ``idxs`` (all indexes by
+        default) of ``obj``.
+        """
+        self._queue(IUUID(obj, None), '/'.join(obj.getPhysicalPath()), idxs)
+
+    def reindex_brain(self, brain, idxs=None):
+        """Defers the reindex of the indexes ``idxs`` (all indexes by
+        default) of the object of the catalog ``brain``, without loading
+        the object.
+        """
+        self._queue(getattr(brain, 'UID', None) or None, brain.getPath(),
+                    idxs)
+
+    def _queue(self, uid, path, idxs):
+        self._requests += 1
+        key = uid or path
+        if key not in self._objects:
+            self._objects[key] = (uid, path,
+                                  None if idxs is None else set(idxs))
+        elif idxs is None:
+            self._objects[key] = (uid, path, None)
+        elif self._objects[key][2] is not None:
+            self._objects[key][2].update(idxs)
+
+    def rebuild_index(self, name):
+        """Defers the rebuild of the index ``name``.
+        """
+        self._requests += 1
+        if name not in self._indexes:
+            self._indexes.append(name)
+
+    def flush(self):
+        """Executes the collected requests and returns statistics about the
+        amount of requests, executed operations and eliminated redundant
+        operations.
+        """
+        objects, self._objects = self._objects, OrderedDict()
+        indexes, self._indexes = self._indexes, []
+        requests, self._requests = self._requests, 0
+        stats = {'requests': requests,
+                 'reindexed_objects': 0,
+                 'rebuilt_indexes': len(indexes),
+                 'unresolved': 0,
+                 'eliminated': 0}
+        if not requests:
+            return stats
+
+        for uid, path, idxs in objects.values():
+            if idxs is not None:
+                idxs = idxs.difference(indexes)
+                if not idxs:
+                    # Covered by the index rebuilds.
+                    continue
+
+            obj = self._resolve(uid, path)
+            if obj is None:
+                self.logger.warning(
+                    'Deferred reindexing: the object {0} (UID {1}) was not'
+                    ' found and is not reindexed.'.format(path, uid))
+                stats['unresolved'] += 1
+                continue
+
+            reindex_object(self.catalog, obj,
+                           idxs=None if idxs is None else sorted(idxs))
+            stats['reindexed_objects'] += 1
+
+        if indexes:
+            self.logger.info('Rebuilding indexes %s' % ', '.join(indexes))
+            # pylint: disable=W0212
+            pgthreshold = self.catalog._getProgressThreshold() or 100
+            # pylint: enable=W0212
+            self.catalog.reindexIndex(indexes, None,
+                                      pghandler=ZLogHandler(pgthreshold))
+            count_metric('catalog_rebuild_index', len(indexes))
+
+        stats['eliminated'] = (requests - stats['reindexed_objects']
+                               - stats['rebuilt_indexes']
+                               - stats['unresolved'])
+        self.logger.info(
+            'Deferred reindexing: reindexed {reindexed_objects} objects and'
+            ' rebuilt {rebuilt_indexes} indexes for {requests} requests'
+            ' ({eliminated} redundant operations eliminated)'.format(**stats))
+        return stats
+
+    def _resolve(self, uid, path):
+        """Returns the object at ``path`` or, when it was moved or renamed,
+        the object with the ``uid``, or None.
+        """
+        obj = self.portal.unrestrictedTraverse(path, None)
+        if obj is not None and (uid is None or IUUID(obj, None) == uid):
+            return obj
+        if uid is None:
+            return None
+        for brain in self.catalog.unrestrictedSearchResults(UID=uid):
+            return self.portal.unrestrictedTraverse(brain.getPath(), None)
+        return None
+
+
+def get_deferred_reindexing():
+    """Returns the ``DeferredReindexing`` active in the current thread or
+    None.
+    """
+    return getattr(_active, 'reindexing', None)
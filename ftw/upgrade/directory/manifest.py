@@ -0,0 +1,111 @@
+from hashlib import sha1
+
+import json
+import logging
+import os
+import tempfile
+
+
+# The manifests of the scanned upgrade step directories are only written
+# when a cache directory is configured with this environment variable.
+MANIFEST_DIRECTORY_KEY = 'UPGRADE_SCAN_CACHE_DIRECTORY'
+
+# Increase when the format of the manifest changes.
+MANIFEST_VERSION = 1
+
+
+LOG = logging.getLogger('ftw.upgrade')
+
+
+def read_manifest(directory):
+    """Returns the upgrade step entries of the manifest of the upgrade step
+    ``directory``.
+    None is returned when there is no manifest or when the directory, an
+    upgrade step directory or an upgrade.py changed since the manifest
+    was written.
+    """
+    manifest_path = get_manifest_path(directory)
+    if manifest_path is None or not os.path.isfile(manifest_path):
+        return None
+
+    try:
+        with open(manifest_path) as manifest_file:
+            manifest = json.load(manifest_file)
+    except (IOError, OSError, ValueError):
+        return None
+
+    if manifest.get('version') != MANIFEST_VERSION \
+       or manifest.get('directory') != os.path.abspath(directory):
+        return None
+
+    for path, stats in manifest['stats'].items():
+        if _get_stats(path) != stats:
+            return None
+
+    return manifest['entries']
+
+
+def write_manifest(directory, stats, entries):
+    """Writes the manifest of the upgrade step ``directory``.
+    The ``stats`` must be collected with ``get_directory_stats`` before
+    the ``entries`` are collected, so that changes made in the meantime
+    invalidate the manifest.
+    """
+    manifest_path = get_manifest_path(directory)
+    if manifest_path is None:
+        return
+
+    manifest = {'version': MANIFEST_VERSION,
+                'directory': os.path.abspath(directory),
+                'stats': stats,
+                'entries': entries}
+
+    try:
+        if not os.path.isdir(os.path.dirname(manifest_path)):
+            os.makedirs(os.path.dirname(manifest_path))
+
+        # Write to a temporary file first so that other instances sharing
+        # the cache directory never read a partially written manifest.
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(manifest_path), suffix='.tmp')
+        with os.fdopen(fd, 'w') as manifest_file:
+            json.dump(manifest, manifest_file)
+        os.rename(tmp_path, manifest_path)
+    except (IOError, OSError) as exc:
+        LOG.warning('Could not write upgrade step manifest {0}: {1}'.format(
+            manifest_path, exc))
+
+
+def get_directory_stats(directory, upgrade_paths):
+    """Returns the modification times and sizes of the upgrade step
+    ``directory``, its subdirectories and the passed upgrade.py files.
+    Subdirectories without an upgrade.py are included, since adding an
+    upgrade.py changes the modification time of its directory only.
+    """
+    paths = [directory]
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if os.path.isdir(path):
+            paths.append(path)
+    paths.extend(upgrade_paths)
+    return dict((os.path.abspath(path), _get_stats(path)) for path in paths)
+
+
+def get_manifest_path(directory):
+    """Returns the path to the manifest of the upgrade step ``directory``
+    or None when no cache directory is configured.
+    """
+    cache_directory = os.environ.get(MANIFEST_DIRECTORY_KEY, None)
+    if not cache_directory:
+        return None
+
+    digest = sha1(os.path.abspath(directory).encode('utf-8')).hexdigest()
+    return os.path.join(cache_directory, 'upgrades-{0}.json'.format(digest))
+
+
+def _get_stats(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_mtime, stat.st_size]
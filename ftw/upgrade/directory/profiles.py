@@ -0,0 +1,40 @@
+import re
+
+
+# The ids of the Generic Setup profiles registered for each upgrade step of
+# an upgrade step directory ("<profile>-upgrade-<version>").
+# There is one of those profiles per upgrade step, which adds up to thousands
+# of profiles in large installations. They are only needed when the upgrade
+# step itself runs, thus they are kept out of the dependency graph and the
+# upgrade listing.
+_upgrade_step_profiles = set()
+
+
+def register_upgrade_step_profile(profile_id):
+    """Marks the profile ``profile_id`` as upgrade step profile.
+    """
+    _upgrade_step_profiles.add(_normalize(profile_id))
+
+
+def is_upgrade_step_profile(profile_id):
+    """Returns whether the profile is a profile of an upgrade step of an
+    upgrade step directory.
+    """
+    return _normalize(profile_id) in _upgrade_step_profiles
+
+
+def clear_upgrade_step_profiles():
+    _upgrade_step_profiles.clear()
+
+
+def _normalize(profile_id):
+    return re.sub('^profile-', '', profile_id)
+
+
+try:
+    from zope.testing.cleanup import addCleanUp
+except ImportError:
+    pass
+else:
+    addCleanUp(clear_upgrade_step_profiles)
+    del addCleanUp
@@ -1,5 +1,6 @@
 from BTrees.OOBTree import OOBTree
 from ftw.upgrade.interfaces import IUpgradeStepRecorder
+from ftw.upgrade.snapshot import invalidate_upgrade_snapshot
 from Products.CMFPlone.interfaces import IPloneSiteRoot
 from zope.annotation import IAnnotations
 from zope.component import adapts
@@ -24,12 +25,24 @@ class UpgradeStepRecorder(object):
         storage = self._get_profile_storage()
         return storage and bool(storage.get(target_version, False))
 
+    def get_installed_versions(self):
+        """Returns a set of the target versions of all upgrade steps marked
+        as installed, reading the storage only once.
+        """
+        storage = self._get_profile_storage()
+        if not storage:
+            return frozenset()
+        return frozenset(version for (version, installed) in storage.items()
+                         if installed)
+
     def mark_as_installed(self, target_version):
         storage = self._get_profile_storage(create=True)
         storage[target_version] = True
+        invalidate_upgrade_snapshot()
 
     def clear(self):
         self._get_profile_storage(create=True).clear()
+        invalidate_upgrade_snapshot()
 
     def _get_profile_storage(self, create=False):
         annotations = IAnnotations(self.portal)
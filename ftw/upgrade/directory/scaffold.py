@@ -18,6 +18,7 @@ class {classname}(UpgradeStep):
 '''
 
 DATETIME_FORMAT = '%Y%m%d%H%M%S'
+UPGRADESTEP_DATETIME_REGEX = re.compile(r'^.*/?(\d{14})[^/]*/upgrade.py$')
 
 
 class UpgradeStepCreator(object):
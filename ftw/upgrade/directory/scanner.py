@@ -1,4 +1,8 @@
 from ftw.upgrade import UpgradeStep
+from ftw.upgrade.directory.manifest import get_directory_stats
+from ftw.upgrade.directory.manifest import read_manifest
+from ftw.upgrade.directory.manifest import write_manifest
+from ftw.upgrade.directory.scaffold import UPGRADESTEP_DATETIME_REGEX
 from ftw.upgrade.exceptions import UpgradeStepDefinitionError
 from ftw.upgrade.utils import subject_from_docstring
 from functools import reduce
@@ -6,10 +10,11 @@ from glob import glob
 from Products.GenericSetup.upgrade import normalize_version
 from six.moves import filter
 from six.moves import map
+from zope.interface import implementedBy
 
+import ast
 import inspect
 import os.path
-import re
 import six
 
 if six.PY2:
@@ -18,7 +23,59 @@ else:
     import importlib
 
 
-UPGRADESTEP_DATETIME_REGEX = re.compile(r'^.*/?(\d{14})[^/]*/upgrade.py$')
+# Statements of an upgrade.py module which do not need to be executed for
+# finding the upgrade step class. Modules with other top level statements
+# (e.g. function calls such as ``classImplements``) are imported when
+# scanning, since they may change the upgrade step class.
+STATIC_STATEMENTS = (ast.Import, ast.ImportFrom, ast.ClassDef,
+                     ast.FunctionDef, ast.Assign, ast.Pass)
+
+
+class LazyUpgradeStepClass(object):
+    """Refers to the upgrade step class of an upgrade.py module without
+    importing the module.
+    The module is imported and validated when the upgrade step is executed
+    for the first time or when an attribute of the class is accessed which
+    is not known from scanning the code.
+    """
+
+    def __init__(self, loader, upgrade_path, name, deferrable=None):
+        self.loader = loader
+        self.upgrade_path = upgrade_path
+        self.__name__ = name
+        if deferrable is not None:
+            self.deferrable = deferrable
+        self._class = None
+
+    @property
+    def implemented(self):
+        """The interfaces implemented by the upgrade step class.
+        The scanner only refers lazily to classes which directly subclass
+        UpgradeStep and do not declare interfaces, thus they implement the
+        interfaces of UpgradeStep until they are loaded.
+        """
+        if self._class is None:
+            return implementedBy(UpgradeStep)
+        return implementedBy(self._class)
+
+    def load(self):
+        """Imports the upgrade.py module and returns the upgrade step class.
+        """
+        if self._class is None:
+            _title, self._class = self.loader(self.upgrade_path)
+        return self._class
+
+    def __call__(self, *args, **kwargs):
+        return self.load()(*args, **kwargs)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.load(), name)
+
+    def __repr__(self):
+        return '<{0} {1} of {2}>'.format(
+            type(self).__name__, self.__name__, self.upgrade_path)
 
 
 class Scanner(object):
@@ -27,25 +84,44 @@ class Scanner(object):
         self.dottedname = dottedname
         self.directory = directory
 
-    def scan(self):
+    def scan(self, entries=None):
+        """Returns the upgrade step infos of the directory.
+        The ``entries`` may be collected beforehand with ``collect``.
+        """
         if six.PY2:
             self._load_upgrades_directory()
-        infos = list(map(self._build_upgrade_step_info,
-                         self._find_upgrade_directories()))
+            infos = list(map(self._build_upgrade_step_info,
+                             self._find_upgrade_directories()))
+        else:
+            if entries is None:
+                entries = self.collect()
+            infos = list(map(self._build_upgrade_step_info_from_entry,
+                             entries))
         infos.sort(key=lambda info: normalize_version(info['target-version']))
         if len(infos) > 0:
             reduce(self._chain_upgrade_steps, infos)
         return infos
 
+    def collect(self):
+        """Collects the upgrade steps of the directory without importing
+        upgrade step code.
+        The upgrade steps are read from the manifest when the directory did
+        not change since the manifest was written.
+        """
+        entries = read_manifest(self.directory)
+        if entries is None:
+            paths = self._find_upgrade_directories()
+            stats = get_directory_stats(self.directory, paths)
+            entries = list(map(self._scan_upgrade_step_code, paths))
+            write_manifest(self.directory, stats, entries)
+        return entries
+
     def _find_upgrade_directories(self):
         return list(filter(UPGRADESTEP_DATETIME_REGEX.match,
                            glob('{0}/*/upgrade.py'.format(self.directory))))
 
     def _build_upgrade_step_info(self, path):
-        if six.PY2:
-            title, callable = self._load_upgrade_step_code_py27(path)
-        else:
-            title, callable = self._load_upgrade_step_code(path)
+        title, callable = self._load_upgrade_step_code_py27(path)
         return {'source-version': None,
                 'target-version':
                     UPGRADESTEP_DATETIME_REGEX.match(path).group(1),
@@ -53,6 +129,22 @@ class Scanner(object):
                 'title': title,
                 'callable': callable}
 
+    def _build_upgrade_step_info_from_entry(self, entry):
+        if entry['class'] is None:
+            title, callable = self._load_upgrade_step_code(
+                entry['upgrade-path'])
+        else:
+            title = entry['title']
+            callable = LazyUpgradeStepClass(
+                self._load_upgrade_step_code, entry['upgrade-path'],
+                entry['class'], deferrable=entry['deferrable'])
+
+        return {'source-version': None,
+                'target-version': entry['target-version'],
+                'path': os.path.dirname(entry['upgrade-path']),
+                'title': title,
+                'callable': callable}
+
     def _chain_upgrade_steps(self, first, second):
         second['source-version'] = first['target-version']
         return second
@@ -101,6 +193,113 @@ class Scanner(object):
             title = six.ensure_text(title)
             yield (title, value)
 
+    def _scan_upgrade_step_code(self, upgrade_path):
+        """Finds the upgrade step class and its title in the syntax tree of
+        the upgrade.py module, so that the module is only imported when the
+        upgrade step is executed.
+        When the class cannot be determined statically, the "class" of the
+        entry is None and the module is imported when building the upgrade
+        step info.
+        """
+        entry = {'target-version':
+                     UPGRADESTEP_DATETIME_REGEX.match(upgrade_path).group(1),
+                 'upgrade-path': upgrade_path,
+                 'title': None,
+                 'class': None,
+                 'deferrable': None}
+
+        with open(upgrade_path, 'rb') as upgrade_file:
+            source = upgrade_file.read()
+
+        try:
+            tree = ast.parse(source, upgrade_path)
+        except SyntaxError:
+            return entry
+
+        node = self._find_upgrade_step_class_node(tree, upgrade_path)
+        if node is None:
+            return entry
+
+        title = subject_from_docstring(ast.get_docstring(node) or node.name)
+        entry.update({'title': six.ensure_text(title),
+                      'class': node.name,
+                      'deferrable': self._get_static_deferrable(node)})
+        return entry
+
+    def _find_upgrade_step_class_node(self, tree, upgrade_path):
+        """Returns the node of the upgrade step class when the module can
+        be validated statically: it must define exactly one upgrade step
+        class, which directly subclasses the UpgradeStep of ftw.upgrade.
+        Returns None when the module needs to be imported for finding and
+        validating the upgrade step class.
+        """
+        if not _is_static(tree.body):
+            return None
+
+        names = set(['UpgradeStep'])
+        classes = set(['object'])
+        nodes = []
+        undecidable = False
+        for node in tree.body:
+            if not isinstance(node, ast.ClassDef):
+                continue
+            bases = set(map(_get_base_name, node.bases))
+            if names.intersection(bases):
+                names.add(node.name)
+                nodes.append(node)
+            elif not bases.issubset(classes):
+                # Bases which are not defined in the module may be
+                # upgrade step classes.
+                undecidable = True
+            classes.add(node.name)
+
+        if len(nodes) > 1:
+            raise UpgradeStepDefinitionError(
+                'The upgrade step file {0} has more than one upgrade class.'.format(  # noqa: E501
+                    upgrade_path
+                )
+            )
+
+        if len(nodes) == 0 or undecidable:
+            return None
+
+        node, = nodes
+        if node.decorator_list or getattr(node, 'keywords', None) \
+           or len(node.bases) != 1 or not isinstance(node.bases[0], ast.Name) \
+           or node.bases[0].id != 'UpgradeStep' \
+           or not _is_static(node.body) \
+           or _declares_special_attributes(node.body):
+            return None
+
+        # Neither the class nor its base may be rebound, and the base must
+        # be the UpgradeStep of ftw.upgrade.
+        bound_names = list(_get_bound_names(tree.body))
+        if bound_names.count(node.name) != 1 \
+           or bound_names.count('UpgradeStep') != 1 \
+           or not _imports_upgrade_step(tree.body):
+            return None
+
+        return node
+
+    def _get_static_deferrable(self, node):
+        """Returns the "deferrable" flag of the upgrade step class node.
+        None is returned when the flag is not a literal, so that it is
+        looked up on the class.
+        """
+        for statement in node.body:
+            if not isinstance(statement, ast.Assign):
+                continue
+            targets = [target.id for target in statement.targets
+                       if isinstance(target, ast.Name)]
+            if 'deferrable' not in targets:
+                continue
+            try:
+                return bool(ast.literal_eval(statement.value))
+            except ValueError:
+                return None
+
+        return UpgradeStep.deferrable
+
     def _load_upgrade_step_code(self, upgrade_path):
         spec = importlib.util.spec_from_file_location(".", upgrade_path)
         module = importlib.util.module_from_spec(spec)
@@ -145,3 +344,67 @@ class Scanner(object):
             pass
         else:
             imp.load_module(self.dottedname, fp, str(pathname), description)
+
+
+def _is_static(statements):
+    for statement in statements:
+        if isinstance(statement, ast.Expr) and _is_string(statement.value):
+            # docstring
+            continue
+        if not isinstance(statement, STATIC_STATEMENTS):
+            return False
+    return True
+
+
+def _get_bound_names(statements):
+    """Yields the names bound by the statements, once for each binding.
+    """
+    for statement in statements:
+        if isinstance(statement, (ast.ClassDef, ast.FunctionDef)):
+            yield statement.name
+        elif isinstance(statement, (ast.Import, ast.ImportFrom)):
+            for alias in statement.names:
+                yield (alias.asname or alias.name).split('.')[0]
+        elif isinstance(statement, ast.Assign):
+            for target in statement.targets:
+                for node in ast.walk(target):
+                    if isinstance(node, ast.Name):
+                        yield node.id
+
+
+def _imports_upgrade_step(statements):
+    for statement in statements:
+        if not isinstance(statement, ast.ImportFrom) \
+           or statement.module not in ('ftw.upgrade', 'ftw.upgrade.step'):
+            continue
+        for alias in statement.names:
+            if alias.name == 'UpgradeStep' and alias.asname is None:
+                return True
+    return False
+
+
+def _declares_special_attributes(statements):
+    """Returns whether the class body assigns special attributes, such as
+    ``__implemented__``, which change the class when it is created.
+    """
+    assignments = [statement for statement in statements
+                   if isinstance(statement, ast.Assign)]
+    for name in _get_bound_names(assignments):
+        if name.startswith('__') and name.endswith('__'):
+            return True
+    return False
+
+
+def _is_string(node):
+    try:
+        return isinstance(ast.literal_eval(node), six.string_types)
+    except ValueError:
+        return False
+
+
+def _get_base_name(node):
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        return node.attr
+    return None
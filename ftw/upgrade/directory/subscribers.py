@@ -1,4 +1,5 @@
 from contextlib import contextmanager
+from ftw.upgrade.directory.profiles import is_upgrade_step_profile
 from ftw.upgrade.gatherer import flatten_upgrades
 from ftw.upgrade.interfaces import IUpgradeStepRecorder
 from functools import partial
@@ -46,6 +47,10 @@ def profile_installed(event):
     if profile in disabled_for_profiles or ALL_FLAG in disabled_for_profiles:
         return
 
+    if is_upgrade_step_profile(profile):
+        # Upgrade step profiles have no upgrade steps to mark.
+        return
+
     portal = getToolByName(event.tool, 'portal_url').getPortalObject()
     recorder = getMultiAdapter((portal, profile), IUpgradeStepRecorder)
 
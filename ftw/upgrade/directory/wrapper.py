@@ -1,3 +1,4 @@
+from ftw.upgrade.directory.scanner import LazyUpgradeStepClass
 from ftw.upgrade.interfaces import IRecordableHandler
 from ftw.upgrade.interfaces import IUpgradeStepRecorder
 from Products.CMFCore.utils import getToolByName
@@ -18,6 +19,9 @@ def wrap_upgrade_step(handler, upgrade_profile, base_profile, target_version):
         recorder.mark_as_installed(target_version)
         return result
     alsoProvides(upgrade_step_wrapper, IRecordableHandler)
-    alsoProvides(upgrade_step_wrapper, implementedBy(handler))
+    if isinstance(handler, LazyUpgradeStepClass):
+        alsoProvides(upgrade_step_wrapper, handler.implemented)
+    else:
+        alsoProvides(upgrade_step_wrapper, implementedBy(handler))
     upgrade_step_wrapper.handler = handler
     return upgrade_step_wrapper
@@ -1,3 +1,4 @@
+from ftw.upgrade.directory.profiles import register_upgrade_step_profile
 from ftw.upgrade.directory.scanner import Scanner
 from ftw.upgrade.directory.wrapper import wrap_upgrade_step
 from ftw.upgrade.exceptions import UpgradeStepConfigurationError
@@ -101,6 +102,8 @@ def upgrade_step_directory_action(profile, dottedname, path,
             product=dottedname,
             profile_type=EXTENSION,
             for_=IMigratingPloneSiteRoot)
+        register_upgrade_step_profile(
+            '{0}:{1}'.format(dottedname, upgrade_profile_name))
 
         last_version = upgrade_info['target-version']
 
@@ -0,0 +1,131 @@
+from BTrees.OOBTree import OOBTree
+from datetime import datetime
+from Products.CMFCore.utils import getToolByName
+from zope.annotation import IAnnotations
+
+
+ANNOTATION_KEY = 'ftw.upgrade:durations'
+
+# Amount of measurements kept per upgrade and site fingerprint.
+MAX_MEASUREMENTS = 5
+
+# Measurements which differ less than this ratio from the expected duration
+# are not stored, since they would not change the prediction.
+DURATION_TOLERANCE = 0.1
+
+
+class UpgradeDurationHistory(object):
+    """Stores how long upgrades took on a Plone site and how many objects
+    they processed, so that the duration of proposed upgrades can be
+    predicted.
+
+    The measurements are stored in an annotation of the Plone site, keyed
+    by the upgrade API id and a fingerprint of the site, so that
+    measurements taken on a site of a different size (e.g. when the
+    database was copied from another site) are preferred less.
+    """
+
+    def __init__(self, portal):
+        self.portal = portal
+        self._fingerprint = None
+
+    def record(self, api_id, duration, objects=None):
+        """Records that the upgrade ``api_id`` took ``duration`` seconds and
+        processed ``objects`` objects.
+        The measurement is not stored when the duration matches the
+        expected duration of this site (see ``DURATION_TOLERANCE``), so that
+        the upgrade transaction is not changed for nothing.
+        Returns whether the measurement was stored.
+        """
+        storage = self._get_storage()
+        measurements = ()
+        if storage is not None and api_id in storage:
+            measurements = storage[api_id].get(self.fingerprint, ())
+
+        expected = get_median([item['duration'] for item in measurements])
+        if expected is not None \
+           and abs(duration - expected) <= expected * DURATION_TOLERANCE:
+            return False
+
+        storage = self._get_storage(create=True)
+        if api_id not in storage:
+            storage[api_id] = OOBTree()
+
+        measurement = {'duration': float(duration),
+                       'objects': objects,
+                       'date': datetime.now().isoformat()}
+        storage[api_id][self.fingerprint] = (
+            measurements + (measurement,))[-MAX_MEASUREMENTS:]
+        return True
+
+    def get_measurements(self, api_id):
+        """Returns the measurements of the upgrade ``api_id``, oldest first.
+        The measurements of the current site fingerprint are returned when
+        there are any, otherwise the measurements of all fingerprints.
+        """
+        storage = self._get_storage()
+        if not storage or api_id not in storage:
+            return ()
+
+        by_fingerprint = storage[api_id]
+        if self.fingerprint in by_fingerprint:
+            return by_fingerprint[self.fingerprint]
+
+        return tuple(sorted(
+            (measurement for measurements in by_fingerprint.values()
+             for measurement in measurements),
+            key=lambda measurement: measurement['date']))
+
+    def get_expected_duration(self, api_id):
+        """Returns the expected duration of the upgrade ``api_id`` in
+        seconds, which is the median of the measured durations, or None
+        when the upgrade was never measured.
+        """
+        return get_median([measurement['duration'] for measurement
+                           in self.get_measurements(api_id)])
+
+    def estimate(self, api_ids):
+        """Returns a tuple of the summed expected duration of the upgrades
+        ``api_ids`` in seconds and the list of the api ids without any
+        measurements.
+        """
+        total = 0
+        unknown = []
+        for api_id in api_ids:
+            duration = self.get_expected_duration(api_id)
+            if duration is None:
+                unknown.append(api_id)
+            else:
+                total += duration
+        return total, unknown
+
+    @property
+    def fingerprint(self):
+        """The fingerprint consists of the path of the site and the order
+        of magnitude of the amount of cataloged objects.
+        """
+        if self._fingerprint is None:
+            catalog = getToolByName(self.portal, 'portal_catalog')
+            self._fingerprint = u'{0}:{1}'.format(
+                u'/'.join(self.portal.getPhysicalPath()),
+                len(str(len(catalog))))
+        return self._fingerprint
+
+    def _get_storage(self, create=False):
+        annotations = IAnnotations(self.portal)
+        if ANNOTATION_KEY not in annotations and create:
+            annotations[ANNOTATION_KEY] = OOBTree()
+        return annotations.get(ANNOTATION_KEY, None)
+
+
+def get_median(values):
+    """Returns the median of the values or None when there are no values.
+    """
+    values = sorted(values)
+    if not values:
+        return None
+
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
@@ -1,15 +1,23 @@
 from AccessControl.SecurityInfo import ClassSecurityInformation
 from distutils.version import LooseVersion
+from ftw.upgrade.deferred import DeferredReindexing
+from ftw.upgrade.durations import UpgradeDurationHistory
+from ftw.upgrade.gatherer import get_api_id
 from ftw.upgrade.indexing import processQueue
 from ftw.upgrade.interfaces import IDuringUpgrade
 from ftw.upgrade.interfaces import IExecutioner
 from ftw.upgrade.interfaces import IPostUpgrade
 from ftw.upgrade.interfaces import IUpgradeInformationGatherer
+from ftw.upgrade.metrics import METRICS_FILENAME
+from ftw.upgrade.metrics import get_profile_stats_path
+from ftw.upgrade.metrics import MetricsWriter
+from ftw.upgrade.metrics import StepMetrics
+from ftw.upgrade.metrics import StepProfiler
 from ftw.upgrade.resource_registries import recook_resources
 from ftw.upgrade.transactionnote import TransactionNote
 from ftw.upgrade.utils import format_duration
 from ftw.upgrade.utils import get_logdir
-from ftw.upgrade.utils import get_sorted_profile_ids
+from ftw.upgrade.utils import get_profile_dependency_graph
 from ftw.upgrade.utils import log_memory_usage
 from ftw.upgrade.utils import optimize_memory_usage
 from Products.CMFCore.utils import getToolByName
@@ -22,7 +30,6 @@ from zope.interface import implementer
 
 import logging
 import os
-import time
 import transaction
 
 try:
@@ -43,17 +50,33 @@ class Executioner(object):
     def __init__(self, portal_setup):
         self.portal_setup = portal_setup
         alsoProvides(portal_setup.REQUEST, IDuringUpgrade)
-        log_dir = get_logdir()
-        if log_dir is None:
-            self.statistics_filename = None
+        self.log_dir = get_logdir()
+        portal = getToolByName(portal_setup, 'portal_url').getPortalObject()
+        self.duration_history = UpgradeDurationHistory(portal)
+        self.deferred_reindexing = DeferredReindexing(portal, logger)
+        if self.log_dir is None:
+            self.metrics_writer = MetricsWriter(None)
         else:
-            self.statistics_filename = os.path.join(log_dir, "upgrade_stats.csv")
+            self.metrics_writer = MetricsWriter(
+                os.path.join(self.log_dir, METRICS_FILENAME))
 
     security.declarePrivate('install')
-    def install(self, data, intermediate_commit=False):
+    def install(self, data, intermediate_commit=False, profiling=False):
         self._register_after_commit_hook()
-        for profileid, upgradeids in data:
-            self._upgrade_profile(profileid, upgradeids, intermediate_commit)
+        if profiling and self.log_dir is None:
+            logger.warning('Profiling is disabled because the log directory'
+                           ' could not be determined.')
+            profiling = False
+
+        self._log_expected_duration(data)
+        try:
+            with self.deferred_reindexing:
+                for profileid, upgradeids in data:
+                    self._upgrade_profile(profileid, upgradeids,
+                                          intermediate_commit,
+                                          profiling=profiling)
+        finally:
+            self.metrics_writer.close()
 
         for adapter in self._get_sorted_post_upgrade_adapters():
             adapter()
@@ -63,16 +86,19 @@ class Executioner(object):
 
         TransactionNote().set_transaction_note()
         recook_resources()
+        self.deferred_reindexing.flush()
         self._process_indexing_queue()
 
     security.declarePrivate('install_upgrades_by_api_ids')
     def install_upgrades_by_api_ids(self, *upgrade_api_ids, **kwargs):
         intermediate_commit = kwargs.pop('intermediate_commit', False)
+        profiling = kwargs.pop('profiling', False)
 
         gatherer = IUpgradeInformationGatherer(self.portal_setup)
         upgrades = gatherer.get_upgrades_by_api_ids(*upgrade_api_ids, **kwargs)
         data = [(upgrade['profile'], [upgrade['id']]) for upgrade in upgrades]
-        return self.install(data, intermediate_commit=intermediate_commit)
+        return self.install(data, intermediate_commit=intermediate_commit,
+                            profiling=profiling)
 
     security.declarePrivate('install_profiles_by_profile_ids')
     def install_profiles_by_profile_ids(self, *profile_ids, **options):
@@ -117,32 +143,79 @@ class Executioner(object):
         processQueue()
 
     security.declarePrivate('_upgrade_profile')
-    def _upgrade_profile(self, profileid, upgradeids, intermediate_commit):
+    def _upgrade_profile(self, profileid, upgradeids, intermediate_commit,
+                         profiling=False):
         last_dest_version = None
 
         for upgradeid in upgradeids:
-            start = time.time()
-            last_dest_version = self._do_upgrade(profileid, upgradeid) \
-                or last_dest_version
-            self._set_portal_setup_version(profileid, last_dest_version)
-
-            if intermediate_commit:
-                TransactionNote().set_transaction_note()
-                self._process_indexing_queue()
-                transaction.commit()
-                self._register_after_commit_hook()
-
-            duration = time.time() - start
+            api_id = self._get_api_id(profileid, upgradeid)
+            metrics = StepMetrics(
+                getattr(self.portal_setup, '_p_jar', None),
+                profile=profileid,
+                upgrade_id=upgradeid,
+                api_id=api_id)
+            try:
+                with metrics:
+                    if profiling:
+                        with StepProfiler(get_profile_stats_path(
+                                self.log_dir, api_id)):
+                            dest_version = self._do_upgrade(profileid,
+                                                            upgradeid)
+                    else:
+                        dest_version = self._do_upgrade(profileid, upgradeid)
+
+                    last_dest_version = dest_version or last_dest_version
+                    self._set_portal_setup_version(profileid,
+                                                   last_dest_version)
+
+                    if intermediate_commit:
+                        TransactionNote().set_transaction_note()
+                        self.deferred_reindexing.flush()
+                        self._process_indexing_queue()
+                        transaction.commit()
+                        self._register_after_commit_hook()
+            finally:
+                if metrics.record is not None:
+                    self.metrics_writer.write(metrics.record)
+                    if intermediate_commit:
+                        self.metrics_writer.flush()
+
             logger.log(logging.INFO, 'Upgrade step duration: %s' % format_duration(
-                duration))
+                metrics.record['wall_time']))
+            self.duration_history.record(api_id,
+                                         metrics.record['wall_time'],
+                                         metrics.record['processed_objects'])
             log_memory_usage(logger)
-            if self.statistics_filename:
-                with open(self.statistics_filename, "a") as stats_file:
-                    stats_file.write("{}, {}, {}\n".format(
-                        profileid, upgradeid, int(duration)))
 
         self._set_quickinstaller_version(profileid)
 
+    security.declarePrivate('_get_api_id')
+    def _get_api_id(self, profileid, upgradeid):
+        step = _upgrade_registry.getUpgradeStep(profileid, upgradeid)
+        if step is None:
+            return '{0}@{1}'.format(upgradeid, profileid)
+        return get_api_id(profileid, step.dest)
+
+    security.declarePrivate('_log_expected_duration')
+    def _log_expected_duration(self, data):
+        api_ids = [self._get_api_id(profileid, upgradeid)
+                   for profileid, upgradeids in data
+                   for upgradeid in upgradeids]
+        if not api_ids:
+            return
+
+        expected, unknown = self.duration_history.estimate(api_ids)
+        if len(unknown) == len(api_ids):
+            # Nothing was measured yet on this site.
+            return
+
+        message = 'Expected duration of %i upgrade steps: %s' % (
+            len(api_ids), format_duration(expected))
+        if unknown:
+            message += ' (%i upgrade steps without measurements)' % (
+                len(unknown))
+        logger.info(message)
+
     security.declarePrivate('_set_quickinstaller_version')
     def _set_quickinstaller_version(self, profileid):
         try:
@@ -195,18 +268,12 @@ class Executioner(object):
         (e.g. "ftw.upgrade:default").
         """
 
-        profile_order = get_sorted_profile_ids(self.portal_setup)
+        graph = get_profile_dependency_graph(self.portal_setup)
+        graph.verify()
 
         portal_url = getToolByName(self.portal_setup, 'portal_url')
         portal = portal_url.getPortalObject()
         adapters = list(getAdapters((portal, portal.REQUEST), IPostUpgrade))
 
-        def sort_key(item):
-            name = item[0]
-            if name not in profile_order:
-                return -1
-            else:
-                return profile_order.index(name)
-
-        adapters.sort(key=sort_key)
+        adapters.sort(key=lambda item: graph.get_rank(item[0]))
         return [adapter for name, adapter in adapters]
@@ -0,0 +1,36 @@
+# This module must not import Zope, since it is used by the "bin/upgrade"
+# command line script as well.
+
+import math
+
+
+def format_duration(seconds):
+    """Makes a duration in seconds human readable.
+    Supports hours, minutes and seconds.
+    """
+
+    seconds = math.ceil(seconds)
+    hours, remainder = divmod(seconds, 60 * 60)
+    minutes, seconds = divmod(remainder, 60)
+
+    result = []
+
+    if hours == 1:
+        result.append('1 hour')
+    elif hours > 1:
+        result.append('%i hours' % hours)
+
+    if minutes == 1:
+        result.append('1 minute')
+    elif minutes > 1:
+        result.append('%i minutes' % minutes)
+
+    if seconds == 1:
+        result.append('1 second')
+    elif seconds > 1:
+        result.append('%i seconds' % seconds)
+
+    if len(result) == 0:
+        return '0 seconds'
+    else:
+        return ', '.join(result)
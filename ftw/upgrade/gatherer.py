@@ -1,26 +1,31 @@
 from AccessControl.SecurityInfo import ClassSecurityInformation
 from datetime import datetime
+from ftw.upgrade.directory.profiles import is_upgrade_step_profile
 from ftw.upgrade.exceptions import UpgradeNotFound
 from ftw.upgrade.interfaces import IRecordableHandler
 from ftw.upgrade.interfaces import IUpgradeInformationGatherer
 from ftw.upgrade.interfaces import IUpgradeStepRecorder
-from ftw.upgrade.utils import get_sorted_profile_ids
-from functools import reduce
+from ftw.upgrade.snapshot import get_installed_products_resolver
+from ftw.upgrade.snapshot import get_upgrade_snapshot
+from ftw.upgrade.utils import get_profile_dependency_graph
 from operator import itemgetter
 from Products.CMFCore.utils import getToolByName
 from Products.GenericSetup.interfaces import ISetupTool
 from Products.GenericSetup.upgrade import normalize_version
 from Products.GenericSetup.upgrade import UpgradeStep
-from six.moves import map
 from zope.component import adapts
 from zope.component import getMultiAdapter
 from zope.deprecation import deprecated
 from zope.interface import implementer
 
-try:
-    from Products.CMFPlone.utils import get_installer
-except ImportError:
-    get_installer = None
+
+def get_api_id(profileid, dest):
+    """Returns the API id of the upgrade step of the profile ``profileid``
+    with the destination version ``dest`` (a version tuple).
+    Upgrade steps without destination version have the destination "all",
+    like the ``sdest`` of Generic Setup.
+    """
+    return '@'.join(('.'.join(dest or ('all',)), profileid))
 
 
 def flatten_upgrades(upgrades):
@@ -98,6 +103,26 @@ def extend_auto_upgrades_with_human_formatted_date_version(profiles):
     return profiles
 
 
+def copy_profiles(profiles, proposed_only=False):
+    """Copies the profile and upgrade information dicts, so that the copies
+    can be modified without changing the memoized originals.
+    When ``proposed_only`` is ``True``, only proposed upgrades are copied and
+    profiles without proposed upgrades are dropped.
+    """
+    result = []
+    for profile in profiles:
+        upgrades = [upgrade.copy() for upgrade in profile['upgrades']
+                    if upgrade['proposed'] or not proposed_only]
+        if not upgrades:
+            continue
+
+        profile = profile.copy()
+        profile['upgrades'] = upgrades
+        result.append(profile)
+
+    return result
+
+
 @implementer(IUpgradeInformationGatherer)
 class UpgradeInformationGatherer(object):
     adapts(ISetupTool)
@@ -109,12 +134,14 @@ class UpgradeInformationGatherer(object):
         self.portal = getToolByName(
             portal_setup, 'portal_url').getPortalObject()
         self.cyclic_dependencies = False
+        self._installed_versions = {}
 
     security.declarePrivate('get_profiles')
     def get_profiles(self, proposed_only=False, propose_deferrable=True):
-        profiles = self._sort_profiles_by_dependencies(
-            self._get_profiles(proposed_only=proposed_only,
-                               propose_deferrable=propose_deferrable))
+        profiles = copy_profiles(
+            self._get_snapshot_profiles(propose_deferrable=propose_deferrable,
+                                        snapshot=self._get_snapshot()),
+            proposed_only=proposed_only)
         profiles = flag_profiles_with_outdated_fs_version(profiles)
         profiles = extend_auto_upgrades_with_human_formatted_date_version(
             profiles)
@@ -127,37 +154,131 @@ class UpgradeInformationGatherer(object):
     security.declarePrivate('get_upgrades_by_api_ids')
     def get_upgrades_by_api_ids(self, *api_ids, **kwargs):
         propose_deferrable = kwargs.pop('propose_deferrable', True)
-        upgrades = [
-            upgrade for upgrade
-            in reduce(list.__add__, map(itemgetter('upgrades'),
-                      self.get_profiles(propose_deferrable=propose_deferrable)))
-            if upgrade['api_id'] in api_ids
+        snapshot = self._get_snapshot()
+        graph = get_profile_dependency_graph(self.portal_setup, snapshot)
+        graph.verify()
+
+        # The API id contains the profile id ("<dest>@<profile id>"), thus
+        # only the profiles of the requested upgrades need to be gathered.
+        requested = set(api_ids)
+        found = {}
+        for profileid in set(api_id.split('@', 1)[-1] for api_id in requested):
+            index = self._get_api_id_index(profileid,
+                                           propose_deferrable=propose_deferrable,
+                                           snapshot=snapshot)
+            for api_id in requested & set(index):
+                found[api_id] = index[api_id]
+
+        missing_api_ids = [api_id for api_id in api_ids if api_id not in found]
+        if missing_api_ids:
+            raise UpgradeNotFound(missing_api_ids[0])
+
+        return [
+            upgrade.copy() for (_rank, _position, upgrade)
+            in sorted(found.values(), key=itemgetter(0, 1))
         ]
 
-        missing_api_ids = (set(api_ids)
-                           - set(map(itemgetter('api_id'), upgrades)))
-        if missing_api_ids:
-            raise UpgradeNotFound(tuple(missing_api_ids)[0])
-        return upgrades
+    security.declarePrivate('_get_api_id_index')
+    def _get_api_id_index(self, profileid, propose_deferrable=True,
+                          snapshot=None):
+        """Returns an index of the upgrades of a profile by API id, memoized
+        in the upgrade snapshot.
+        The values are tuples of the profile rank, the position of the
+        upgrade in the profile and the upgrade information.
+        """
+        snapshot = snapshot or self._get_snapshot()
+
+        def build_index():
+            data = self._get_listed_profile_data(
+                profileid, propose_deferrable=propose_deferrable,
+                snapshot=snapshot)
+            if data is None:
+                return {}
+
+            profiles = extend_auto_upgrades_with_human_formatted_date_version(
+                flag_profiles_with_outdated_fs_version(copy_profiles([data])))
+            rank = get_profile_dependency_graph(
+                self.portal_setup, snapshot).get_rank(profileid)
+            return dict(
+                (upgrade['api_id'], (rank, position, upgrade))
+                for (position, upgrade) in enumerate(profiles[0]['upgrades']))
+
+        return snapshot.get(
+            ('api-ids', profileid, bool(propose_deferrable)), build_index)
+
+    security.declarePrivate('_get_snapshot')
+    def _get_snapshot(self):
+        """Returns the upgrade snapshot of the current transaction.
+        Looking up the snapshot verifies its fingerprint, which lists the
+        registered profiles. Therefore the snapshot is looked up once per
+        gathering and passed down.
+        """
+        return get_upgrade_snapshot(self.portal_setup)
+
+    security.declarePrivate('_get_snapshot_profiles')
+    def _get_snapshot_profiles(self, propose_deferrable=True, snapshot=None):
+        """Returns all profiles sorted by dependencies, memoized in the
+        upgrade snapshot of the current transaction.
+        The returned data must not be modified.
+        """
+        snapshot = snapshot or self._get_snapshot()
+        return snapshot.get(
+            ('profiles', bool(propose_deferrable)),
+            lambda: self._sort_profiles_by_dependencies(
+                self._get_profiles(propose_deferrable=propose_deferrable,
+                                   snapshot=snapshot),
+                snapshot=snapshot))
 
     security.declarePrivate('_get_profiles')
-    def _get_profiles(self, proposed_only=False, propose_deferrable=True):
+    def _get_profiles(self, proposed_only=False, propose_deferrable=True,
+                      snapshot=None):
+        snapshot = snapshot or self._get_snapshot()
         for profileid in self.portal_setup.listProfilesWithUpgrades():
-            if not self._is_profile_installed(profileid):
+            data = self._get_listed_profile_data(
+                profileid, propose_deferrable=propose_deferrable,
+                snapshot=snapshot)
+            if data is None:
                 continue
 
-            data = self._get_profile_data(profileid,
-                                          proposed_only=proposed_only,
-                                          propose_deferrable=propose_deferrable)
-            if len(data['upgrades']) == 0:
-                continue
+            if proposed_only:
+                profiles = copy_profiles([data], proposed_only=True)
+                if not profiles:
+                    continue
+                data = profiles[0]
+
+            yield data
+
+    security.declarePrivate('_get_listed_profile_data')
+    def _get_listed_profile_data(self, profileid, propose_deferrable=True,
+                                 snapshot=None):
+        """Returns the profile data of a profile which is listed with its
+        upgrades, memoized in the upgrade snapshot.
+        Returns None for profiles which are not listed.
+        The returned data must not be modified.
+        """
+        snapshot = snapshot or self._get_snapshot()
+
+        def get_data():
+            if is_upgrade_step_profile(profileid):
+                return None
 
             if profileid == 'Products.CMFPlone:plone':
                 # Plone has its own migration mechanism.
                 # We do not support upgrading plone.
-                continue
+                return None
 
-            yield data
+            if not self._is_profile_installed(profileid, snapshot=snapshot):
+                return None
+
+            data = self._get_profile_data(
+                profileid, propose_deferrable=propose_deferrable)
+            if len(data['upgrades']) == 0:
+                return None
+
+            return data
+
+        return snapshot.get(
+            ('profile', profileid, bool(propose_deferrable)), get_data)
 
     security.declarePrivate('_get_profile_data')
     def _get_profile_data(self, profileid,
@@ -194,20 +315,15 @@ class UpgradeInformationGatherer(object):
     def _get_profile_upgrades(self, profileid,
                               proposed_only=False,
                               propose_deferrable=True):
-        proposed_ids = set()
         upgrades = []
+        db_version = self.portal_setup.getLastVersionForProfile(profileid)
+        self._installed_versions.pop(profileid, None)
 
-        proposed_upgrades = list(flatten_upgrades(
-                self.portal_setup.listUpgrades(profileid)))
-        all_upgrades = list(flatten_upgrades(
-                self.portal_setup.listUpgrades(profileid, show_old=True)))
-
-        for upgrade in proposed_upgrades:
-            proposed_ids.add(upgrade['id'])
-
-        for upgrade in all_upgrades:
-            upgrade = upgrade.copy()
-            if upgrade['id'] not in proposed_ids:
+        # listUpgrades builds new dicts on each call, thus the upgrade infos
+        # can be modified in place.
+        for upgrade in flatten_upgrades(
+                self.portal_setup.listUpgrades(profileid, show_old=True)):
+            if not self._is_listed_for_version(upgrade, db_version):
                 upgrade['proposed'] = False
                 upgrade['done'] = True
 
@@ -228,7 +344,7 @@ class UpgradeInformationGatherer(object):
                 del upgrade['step']
 
             upgrade['profile'] = profileid
-            upgrade['api_id'] = '@'.join((upgrade['sdest'], profileid))
+            upgrade['api_id'] = get_api_id(profileid, upgrade['dest'])
 
             if proposed_only and not upgrade['proposed']:
                 continue
@@ -237,39 +353,52 @@ class UpgradeInformationGatherer(object):
 
         return upgrades
 
+    security.declarePrivate('_is_listed_for_version')
+    def _is_listed_for_version(self, upgrade_step_info, version):
+        """Returns whether portal_setup would list the upgrade step when
+        listing the upgrades starting at ``version`` (the installed version
+        of the profile), which is the case when the upgrade is not yet
+        installed.
+        This lets us derive the proposed upgrades from a single listing with
+        all upgrades, following the version matching of Generic Setup.
+        """
+        step = upgrade_step_info['step']
+        if step.checker is None:
+            return step.versionMatch(version)
+
+        # The checker does not depend on the version, thus its result is
+        # already the "proposed" value of the listing with all upgrades.
+        return (upgrade_step_info['proposed']
+                or version is None
+                or (step.source is not None and step.versionMatch(version)))
+
     security.declarePrivate('_is_profile_installed')
-    def _is_profile_installed(self, profileid):
+    def _is_profile_installed(self, profileid, snapshot=None):
         try:
             profileinfo = self.portal_setup.getProfileInfo(profileid)
         except KeyError:
             return False
         product = profileinfo['product']
 
-        if get_installer is not None:
-            quickinstaller = get_installer(self.portal, self.portal.REQUEST)
-
-            if (quickinstaller.is_product_installable(product)
-                    and not quickinstaller.is_product_installed(product)):
-                return False
-        else:
-            quickinstaller = getToolByName(
-                self.portal_setup, 'portal_quickinstaller')
-            if (quickinstaller.isProductInstallable(product)
-                    and not quickinstaller.isProductInstalled(product)):
-                return False
+        resolver = get_installed_products_resolver(self.portal_setup,
+                                                   snapshot=snapshot)
+        if (resolver.is_product_installable(product)
+                and not resolver.is_product_installed(product)):
+            return False
 
         version = self.portal_setup.getLastVersionForProfile(profileid)
         return version != 'unknown'
 
     security.declarePrivate('_sort_profiles_by_dependencies')
-    def _sort_profiles_by_dependencies(self, profiles):
+    def _sort_profiles_by_dependencies(self, profiles, snapshot=None):
         """Sort the profiles so that the profiles are listed after its
         dependencies since it is safer to first install dependencies.
         """
 
-        sorted_profile_ids = get_sorted_profile_ids(self.portal_setup)
+        graph = get_profile_dependency_graph(self.portal_setup, snapshot)
+        graph.verify()
         return sorted(profiles,
-                      key=lambda p: sorted_profile_ids.index(p.get('id')))
+                      key=lambda p: graph.get_rank(p.get('id')))
 
     security.declarePrivate('_is_orphan')
     def _is_orphan(self, profile, upgrade_step_info):
@@ -313,7 +442,27 @@ class UpgradeInformationGatherer(object):
         """
         if not self._is_recordeable(upgrade_step_info):
             return None
-        else:
+
+        installed_versions = self._get_installed_versions(profile)
+        if installed_versions is None:
             recorder = getMultiAdapter((self.portal, profile),
                                        IUpgradeStepRecorder)
             return recorder.is_installed(upgrade_step_info['sdest'])
+        return upgrade_step_info['sdest'] in installed_versions
+
+    security.declarePrivate('_get_installed_versions')
+    def _get_installed_versions(self, profile):
+        """Returns the set of target versions recorded as installed for the
+        profile, loaded once each time the upgrades of the profile are
+        gathered.
+        Returns None when the recorder does not support loading all
+        versions at once.
+        """
+        if profile not in self._installed_versions:
+            recorder = getMultiAdapter((self.portal, profile),
+                                       IUpgradeStepRecorder)
+            get_installed_versions = getattr(
+                recorder, 'get_installed_versions', None)
+            self._installed_versions[profile] = (
+                get_installed_versions and get_installed_versions())
+        return self._installed_versions[profile]
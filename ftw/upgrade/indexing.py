@@ -25,6 +25,7 @@ else:
 
 if HAS_INDEXING:
     from ftw.upgrade.interfaces import IDuringUpgrade
+    from ftw.upgrade.metrics import count_metric
     from ftw.upgrade.progresslogger import ProgressLogger
     from zope.globalrequest import getRequest
 
@@ -47,6 +48,7 @@ if HAS_INDEXING:
                 return
 
             indexing_queue_length = getQueue().length()
+            count_metric('indexing_queue_processed', indexing_queue_length)
             self.logger = ProgressLogger(
                 'Processing indexing queue',
                 indexing_queue_length)
@@ -58,16 +60,19 @@ if HAS_INDEXING:
             pass
 
         def index(self, obj, attributes):
+            count_metric('catalog_index')
             if not self.should_log:
                 return
             self.logger()
 
         def reindex(self, obj, attributes, update_metadata=False):
+            count_metric('catalog_reindex')
             if not self.should_log:
                 return
             self.logger()
 
         def unindex(self, obj):
+            count_metric('catalog_unindex')
             if not self.should_log:
                 return
             self.logger()
@@ -127,6 +127,21 @@ class IUpgradeStep(Interface):
         """Reindex the ``portal_catalog`` index identified by ``name``.
         """
 
+    def catalog_rebuild_indexes(names, logger=None, savepoints=None):
+        """Reindex the ``portal_catalog`` indexes identified by ``names``
+        in a single pass over the cataloged objects.
+        """
+
+    def defer_reindex_object(obj, idxs=None):
+        """Reindexes the indexes ``idxs`` (all indexes by default) of
+        ``obj`` once at the end of the upgrade run.
+        """
+
+    def defer_rebuild_index(name):
+        """Rebuilds the ``portal_catalog`` index ``name`` once at the end
+        of the upgrade run.
+        """
+
     def catalog_has_index(name):
         """Returns whether there is a catalog index ``name``.
         """
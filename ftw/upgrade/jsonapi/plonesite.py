@@ -1,4 +1,5 @@
 from ftw.upgrade.browser.manage import ResponseLogger
+from ftw.upgrade.durations import UpgradeDurationHistory
 from ftw.upgrade.interfaces import IExecutioner
 from ftw.upgrade.interfaces import IUpgradeInformationGatherer
 from ftw.upgrade.jsonapi.base import APIView
@@ -11,7 +12,6 @@ from ftw.upgrade.jsonapi.utils import jsonify
 from ftw.upgrade.jsonapi.utils import parse_bool
 from ftw.upgrade.resource_registries import recook_resources
 from ftw.upgrade.utils import get_portal_migration
-from functools import reduce
 from operator import itemgetter
 from Products.CMFCore.utils import getToolByName
 from six.moves import map
@@ -53,26 +53,35 @@ class PloneSiteAPI(APIView):
         """Returns a list of proposed upgrades.
         """
         propose_deferrable = parse_bool(propose_deferrable)
-        return list(map(
-            self._refine_upgrade_info,
-            self._get_proposed_upgrades(propose_deferrable=propose_deferrable)))
+        history = UpgradeDurationHistory(self.context)
+        upgrades = []
+        for upgrade in self._get_proposed_upgrades(
+                propose_deferrable=propose_deferrable):
+            info = self._refine_upgrade_info(upgrade)
+            info['expected_duration'] = history.get_expected_duration(
+                upgrade['api_id'])
+            upgrades.append(info)
+        return upgrades
 
     @action('POST', rename_params={'upgrades': 'upgrades:list'})
     def execute_upgrades(self, upgrades, allow_outdated=False,
-            intermediate_commit=False):
+            intermediate_commit=False, profiling=False):
         """Executes a list of upgrades, each identified by the upgrade ID
         in the form "[dest-version]@[profile ID]".
         """
         if not allow_outdated:
             self._require_up_to_date_plone_site()
         intermediate_commit = parse_bool(intermediate_commit)
+        profiling = parse_bool(profiling)
         self._validate_upgrade_ids(*upgrades)
         return self._install_upgrades(
-            *upgrades, intermediate_commit=intermediate_commit)
+            *upgrades, intermediate_commit=intermediate_commit,
+            profiling=profiling)
 
     @action('POST', rename_params={'profiles': 'profiles:list'})
     def execute_proposed_upgrades(self, profiles=None, propose_deferrable=True,
-            allow_outdated=False, intermediate_commit=False):
+            allow_outdated=False, intermediate_commit=False,
+            profiling=False):
         """Executes all proposed upgrades.
         """
         if not allow_outdated:
@@ -81,13 +90,15 @@ class PloneSiteAPI(APIView):
             self._validate_profile_ids(*profiles)
         propose_deferrable = parse_bool(propose_deferrable)
         intermediate_commit = parse_bool(intermediate_commit)
+        profiling = parse_bool(profiling)
 
         api_ids = list(map(itemgetter('api_id'), self._get_proposed_upgrades(
             only_profiles=profiles, propose_deferrable=propose_deferrable)))
         return self._install_upgrades(
             *api_ids,
             propose_deferrable=propose_deferrable,
-            intermediate_commit=intermediate_commit)
+            intermediate_commit=intermediate_commit,
+            profiling=profiling)
 
     @action('POST', rename_params={'profiles': 'profiles:list'})
     def execute_profiles(self, profiles, force_reinstall=False,
@@ -179,9 +190,8 @@ class PloneSiteAPI(APIView):
         if only_profiles:
             profiles = [
                 profile for profile in profiles if profile['id'] in only_profiles]
-        if not profiles:
-            return []
-        return reduce(list.__add__, map(itemgetter('upgrades'), profiles))
+        return [upgrade for profile in profiles
+                for upgrade in profile['upgrades']]
 
     def _validate_upgrade_ids(self, *api_ids):
         self.gatherer.get_upgrades_by_api_ids(*api_ids)
@@ -196,6 +206,7 @@ class PloneSiteAPI(APIView):
     def _install_upgrades(self, *api_ids, **kwargs):
         propose_deferrable = kwargs.pop('propose_deferrable', True)
         intermediate_commit = kwargs.pop('intermediate_commit', False)
+        profiling = kwargs.pop('profiling', False)
 
         executioner = IExecutioner(self.portal_setup)
         try:
@@ -203,7 +214,8 @@ class PloneSiteAPI(APIView):
                 executioner.install_upgrades_by_api_ids(
                     *api_ids,
                     propose_deferrable=propose_deferrable,
-                    intermediate_commit=intermediate_commit
+                    intermediate_commit=intermediate_commit,
+                    profiling=profiling
                     )
         except Exception as exc:
             raise AbortTransactionWithStreamedResponse(exc)
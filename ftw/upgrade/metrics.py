@@ -0,0 +1,240 @@
+from datetime import datetime
+
+import cProfile
+import json
+import logging
+import os
+import psutil
+import re
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows.
+    resource = None
+
+
+METRICS_FILENAME = 'upgrade_metrics.jsonl'
+
+LOG = logging.getLogger('ftw.upgrade')
+
+_active = threading.local()
+
+
+class StepMetrics(object):
+    """Collects the metrics of executing one upgrade step:
+
+    - ``wall_time`` and ``cpu_time`` (of the executing thread, when supported)
+      in seconds
+    - ``rss_before``, ``rss_after`` and ``rss_peak`` in bytes; the peak is
+      the peak of the process when it was reached while executing the step,
+      otherwise the highest RSS measured at the savepoints
+    - ``zodb_loads`` and ``zodb_stores`` of the ZODB connection
+    - ``bytes_written`` by the process (None when not supported)
+    - counters reported with ``count_metric``, such as ``savepoints``,
+      ``catalog_index``, ``catalog_reindex``, ``catalog_unindex``,
+      ``catalog_rebuild_index``, ``indexing_queue_processed`` and
+      ``processed_objects`` (objects and brains iterated with the
+      ``objects`` and ``brains`` helpers of upgrade steps); the catalog
+      counters include the indexing queue and the direct catalog writes
+      of the reindexing helpers of ``ftw.upgrade``
+
+    While the metrics are collected, they are registered as the active
+    metrics of the current thread, so that the counters can be reported
+    from anywhere.
+    """
+
+    def __init__(self, connection=None, **info):
+        self.connection = connection
+        self.info = info
+        self.counters = {'savepoints': 0,
+                         'catalog_index': 0,
+                         'catalog_reindex': 0,
+                         'catalog_unindex': 0,
+                         'catalog_rebuild_index': 0,
+                         'indexing_queue_processed': 0,
+                         'processed_objects': 0}
+        self.record = None
+        self._previous = None
+
+    def __enter__(self):
+        self._previous = get_active_metrics()
+        _active.metrics = self
+        self._process = psutil.Process()
+        self._started = datetime.now()
+        self._start_wall = time.time()
+        self._start_cpu = _get_cpu_time(self._process)
+        self._start_transfer = _get_transfer_counts(self.connection)
+        self._start_written = _get_bytes_written(self._process)
+        self._start_maxrss = _get_max_rss()
+        self.rss_before = self._process.memory_info().rss
+        self._rss_samples = [self.rss_before]
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _active.metrics = self._previous
+        rss_after = self._process.memory_info().rss
+        self._rss_samples.append(rss_after)
+
+        loads, stores = _get_transfer_counts(self.connection)
+        start_loads, start_stores = self._start_transfer
+        written = _get_bytes_written(self._process)
+
+        record = dict(self.info)
+        record.update({
+            'started': self._started.isoformat(),
+            'wall_time': time.time() - self._start_wall,
+            'cpu_time': _get_cpu_time(self._process) - self._start_cpu,
+            'rss_before': self.rss_before,
+            'rss_after': rss_after,
+            'rss_peak': self._get_rss_peak(),
+            'zodb_loads': _get_difference(start_loads, loads),
+            'zodb_stores': _get_difference(start_stores, stores),
+            'bytes_written': _get_difference(self._start_written, written),
+            'failed': exc_type is not None,
+        })
+        record.update(self.counters)
+        self.record = record
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def sample_memory_usage(self):
+        self._rss_samples.append(self._process.memory_info().rss)
+
+    def _get_rss_peak(self):
+        max_rss = _get_max_rss()
+        if max_rss is not None and self._start_maxrss is not None \
+           and max_rss > self._start_maxrss:
+            return max_rss
+        return max(self._rss_samples)
+
+
+class MetricsWriter(object):
+    """Writes metrics records as JSON lines to a file.
+    The file is opened once and the records are buffered until ``flush``
+    or ``close`` is called.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def write(self, record):
+        if self.path is None:
+            return
+        if self._file is None:
+            self._file = open(self.path, 'a')
+        self._file.write(json.dumps(record, sort_keys=True) + '\n')
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class StepProfiler(object):
+    """Profiles the code executed in the context with ``cProfile`` and
+    dumps the stats to ``path``, which can be inspected with ``pstats``
+    or tools such as ``snakeviz``.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.profile = None
+
+    def __enter__(self):
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profile.disable()
+        try:
+            self.profile.dump_stats(self.path)
+        except (IOError, OSError) as exc:
+            LOG.warning('Could not write profile {0}: {1}'.format(
+                self.path, exc))
+        else:
+            LOG.info('Profile written to {0}'.format(self.path))
+
+
+def get_profile_stats_path(directory, api_id):
+    """Returns the path of the profile stats file of the upgrade step
+    ``api_id`` in ``directory``.
+    """
+    name = re.sub(r'[^\w.@-]+', '_', api_id)
+    return os.path.join(directory, 'upgrade-profile-{0}-{1}.pstats'.format(
+        datetime.now().strftime('%Y%m%d%H%M%S'), name))
+
+
+def get_active_metrics():
+    """Returns the ``StepMetrics`` collected in the current thread or None.
+    """
+    return getattr(_active, 'metrics', None)
+
+
+def count_metric(name, amount=1):
+    """Increases the counter ``name`` of the active step metrics, if any.
+    """
+    metrics = get_active_metrics()
+    if metrics is not None:
+        metrics.count(name, amount)
+
+
+def record_savepoint():
+    """Counts a savepoint and samples the memory usage for the active step
+    metrics, if any.
+    """
+    metrics = get_active_metrics()
+    if metrics is not None:
+        metrics.count('savepoints')
+        metrics.sample_memory_usage()
+
+
+def _get_cpu_time(process):
+    thread_time = getattr(time, 'thread_time', None)
+    if thread_time is not None:
+        return thread_time()
+    cpu_times = process.cpu_times()
+    return cpu_times.user + cpu_times.system
+
+
+def _get_transfer_counts(connection):
+    get_transfer_counts = getattr(connection, 'getTransferCounts', None)
+    if get_transfer_counts is None:
+        return None, None
+    return get_transfer_counts()
+
+
+def _get_bytes_written(process):
+    try:
+        return process.io_counters().write_bytes
+    except (AttributeError, NotImplementedError, psutil.Error):
+        return None
+
+
+def _get_max_rss():
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return max_rss
+    # ru_maxrss is in kilobytes on Linux.
+    return max_rss * 1024
+
+
+def _get_difference(start, end):
+    if start is None or end is None:
+        return None
+    if end < start:
+        # The counter was reset in the meantime.
+        return end
+    return end - start
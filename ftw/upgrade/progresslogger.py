@@ -1,19 +1,41 @@
 from AccessControl.SecurityInfo import ClassSecurityInformation
+from collections import deque
+from ftw.upgrade.formatting import format_duration
 from time import time
 
+import heapq
 import logging
 import six
 
 
+# Upper bounds (in seconds) of the buckets of the latency histogram.
+LATENCY_BUCKETS = ((0.001, '<1ms'),
+                   (0.01, '<10ms'),
+                   (0.1, '<100ms'),
+                   (1, '<1s'),
+                   (10, '<10s'))
+LATENCY_OVERFLOW_LABEL = '>=10s'
+
+# The throughput is calculated over the progress of this amount of seconds.
+RATE_WINDOW = 60
+
+
 class ProgressLogger(object):
     """Loggs the proggress of a process to the passed
     logger.
+
+    Besides the progress in percent, the logger reports the throughput
+    (items per second) over a sliding window and the estimated remaining
+    time.
+    When the process took longer than the ``timeout``, the DONE / FAILED
+    message is followed by a histogram of the per-item processing times
+    and the ``slowest`` items.
     """
 
     security = ClassSecurityInformation()
 
     def __init__(self, message, iterable, logger=None,
-                 timeout=5):
+                 timeout=5, slowest=5):
         self.logger = logger or logging.getLogger('ftw.upgrade')
         self.message = message
         self.iterable = iterable
@@ -24,19 +46,28 @@ class ProgressLogger(object):
             self.length = len(iterable)
 
         self.timeout = timeout
+        self.slowest = slowest
         self._timestamp = None
         self._counter = 0
         self._current_item = None
+        self._started = None
+        self._last_call = None
+        self._samples = deque()
+        self._latencies = [0] * (len(LATENCY_BUCKETS) + 1)
+        self._slowest_items = []
 
     security.declarePrivate('__enter__')
     def __enter__(self):
         self.logger.info('STARTING %s' % self.message)
+        self._started = self._last_call = time()
         return self
 
     security.declarePrivate('__exit__')
     def __exit__(self, exc_type, exc_value, traceback):
+        summary = self.get_summary()
+
         if not exc_type:
-            self.logger.info('DONE %s' % self.message)
+            self.logger.info('DONE %s%s' % (self.message, summary))
 
         else:
             if self._current_item is not None:
@@ -44,24 +75,44 @@ class ProgressLogger(object):
             else:
                 current_step = 'item nr. %d' % self._counter
 
-            self.logger.error('FAILED %s (%s: %s) at %s' % (
+            self.logger.error('FAILED %s (%s: %s) at %s%s' % (
                     self.message,
                     str(exc_type.__name__),
                     str(exc_value),
-                    current_step))
+                    current_step,
+                    summary))
+
+        if summary:
+            self.logger.info('Latency histogram of %s: %s' % (
+                self.message, self.format_histogram()))
+            self.logger.info('Slowest items of %s: %s' % (
+                self.message, self.format_slowest_items()))
 
     security.declarePrivate('__call__')
     def __call__(self):
+        now = float(time())
         self._counter += 1
-        if not self.should_be_logged():
+        if self._last_call is not None:
+            self._record_latency(now - self._last_call)
+        self._last_call = now
+
+        if not self.should_be_logged(now):
             return
 
         percent = int(self._counter * 100.0 / self.length)
-        self.logger.info('%s of %s (%s%%): %s' % (
-                self._counter,
-                self.length,
-                percent,
-                self.message))
+        message = '%s of %s (%s%%): %s' % (
+            self._counter,
+            self.length,
+            percent,
+            self.message)
+
+        rate = self._sample_rate(now)
+        if rate:
+            remaining = max(self.length - self._counter, 0) / rate
+            message += ' [%.1f items/s, ETA %s]' % (
+                rate, format_duration(remaining))
+
+        self.logger.info(message)
 
     security.declarePrivate('__iter__')
     def __iter__(self):
@@ -72,8 +123,9 @@ class ProgressLogger(object):
                 step()
 
     security.declarePrivate('should_be_logged')
-    def should_be_logged(self):
-        now = float(time())
+    def should_be_logged(self, now=None):
+        if now is None:
+            now = float(time())
 
         if self._timestamp is None:
             self._timestamp = now
@@ -86,3 +138,86 @@ class ProgressLogger(object):
 
         else:
             return False
+
+    security.declarePrivate('get_summary')
+    def get_summary(self):
+        """Returns the throughput summary for the DONE / FAILED message or an
+        empty string when the process was too short for being reported.
+        """
+        if self._started is None or not self._counter:
+            return ''
+
+        duration = float(time()) - self._started
+        if duration < self.timeout or duration <= 0:
+            return ''
+
+        return ' [%s items in %s, %.1f items/s]' % (
+            self._counter, format_duration(duration),
+            self._counter / duration)
+
+    security.declarePrivate('format_histogram')
+    def format_histogram(self):
+        labels = [label for (_bound, label) in LATENCY_BUCKETS]
+        labels.append(LATENCY_OVERFLOW_LABEL)
+        return ', '.join('%s: %s' % (label, amount) for (label, amount)
+                         in zip(labels, self._latencies) if amount)
+
+    security.declarePrivate('format_slowest_items')
+    def format_slowest_items(self):
+        return ', '.join('%s (%.3fs)' % (label, latency)
+                         for (latency, _counter, label)
+                         in sorted(self._slowest_items, reverse=True))
+
+    def _record_latency(self, latency):
+        for index, (bound, _label) in enumerate(LATENCY_BUCKETS):
+            if latency < bound:
+                self._latencies[index] += 1
+                break
+        else:
+            self._latencies[-1] += 1
+
+        if not self.slowest:
+            return
+
+        if len(self._slowest_items) < self.slowest:
+            heapq.heappush(self._slowest_items, (
+                latency, self._counter, self._get_item_label()))
+        elif latency > self._slowest_items[0][0]:
+            heapq.heapreplace(self._slowest_items, (
+                latency, self._counter, self._get_item_label()))
+
+    def _get_item_label(self):
+        item = self._current_item
+        if item is None:
+            return 'item nr. %d' % self._counter
+
+        get_path = getattr(item, 'getPath', None)
+        if callable(get_path):
+            return get_path()
+
+        get_physical_path = getattr(item, 'getPhysicalPath', None)
+        if callable(get_physical_path):
+            return '/'.join(get_physical_path())
+
+        label = repr(item)
+        if len(label) > 100:
+            label = label[:97] + '...'
+        return label
+
+    def _sample_rate(self, now):
+        """Records the progress and returns the throughput in items per
+        second over the sliding window, or None when it is not yet known.
+        """
+        self._samples.append((now, self._counter))
+        while len(self._samples) > 2 \
+              and now - self._samples[0][0] > RATE_WINDOW:
+            self._samples.popleft()
+
+        if len(self._samples) < 2:
+            return None
+
+        (start, start_counter), (end, end_counter) = (
+            self._samples[0], self._samples[-1])
+        if end <= start:
+            return None
+        return (end_counter - start_counter) / (end - start)
@@ -0,0 +1,201 @@
+from Acquisition import aq_base
+from ftw.upgrade.metrics import count_metric
+from Missing import MV
+from plone.indexer.interfaces import IIndexableObject
+from zope.component import queryMultiAdapter
+from zope.interface import Interface
+
+import pkg_resources
+import six
+
+
+try:
+    from Products.PluginIndexes.util import safe_callable
+except ImportError:
+    # Zope 2
+    from Products.PluginIndexes.common.util import safe_callable
+
+try:
+    pkg_resources.get_distribution('Products.Archetypes')
+except pkg_resources.DistributionNotFound:
+    class IBaseObject(Interface):
+        pass
+else:
+    from Products.Archetypes.interfaces import IBaseObject
+
+
+def reindex_object(catalog, obj, idxs=None):
+    """Reindexes the indexes ``idxs`` (all indexes by default) and the
+    metadata of ``obj`` without changing its modification date.
+    """
+    if idxs is None and not IBaseObject.providedBy(obj):
+        # Reindex all indexes and metadata in a single catalog
+        # write. Unlike ``obj.reindexObject()``, the catalog does
+        # not update the modification date.
+        catalog.reindexObject(obj)
+        count_metric('catalog_reindex')
+
+    elif idxs is None:
+        # Archetypes objects are indexed in multiple catalogs.
+        # Store modification date
+        modification_date = obj.modified()
+        obj.reindexObject()
+
+        # Restore modification date
+        obj.setModificationDate(modification_date)
+        obj.reindexObject(idxs=['modified'])
+
+    else:
+        obj.reindexObject(idxs=idxs)
+
+
+class ChangedValuesReindexer(object):
+    """Reindexes objects in the catalog, writing only the indexes and the
+    metadata whose values changed.
+
+    Most indexes (field, keyword, date, boolean, UUID and date range
+    indexes) compare the new value with the stored value themselves and
+    report whether they wrote.
+    Text indexes always rewrite the words of the document, therefore their
+    words are compared upfront.
+    The metadata record is compared with the stored record.
+
+    The ``stats`` count the reindexed objects and the written and avoided
+    index and metadata writes.
+    """
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.stats = {'objects': 0,
+                      'index_writes': 0,
+                      'index_writes_avoided': 0,
+                      'metadata_writes': 0,
+                      'metadata_writes_avoided': 0}
+
+    def reindex(self, obj, idxs=None):
+        """Reindexes the indexes ``idxs`` (all indexes by default) and the
+        metadata of ``obj``.
+        """
+        uid = '/'.join(obj.getPhysicalPath())
+        rid = self.catalog.getrid(uid)
+        if rid is None:
+            self.catalog.catalog_object(obj, uid, idxs=idxs)
+            count_metric('catalog_index')
+            return
+
+        self.stats['objects'] += 1
+        wrapper = self._get_indexable_object(obj)
+        written = False
+
+        names = self.catalog.indexes()
+        if idxs:
+            # Unknown indexes are ignored, like in ``catalog_object``.
+            names = [name for name in idxs if name in names]
+
+        for name in names:
+            index = self.catalog._catalog.getIndex(name)
+            if self._is_text_index(index) \
+               and not self._text_changed(index, rid, wrapper):
+                self.stats['index_writes_avoided'] += 1
+            elif index.index_object(rid, wrapper):
+                self.stats['index_writes'] += 1
+                written = True
+            else:
+                self.stats['index_writes_avoided'] += 1
+
+        record = self.catalog._catalog.recordify(wrapper)
+        if self._write_metadata(rid, record) or written:
+            self._increment_counter()
+            count_metric('catalog_reindex')
+
+    def update_metadata(self, obj, columns=None):
+        """Updates the metadata ``columns`` (all columns by default) of
+        ``obj`` without touching the indexes.
+        Objects which are not cataloged are skipped.
+        """
+        rid = self.catalog.getrid('/'.join(obj.getPhysicalPath()))
+        if rid is None:
+            return
+
+        self.stats['objects'] += 1
+        wrapper = self._get_indexable_object(obj)
+        old_record = self.catalog._catalog.data.get(rid, None)
+        if columns is None or old_record is None:
+            record = self.catalog._catalog.recordify(wrapper)
+        else:
+            record = list(old_record)
+            for name in columns:
+                position = self.catalog._catalog.schema[name]
+                record[position] = self._get_column_value(wrapper, name)
+            record = tuple(record)
+
+        if self._write_metadata(rid, record):
+            self._increment_counter()
+            count_metric('catalog_reindex')
+
+    def _get_column_value(self, wrapper, name):
+        """Returns the metadata value like ``Catalog.recordify``.
+        """
+        value = getattr(wrapper, name, MV)
+        if value is not MV and safe_callable(value):
+            value = value()
+        return value
+
+    def _write_metadata(self, rid, record):
+        if self.catalog._catalog.data.get(rid, None) == record:
+            self.stats['metadata_writes_avoided'] += 1
+            return False
+
+        self.catalog._catalog.data[rid] = record
+        self.stats['metadata_writes'] += 1
+        return True
+
+    def _increment_counter(self):
+        increment_counter = getattr(self.catalog, '_increment_counter', None)
+        if increment_counter is not None:
+            # Invalidates caches depending on the catalog counter.
+            increment_counter()
+
+    def _get_indexable_object(self, obj):
+        if IIndexableObject.providedBy(obj):
+            return obj
+        wrapper = queryMultiAdapter((obj, self.catalog), IIndexableObject)
+        if wrapper is None:
+            return obj
+        return wrapper
+
+    def _is_text_index(self, index):
+        return getattr(aq_base(index), 'getLexicon', None) is not None \
+            and getattr(getattr(aq_base(index), 'index', None),
+                        'get_words', None) is not None
+
+    def _text_changed(self, index, rid, wrapper):
+        """Returns whether the words of the text index changed, following
+        how ``ZCTextIndex.index_object`` extracts the texts.
+        """
+        texts = []
+        for attr in index.getIndexSourceNames():
+            text = getattr(wrapper, attr, None)
+            if safe_callable(text):
+                text = text()
+            if not text:
+                continue
+            if isinstance(text, (list, tuple)):
+                texts.extend(text)
+            else:
+                texts.append(text)
+
+        texts = [text for text in texts
+                 if isinstance(text, six.string_types)]
+        if not texts:
+            # The text index does not change without texts.
+            return False
+
+        try:
+            old_words = list(index.index.get_words(rid))
+        except KeyError:
+            return True
+
+        # The word ids are computed like when indexing the texts, with the
+        # full splitter and normalizer pipeline of the lexicon.
+        return old_words != list(index.getLexicon().sourceToWordIds(texts))
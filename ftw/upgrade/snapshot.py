@@ -0,0 +1,144 @@
+from Acquisition import aq_base
+from Products.CMFCore.utils import getToolByName
+from Products.GenericSetup.registry import _profile_registry
+from Products.GenericSetup.upgrade import _upgrade_registry
+
+import transaction
+
+try:
+    from Products.CMFPlone.utils import get_installer
+except ImportError:
+    get_installer = None
+
+
+SNAPSHOT_ATTRIBUTE = 'ftw.upgrade:snapshot'
+
+
+class UpgradeSnapshot(object):
+    """The upgrade snapshot memoizes expensive upgrade information (such as
+    the gathered profiles) for the current transaction, so that the gatherer,
+    the executioner, the JSON API and the management view do not gather the
+    same information over and over again while handling one request.
+
+    The snapshot is bound to a fingerprint of the state it was computed from.
+    When the last versions of the profiles change (``setLastVersionForProfile``
+    always replaces the versions mapping of ``portal_setup``) or when
+    profiles or upgrade steps are registered, the fingerprint no longer
+    matches and a fresh snapshot is created.
+    Changes of the upgrade step recorder invalidate the snapshot explicitly
+    with ``invalidate_upgrade_snapshot``.
+    """
+
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        self._data = {}
+
+    def get(self, key, factory):
+        """Returns the value memoized for ``key``.
+        The value is computed by calling ``factory`` when it is not yet
+        memoized.
+        """
+        if key not in self._data:
+            self._data[key] = factory()
+        return self._data[key]
+
+    def matches(self, fingerprint):
+        tool, versions, registry_sizes = self.fingerprint
+        # The tool and the versions mapping are compared by identity since
+        # the versions mapping is replaced on each change.
+        return (tool is fingerprint[0]
+                and versions is fingerprint[1]
+                and registry_sizes == fingerprint[2])
+
+
+class InstalledProductsResolver(object):
+    """Answers whether products are installable and installed.
+    The answers of the add-on installer (or the quickinstaller on older
+    Plone versions) are memoized, since asking the installer is expensive
+    and the same products are checked over and over again.
+    Use ``get_installed_products_resolver`` for getting the resolver of the
+    current upgrade snapshot.
+    """
+
+    def __init__(self, portal):
+        self.portal = portal
+        self._installer = None
+        self._installable = {}
+        self._installed = {}
+
+    def is_product_installable(self, product_name):
+        if product_name not in self._installable:
+            if get_installer is not None:
+                installable = self.installer.is_product_installable(
+                    product_name)
+            else:
+                installable = self.installer.isProductInstallable(
+                    product_name)
+            self._installable[product_name] = bool(installable)
+        return self._installable[product_name]
+
+    def is_product_installed(self, product_name):
+        if product_name not in self._installed:
+            if get_installer is not None:
+                installed = self.installer.is_product_installed(product_name)
+            else:
+                installed = self.installer.isProductInstalled(product_name)
+            self._installed[product_name] = bool(installed)
+        return self._installed[product_name]
+
+    @property
+    def installer(self):
+        if self._installer is None:
+            if get_installer is not None:
+                self._installer = get_installer(self.portal,
+                                                self.portal.REQUEST)
+            else:
+                self._installer = getToolByName(self.portal,
+                                                'portal_quickinstaller')
+        return self._installer
+
+
+def get_installed_products_resolver(portal_setup, snapshot=None):
+    """Returns the InstalledProductsResolver of the current upgrade
+    snapshot.
+    Since installing a profile changes the profile versions, the resolver
+    is replaced together with the snapshot.
+    Callers which already hold the snapshot should pass it as ``snapshot``.
+    """
+    if snapshot is None:
+        snapshot = get_upgrade_snapshot(portal_setup)
+    return snapshot.get(
+        'installed-products',
+        lambda: InstalledProductsResolver(
+            getToolByName(portal_setup, 'portal_url').getPortalObject()))
+
+
+def get_upgrade_snapshot(portal_setup):
+    """Returns the upgrade snapshot of the current transaction for the
+    passed ``portal_setup`` tool.
+    Verifying the fingerprint lists the registered profiles, thus callers
+    doing many lookups should get the snapshot once and pass it down.
+    """
+    fingerprint = _get_fingerprint(portal_setup)
+    current_transaction = transaction.get()
+    snapshot = getattr(current_transaction, SNAPSHOT_ATTRIBUTE, None)
+    if snapshot is None or not snapshot.matches(fingerprint):
+        snapshot = UpgradeSnapshot(fingerprint)
+        setattr(current_transaction, SNAPSHOT_ATTRIBUTE, snapshot)
+    return snapshot
+
+
+def invalidate_upgrade_snapshot():
+    """Drops the upgrade snapshot of the current transaction.
+    """
+    current_transaction = transaction.get()
+    if getattr(current_transaction, SNAPSHOT_ATTRIBUTE, None) is not None:
+        setattr(current_transaction, SNAPSHOT_ATTRIBUTE, None)
+
+
+def _get_fingerprint(portal_setup):
+    tool = aq_base(portal_setup)
+    return (tool,
+            getattr(tool, '_profile_upgrade_versions', None),
+            (len(_profile_registry.listProfiles()),
+             len(_upgrade_registry.keys())))
@@ -1,15 +1,26 @@
 from AccessControl.SecurityInfo import ClassSecurityInformation
 from Acquisition import aq_base
 from Acquisition import aq_parent
+from ftw.upgrade.cursor import CommitIterator
+from ftw.upgrade.cursor import IterationCursor
+from ftw.upgrade.deferred import get_deferred_reindexing
 from ftw.upgrade.events import ClassMigratedEvent
 from ftw.upgrade.exceptions import NoAssociatedProfileError
 from ftw.upgrade.helpers import update_security_for
 from ftw.upgrade.interfaces import IUpgradeStep
+from ftw.upgrade.metrics import count_metric
 from ftw.upgrade.progresslogger import ProgressLogger
+from ftw.upgrade.reindexer import ChangedValuesReindexer
+from ftw.upgrade.reindexer import reindex_object
+from ftw.upgrade.snapshot import get_installed_products_resolver
+from ftw.upgrade.snapshot import invalidate_upgrade_snapshot
+from ftw.upgrade.utils import GhostResolver
 from ftw.upgrade.utils import log_silencer
+from ftw.upgrade.utils import PrefetchingIterator
 from ftw.upgrade.utils import SafeObjectGetter
 from ftw.upgrade.utils import SavepointIterator
 from ftw.upgrade.utils import SizedGenerator
+from ftw.upgrade.utils import StreamingBrains
 from plone.browserlayer.interfaces import ILocalBrowserLayerType
 from plone.portlets.interfaces import IPortletManager
 from plone.portlets.interfaces import IPortletManagerRenderer
@@ -57,7 +68,9 @@ class UpgradeStep(object):
         """
         obj = object.__new__(cls)
         obj.__init__(*args, **kwargs)
-        return obj()
+        result = obj()
+        obj._clear_cursors()
+        return result
 
     def __init__(self, portal_setup,
                  associated_profile=None,
@@ -70,6 +83,7 @@ class UpgradeStep(object):
         self.target_version = target_version
         self.catalog = self.getToolByName('portal_catalog')
         self._safe_object_getter = None
+        self._cursors = []
 
     security.declarePrivate('__call__')
     def __call__(self):
@@ -86,34 +100,130 @@ class UpgradeStep(object):
         return getToolByName(self.portal_setup, tool_name)
 
     def _iterate_and_log(self, catalog_query, full_objects, message,
-                         logger=None, savepoints=None):
-        results = self.catalog_unrestricted_search(
-            catalog_query, full_objects=full_objects)
+                         logger=None, savepoints=None, commit_every=None,
+                         streaming=False, prefetch=None, order=None):
+        if commit_every:
+            results = self._resumable_search(
+                catalog_query, full_objects, message, commit_every, logger,
+                prefetch=prefetch)
+        else:
+            results = self.catalog_unrestricted_search(
+                catalog_query, full_objects=full_objects,
+                streaming=streaming, prefetch=prefetch, order=order)
         items = SavepointIterator.build(results, savepoints, logger)
+        items = SizedGenerator(self._count_processed_objects(items),
+                               len(items))
         return ProgressLogger(message, items, logger=logger)
 
+    def _get_cursor_key(self, message):
+        """Returns the key of the cursor of the resumable iteration with the
+        ``message``.
+        The upgrade step is identified by its profile and target version.
+        Upgrade steps which are not run with their profile information
+        (e.g. plain Generic Setup handlers) are identified by their class.
+        """
+        if self.base_profile and self.target_version:
+            return '{0}@{1}:{2}'.format(
+                self.base_profile, self.target_version, message)
+        return '{0}.{1}:{2}'.format(
+            type(self).__module__, type(self).__name__, message)
+
+    def _clear_cursors(self):
+        """Removes the cursors of the resumable iterations once the upgrade
+        step is completed, so that iterations which were left early do not
+        skip items when the upgrade step is executed again.
+        The cursors of a failed upgrade step are kept for resuming.
+        """
+        for cursor in getattr(self, '_cursors', ()):
+            cursor.clear()
+
+    def _count_processed_objects(self, items):
+        """Reports the iterated items to the step metrics.
+        """
+        for item in items:
+            count_metric('processed_objects')
+            yield item
+
+    def _resumable_search(self, catalog_query, full_objects, message,
+                          commit_every, logger=None, prefetch=None):
+        """Searches the catalog (unrestricted) and returns an iterator
+        ordered by path, which commits every ``commit_every`` items.
+        When a previous run of this iteration was interrupted, the items
+        of the already committed batches are skipped.
+        The brains are streamed (see ``StreamingBrains``), only their
+        record ids are sorted; the path of each record id is looked up
+        with ``catalog.getpath``, since the brains are not instantiated
+        for sorting.
+        """
+        cursor = IterationCursor(self.portal, self._get_cursor_key(message))
+        self._cursors.append(cursor)
+        position = cursor.get()
+        brains = StreamingBrains(
+            self.catalog.unrestrictedSearchResults(catalog_query),
+            order_key=self._get_catalog_path, start_after=position)
+        if position is not None:
+            (logger or LOG).info('Resuming %s after %s' % (message, position))
+
+        positioned_brains = SizedGenerator(
+            ((brain.getPath(), brain) for brain in brains), len(brains))
+        brains = CommitIterator(positioned_brains, commit_every, cursor,
+                                logger)
+        if not full_objects:
+            return brains
+
+        if prefetch:
+            brains = PrefetchingIterator(brains, self.portal, prefetch)
+        generator = (self.catalog_unrestricted_get_object(brain)
+                     for brain in brains)
+        generator = (obj for obj in generator if obj is not None)
+        return SizedGenerator(generator, len(brains))
+
     security.declarePrivate('objects')
     def objects(self, catalog_query, message, logger=None,
-                savepoints=None):
+                savepoints=None, commit_every=None, streaming=False,
+                prefetch=None, order=None):
         """Queries the catalog (unrestricted) and an iterator with full
         objects.
         The iterator configures and calls a ``ProgressLogger`` with the
         passed ``message``.
+        When ``commit_every`` is set, the transaction is committed every
+        n objects and an interrupted iteration is resumed when rerun.
+        When ``streaming`` is enabled, the brains are not kept in memory
+        (see ``catalog_unrestricted_search``).
+        When ``prefetch`` is set to n, the ZODB prefetches the next n
+        objects while the current ones are processed
+        (see ``catalog_unrestricted_search``).
+        The objects are ordered by ``order`` (see
+        ``catalog_unrestricted_search``); iterations with ``commit_every``
+        are always ordered by path.
         """
         return self._iterate_and_log(catalog_query, True, message,
-                                     logger=logger, savepoints=savepoints)
+                                     logger=logger, savepoints=savepoints,
+                                     commit_every=commit_every,
+                                     streaming=streaming, prefetch=prefetch,
+                                     order=order)
 
     security.declarePrivate('brains')
     def brains(self, catalog_query, message, logger=None,
-               savepoints=None):
+               savepoints=None, commit_every=None, streaming=False,
+               order=None):
         """Queries the catalog (unrestricted) and creates an iterator
         over the brains.
         The iterator configures and calls a ``ProgressLogger`` with the
         passed ``message``.
+        When ``commit_every`` is set, the transaction is committed every
+        n brains and an interrupted iteration is resumed when rerun.
+        When ``streaming`` is enabled, the brains are not kept in memory
+        (see ``catalog_unrestricted_search``).
+        The brains are ordered by ``order`` (see
+        ``catalog_unrestricted_search``); iterations with ``commit_every``
+        are always ordered by path.
         """
 
         return self._iterate_and_log(catalog_query, False, message,
-                                     logger=logger, savepoints=savepoints)
+                                     logger=logger, savepoints=savepoints,
+                                     commit_every=commit_every,
+                                     streaming=streaming, order=order)
 
     security.declarePrivate('catalog_rebuild_index')
     def catalog_rebuild_index(self, name):
@@ -126,30 +236,146 @@ class UpgradeStep(object):
         # pylint: enable=W0212
         pghandler = ZLogHandler(pgthreshold)
         self.catalog.reindexIndex(name, None, pghandler=pghandler)
+        count_metric('catalog_rebuild_index')
 
         LOG.info("Reindexing index %s DONE" % name)
 
+    security.declarePrivate('catalog_rebuild_indexes')
+    def catalog_rebuild_indexes(self, names, logger=None, savepoints=None):
+        """Reindex the ``portal_catalog`` indexes identified by ``names``
+        in a single pass over all cataloged objects.
+        The iteration is logged and creates savepoints like ``objects``.
+        """
+        names = list(names)
+        unknown = [name for name in names if not self.catalog_has_index(name)]
+        if unknown:
+            raise ValueError('Unknown catalog indexes: {0}'.format(
+                ', '.join(unknown)))
+        if not names:
+            return
+
+        # The paths are taken from the catalog records, since catalog
+        # queries without filter are deprecated (ZCatalog 3) or return
+        # nothing (ZCatalog 4).
+        # pylint: disable=W0212
+        paths = list(self.catalog._catalog.uids.keys())
+        # pylint: enable=W0212
+        items = SavepointIterator.build(paths, savepoints, logger)
+        items = SizedGenerator(self._count_processed_objects(items),
+                               len(items))
+        message = 'Reindexing indexes {0}'.format(', '.join(names))
+        for path in ProgressLogger(message, items, logger=logger):
+            obj = self.safe_object_getter.unrestricted_get_object_by_path(
+                path)
+            if obj is None:
+                LOG.warning('The object of the catalog record {!r} no longer'
+                            ' exists and is not reindexed.'.format(path))
+                continue
+            self.catalog.catalog_object(obj, path, idxs=names,
+                                        update_metadata=0)
+        count_metric('catalog_rebuild_index', len(names))
+
     security.declarePrivate('catalog_reindex_objects')
-    def catalog_reindex_objects(self, query, idxs=None, savepoints=None):
+    def catalog_reindex_objects(self, query, idxs=None, savepoints=None,
+                                commit_every=None, only_changed=False,
+                                deferred=False):
         """Reindex all objects found in the catalog with `query`.
         A list of indexes can be passed as `idxs` for limiting the
         indexed indexes.
+        The modification date of the objects is not changed.
+        With `only_changed`, only the indexes and metadata whose values
+        changed are written and the statistics of the written and avoided
+        writes are returned.
+        With `deferred`, the objects are reindexed at the end of the
+        upgrade run, or before the next commit (see
+        ``defer_reindex_object``); the requests are queued from the brains
+        without loading the objects.
         """
 
         title = '.'.join((self.__module__, self.__class__.__name__))
 
-        for obj in self.objects(query, title, savepoints=savepoints):
-            if idxs is None:
-                # Store modification date
-                modification_date = obj.modified()
-                obj.reindexObject()
+        if deferred and only_changed:
+            raise ValueError('"only_changed" is not supported for deferred'
+                             ' reindexing.')
+
+        deferred_reindexing = get_deferred_reindexing()
+        if deferred and deferred_reindexing is not None:
+            for brain in self.brains(query, title, savepoints=savepoints,
+                                     commit_every=commit_every):
+                deferred_reindexing.reindex_brain(brain, idxs=idxs)
+            return
+
+        if only_changed:
+            reindexer = ChangedValuesReindexer(self.catalog)
+            for obj in self.objects(query, title, savepoints=savepoints,
+                                    commit_every=commit_every):
+                reindexer.reindex(obj, idxs=idxs)
+
+            LOG.info('Reindexed {objects} objects: {index_writes} index writes'
+                     ' ({index_writes_avoided} avoided), {metadata_writes}'
+                     ' metadata writes ({metadata_writes_avoided} avoided)'
+                     .format(**reindexer.stats))
+            return reindexer.stats
+
+        for obj in self.objects(query, title, savepoints=savepoints,
+                                commit_every=commit_every):
+            reindex_object(self.catalog, obj, idxs=idxs)
+
+    security.declarePrivate('defer_reindex_object')
+    def defer_reindex_object(self, obj, idxs=None):
+        """Reindexes the indexes `idxs` (all indexes by default) of `obj`
+        at the end of the upgrade run, or at the next intermediate commit.
+        The reindex requests of all upgrade steps of the run are merged,
+        so that each object is reindexed only once.
+        The object is reindexed immediately when the upgrade step is not
+        run by ftw.upgrade.
+        """
+        deferred_reindexing = get_deferred_reindexing()
+        if deferred_reindexing is None:
+            reindex_object(self.catalog, obj, idxs=idxs)
+        else:
+            deferred_reindexing.reindex_object(obj, idxs=idxs)
+
+    security.declarePrivate('defer_rebuild_index')
+    def defer_rebuild_index(self, name):
+        """Rebuilds the ``portal_catalog`` index `name` at the end of the
+        upgrade run, or at the next intermediate commit.
+        The rebuilds of all upgrade steps of the run are merged into a
+        single pass over the catalog.
+        The index is rebuilt immediately when the upgrade step is not run
+        by ftw.upgrade.
+        """
+        deferred_reindexing = get_deferred_reindexing()
+        if deferred_reindexing is None:
+            self.catalog_rebuild_index(name)
+        else:
+            deferred_reindexing.rebuild_index(name)
+
+    security.declarePrivate('catalog_update_metadata')
+    def catalog_update_metadata(self, query, columns=None, savepoints=None,
+                                commit_every=None):
+        """Updates the catalog metadata of all objects found in the catalog
+        with `query` without reindexing any index.
+        A list of metadata columns can be passed as `columns` for limiting
+        the updated columns.
+        """
+        if columns is not None:
+            columns = list(columns)
+            schema = self.catalog.schema()
+            unknown = [name for name in columns if name not in schema]
+            if unknown:
+                raise ValueError('Unknown catalog metadata columns: {0}'.format(
+                    ', '.join(unknown)))
 
-                # Restore modification date
-                obj.setModificationDate(modification_date)
-                obj.reindexObject(idxs=['modified'])
+        title = '.'.join((self.__module__, self.__class__.__name__))
+        reindexer = ChangedValuesReindexer(self.catalog)
+        for obj in self.objects(query, title, savepoints=savepoints,
+                                commit_every=commit_every):
+            reindexer.update_metadata(obj, columns=columns)
 
-            else:
-                obj.reindexObject(idxs=idxs)
+        LOG.info('Updated metadata of {objects} objects: {metadata_writes}'
+                 ' writes ({metadata_writes_avoided} avoided)'.format(
+                     **reindexer.stats))
 
     security.declarePrivate('catalog_has_index')
     def catalog_has_index(self, name):
@@ -183,14 +409,38 @@ class UpgradeStep(object):
         return self.safe_object_getter.catalog_unrestricted_get_object(brain)
 
     security.declarePrivate('catalog_unrestricted_search')
-    def catalog_unrestricted_search(self, query, full_objects=False):
+    def catalog_unrestricted_search(self, query, full_objects=False,
+                                    streaming=False, prefetch=None,
+                                    order=None):
         """Search catalog without security checks.
         If `full_objects` is `True`, objects instead of brains
         are returned.
+        If `streaming` is `True`, the brains are instantiated one by one
+        while iterating and are not kept in memory.
+        The results can then only be iterated.
+        If `prefetch` is set to n together with `full_objects`, the next n
+        objects are prefetched from storages supporting it (e.g. ZEO or
+        RelStorage), which saves round trips to the database server.
+        The results are in catalog order by default. With `order="path"`
+        they are ordered by physical path, so that siblings are processed
+        together, with `order="oid"` they are ordered by the oids of the
+        objects, which follows the storage layout.
         """
-        brains = tuple(self.catalog.unrestrictedSearchResults(query))
+        order_key = self._get_order_key(order)
+        results = self.catalog.unrestrictedSearchResults(query)
+        if streaming:
+            brains = StreamingBrains(
+                results, order_key=order_key and (
+                    lambda rid: order_key(self._get_catalog_path(rid))))
+        elif order_key is not None:
+            brains = tuple(sorted(
+                results, key=lambda brain: order_key(brain.getPath())))
+        else:
+            brains = tuple(results)
 
         if full_objects:
+            if prefetch:
+                brains = PrefetchingIterator(brains, self.portal, prefetch)
             generator = (self.catalog_unrestricted_get_object(brain)
                          for brain in brains)
             generator = (obj for obj in generator if obj is not None)
@@ -199,6 +449,33 @@ class UpgradeStep(object):
         else:
             return brains
 
+    def _get_order_key(self, order):
+        """Returns a function returning the sort key of a cataloged path
+        for the iteration ``order``.
+        """
+        if order is None:
+            return None
+
+        if order == 'path':
+            return lambda path: path
+
+        if order == 'oid':
+            return GhostResolver(self.portal).get_oid
+
+        raise ValueError(
+            'Unknown iteration order {!r}, expected "path" or "oid".'.format(
+                order))
+
+    def _get_catalog_path(self, rid):
+        """Returns the path of the catalog record id ``rid``, for ordering
+        record ids without instantiating their brains.
+        Instantiated brains are ordered by ``brain.getPath()`` instead.
+        """
+        try:
+            return self.catalog.getpath(rid)
+        except KeyError:
+            return ''
+
     security.declarePrivate('actions_remove_action')
     def actions_remove_action(self, category, action_id):
         """Removes an action identified by ``action_id`` from
@@ -358,14 +635,9 @@ class UpgradeStep(object):
     def is_product_installed(self, product_name):
         """Check whether a product is installed.
         """
-        if get_installer is not None:
-            quickinstaller = get_installer(self.portal, self.portal.REQUEST)
-            return (quickinstaller.is_product_installable(product_name)
-                    and quickinstaller.is_product_installed(product_name))
-        else:
-            quickinstaller = self.getToolByName('portal_quickinstaller')
-            return (quickinstaller.isProductInstallable(product_name)
-                    and quickinstaller.isProductInstalled(product_name))
+        resolver = get_installed_products_resolver(self.portal_setup)
+        return (resolver.is_product_installable(product_name)
+                and resolver.is_product_installed(product_name))
 
     security.declarePrivate('uninstall_product')
     def uninstall_product(self, product_name):
@@ -377,6 +649,7 @@ class UpgradeStep(object):
         else:
             quickinstaller = self.getToolByName('portal_quickinstaller')
             quickinstaller.uninstallProducts([product_name])
+        invalidate_upgrade_snapshot()
 
     security.declarePrivate('migrate_class')
     def migrate_class(self, obj, new_class):
@@ -473,11 +746,13 @@ class UpgradeStep(object):
 
     security.declarePrivate('update_workflow_security')
     def update_workflow_security(self, workflow_names, reindex_security=True,
-                                 savepoints=1000):
+                                 savepoints=1000, streaming=False):
         """Updates the object security of all objects with one of the
         passed workflows.
         `workflows` is expected to be a list of workflow names.
         If `savepoints` is None, no savepoints will be created.
+        When `streaming` is enabled, the brains are not kept in memory
+        (see ``catalog_unrestricted_search``).
         """
 
         if getattr(workflow_names, '__iter__', None) is None or \
@@ -488,4 +763,4 @@ class UpgradeStep(object):
         from ftw.upgrade.workflow import WorkflowSecurityUpdater
         updater = WorkflowSecurityUpdater()
         updater.update(workflow_names, reindex_security=reindex_security,
-                       savepoints=savepoints)
+                       savepoints=savepoints, streaming=streaming)
@@ -0,0 +1,27 @@
+# This module must not import Zope, since it is used by the "bin/upgrade"
+# command line script as well.
+
+from path import Path
+
+import stat
+
+
+def get_tempfile_authentication_directory(directory=None):
+    """Finds the buildout directory and returns the absolute path to the
+    relative directory var/ftw.upgrade-authentication/.
+    If the directory does not exist it is created.
+    """
+    directory = Path(directory) or Path.getcwd()
+    if not directory.joinpath('bin', 'buildout').isfile():
+        return get_tempfile_authentication_directory(directory.parent)
+
+    auth_directory = directory.joinpath('var', 'ftw.upgrade-authentication')
+    if not auth_directory.isdir():
+        auth_directory.mkdir(mode=0o770)
+
+    # Verify that "others" do not have any permissions on this directory.
+    if auth_directory.stat().st_mode & stat.S_IRWXO:
+        raise ValueError('{0} has invalid mode: "others" should not have '
+                         'any permissions'.format(auth_directory))
+
+    return auth_directory
@@ -352,6 +352,20 @@ class TestInstallCommand(CommandAndInstanceTestCase):
                 [u'ERROR: --intermediate-commit is not implemented for --profiles.'],
                 output.splitlines())
 
+    def test_profiling_not_supported_with_install_profiles(self):
+        self.package.with_profile(Builder('genericsetup profile'))
+
+        self.setup_logging()
+        with self.package_created():
+            exitcode, output = self.upgrade_script(
+                'install -s plone --profiles the.package:default '
+                '--profiling',
+                assert_exitcode=False)
+            self.assertEqual(3, exitcode)
+            self.assertEqual(
+                [u'ERROR: --profiling is not implemented for --profiles.'],
+                output.splitlines())
+
     def test_force_option_is_meant_to_be_combined_with_profiles(self):
         exitcode, output = self.upgrade_script(
             'install -s plone --force --upgrades 20110101000000@the.package:default',
@@ -1,12 +1,14 @@
 from datetime import datetime
 from ftw.builder import Builder
 from ftw.upgrade.command import jsonapi
+from ftw.upgrade.durations import UpgradeDurationHistory
 from ftw.upgrade.tests.base import CommandAndInstanceTestCase
 from six.moves import map
 
 import json
 import re
 import six
+import transaction
 
 
 class TestListCommand(CommandAndInstanceTestCase):
@@ -100,6 +102,30 @@ class TestListCommand(CommandAndInstanceTestCase):
                 '20120202000000@the.package:default         Upgrade.  \n',
                 output)
 
+    def test_listing_proposed_upgrades_with_expected_durations(self):
+        self.package.with_profile(
+            Builder('genericsetup profile')
+            .with_upgrade(Builder('ftw upgrade step').to(datetime(2011, 1, 1)))
+            .with_upgrade(Builder('ftw upgrade step').to(datetime(2012, 2, 2))))
+
+        with self.package_created():
+            self.install_profile('the.package:default', version='20110101000000')
+            self.clear_recorded_upgrades('the.package:default')
+            UpgradeDurationHistory(self.portal).record(
+                '20120202000000@the.package:default', 90)
+            transaction.commit()
+
+            exitcode, output = self.upgrade_script('list --upgrades -s plone')
+            self.assertEqual(0, exitcode)
+            normalized_output = list(map(six.text_type.strip,
+                                         re.sub(r' +', ' ', output).splitlines()))
+            self.assertEqual(
+                ['Proposed upgrades:',
+                 'ID: Title: Expected duration:',
+                 '20110101000000@the.package:default ORPHAN Upgrade. -',
+                 '20120202000000@the.package:default Upgrade. 1 minute, 30 seconds'],
+                normalized_output)
+
     def test_listing_proposed_upgrades_as_json(self):
         self.package.with_profile(
             Builder('genericsetup profile')
@@ -121,6 +147,7 @@ class TestListCommand(CommandAndInstanceTestCase):
                         "outdated_fs_version": False,
                         "proposed": True,
                         "deferrable": False,
+                        "expected_duration": None,
                         "source": "10000000000000",
                         "title": "Upgrade."
                         },
@@ -132,6 +159,7 @@ class TestListCommand(CommandAndInstanceTestCase):
                         "outdated_fs_version": False,
                         "proposed": True,
                         "deferrable": False,
+                        "expected_duration": None,
                         "source": "20110101000000",
                         "title": "Upgrade."
                         }],
@@ -198,6 +226,7 @@ class TestListCommand(CommandAndInstanceTestCase):
                         "outdated_fs_version": False,
                         "proposed": True,
                         "deferrable": True,
+                        "expected_duration": None,
                         "source": "10000000000000",
                         "title": "DeferrableUpgrade"
                         }],
@@ -0,0 +1,91 @@
+from unittest import skipIf
+from unittest import TestCase
+
+import json
+import os
+import six
+import subprocess
+import sys
+
+
+IMPORTS_SCRIPT = '''
+import json
+import sys
+
+{code}
+print(json.dumps(sorted(sys.modules)))
+'''
+
+COMMAND_CODE = '''
+from ftw.upgrade.command import UpgradeCommand
+UpgradeCommand(sys.argv[1:])
+'''
+
+ZOPE_MODULES = (
+    'AccessControl',
+    'Acquisition',
+    'App',
+    'OFS',
+    'plone',
+    'Products',
+    'transaction',
+    'zope.component',
+)
+
+
+@skipIf(six.PY2, 'The public API is imported eagerly on Python 2.')
+class TestCommandStartup(TestCase):
+    """The bin/upgrade script is a HTTP client and should start without
+    importing the Zope stack.
+    """
+
+    def test_commands_do_not_import_zope(self):
+        for command in ('list', 'install', 'sites', 'create', 'touch'):
+            modules = self.get_imported_modules(COMMAND_CODE, command)
+            self.assertEqual(
+                [], list(filter(is_zope_module, modules)),
+                'Command "{0}" imports Zope'.format(command))
+
+    def test_only_the_chosen_command_is_imported(self):
+        modules = self.get_imported_modules(COMMAND_CODE, 'list', '--json')
+        self.assertEqual(
+            ['ftw.upgrade.command.list_cmd'],
+            [name for name in get_command_modules(modules)
+             if name != 'ftw.upgrade.command.jsonapi'])
+
+    def test_all_commands_are_imported_for_the_help(self):
+        modules = self.get_imported_modules(COMMAND_CODE, 'help')
+        self.assertIn('ftw.upgrade.command.create',
+                      get_command_modules(modules))
+        self.assertIn('ftw.upgrade.command.list_cmd',
+                      get_command_modules(modules))
+
+    def test_zope_modules_are_only_imported_by_the_upgrade_code(self):
+        zope_modules = set(filter(
+            is_zope_module, self.get_imported_modules(
+                'import ftw.upgrade.step')))
+        self.assertIn('Products.GenericSetup', zope_modules)
+        self.assertEqual(
+            set(), zope_modules.intersection(
+                self.get_imported_modules(COMMAND_CODE, 'list')))
+
+    def get_imported_modules(self, code, *args):
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        env.pop('_ARGCOMPLETE', None)
+        output = subprocess.check_output(
+            (sys.executable, '-c', IMPORTS_SCRIPT.format(code=code)) + args,
+            env=env)
+        return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def is_zope_module(name):
+    return any(name == prefix or name.startswith(prefix + '.')
+               for prefix in ZOPE_MODULES)
+
+
+def get_command_modules(modules):
+    return [name for name in modules
+            if name.startswith('ftw.upgrade.command.')
+            and name not in ('ftw.upgrade.command.formatter',
+                             'ftw.upgrade.command.terminal',
+                             'ftw.upgrade.command.utils')]
@@ -0,0 +1,62 @@
+from ftw.testing.layer import TEMP_DIRECTORY
+from ftw.upgrade.directory.manifest import get_directory_stats
+from ftw.upgrade.directory.manifest import get_manifest_path
+from ftw.upgrade.directory.manifest import MANIFEST_DIRECTORY_KEY
+from ftw.upgrade.directory.manifest import read_manifest
+from ftw.upgrade.directory.manifest import write_manifest
+from unittest import TestCase
+
+import os
+
+
+class TestManifest(TestCase):
+    layer = TEMP_DIRECTORY
+
+    def setUp(self):
+        self.tempdir = self.layer['temp_directory']
+        self.upgrades = self.tempdir.joinpath('upgrades')
+        self.upgrades.joinpath('20110101080000_foo').makedirs()
+        self.upgrade_path = self.upgrades.joinpath(
+            '20110101080000_foo', 'upgrade.py')
+        self.upgrade_path.write_text(u'# upgrade')
+
+        self.previous_value = os.environ.get(MANIFEST_DIRECTORY_KEY, None)
+        os.environ[MANIFEST_DIRECTORY_KEY] = self.tempdir.joinpath('cache')
+
+    def tearDown(self):
+        if self.previous_value is None:
+            os.environ.pop(MANIFEST_DIRECTORY_KEY, None)
+        else:
+            os.environ[MANIFEST_DIRECTORY_KEY] = self.previous_value
+
+    def test_no_manifest_without_cache_directory(self):
+        os.environ.pop(MANIFEST_DIRECTORY_KEY)
+        self.assertIsNone(get_manifest_path(self.upgrades))
+        self.write_manifest()
+        self.assertIsNone(read_manifest(self.upgrades))
+
+    def test_manifest_is_read_when_unchanged(self):
+        self.assertIsNone(read_manifest(self.upgrades))
+        self.write_manifest()
+        self.assertEqual([{'title': u'Foo'}], read_manifest(self.upgrades))
+
+    def test_manifest_is_stale_when_upgrade_changes(self):
+        self.write_manifest()
+        self.upgrade_path.write_text(u'# changed upgrade')
+        self.assertIsNone(read_manifest(self.upgrades))
+
+    def test_manifest_is_stale_when_upgrade_is_added(self):
+        self.upgrades.joinpath('20110202080000_bar').mkdir()
+        self.write_manifest()
+        self.upgrades.joinpath('20110202080000_bar', 'upgrade.py').write_text(
+            u'# upgrade')
+        self.assertIsNone(read_manifest(self.upgrades))
+
+    def test_manifest_is_stale_when_upgrade_is_removed(self):
+        self.write_manifest()
+        self.upgrades.joinpath('20110101080000_foo').rmtree()
+        self.assertIsNone(read_manifest(self.upgrades))
+
+    def write_manifest(self):
+        stats = get_directory_stats(self.upgrades, [self.upgrade_path])
+        write_manifest(self.upgrades, stats, [{'title': u'Foo'}])
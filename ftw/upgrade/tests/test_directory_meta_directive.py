@@ -1,6 +1,7 @@
 from datetime import datetime
 from ftw.builder import Builder
 from ftw.builder import create
+from ftw.upgrade.directory.profiles import is_upgrade_step_profile
 from ftw.upgrade.interfaces import IRecordableHandler
 from ftw.upgrade.interfaces import IUpgradeStep
 from ftw.upgrade.tests.base import UpgradeTestCase
@@ -82,6 +83,20 @@ class TestDirectoryMetaDirective(UpgradeTestCase):
                  'type': EXTENSION,
                  'for': IMigratingPloneSiteRoot})
 
+    def test_upgrade_step_profiles_are_not_sorted_by_dependencies(self):
+        self.profile.with_upgrade(Builder('ftw upgrade step')
+                                  .to(datetime(2011, 1, 1, 8))
+                                  .named('add_an_action'))
+
+        with self.package_created():
+            profile_id = 'the.package.upgrades:default-upgrade-20110101080000'
+            self.assertTrue(self.portal_setup.profileExists(profile_id))
+            self.assertTrue(is_upgrade_step_profile(profile_id))
+            self.assertIn('the.package:default',
+                          get_sorted_profile_ids(self.portal_setup))
+            self.assertNotIn(profile_id,
+                             get_sorted_profile_ids(self.portal_setup))
+
     def test_package_modules_is_not_corrupted(self):
         # Regression: when the upgrade-step:directory directive is used from
         # the package-directory with a relative path (directory="upgrades"),
@@ -12,3 +12,13 @@ class TestUpgradeStepRecorder(UpgradeTestCase):
         self.assertFalse(recorder.is_installed('20140101083000'))
         recorder.mark_as_installed('20140101083000')
         self.assertTrue(recorder.is_installed('20140101083000'))
+
+    def test_get_installed_versions(self):
+        recorder = getMultiAdapter((self.layer['portal'], 'some.package:default'),
+                                   IUpgradeStepRecorder)
+
+        self.assertEqual(frozenset(), recorder.get_installed_versions())
+        recorder.mark_as_installed('20140101083000')
+        recorder.mark_as_installed('20140202083000')
+        self.assertEqual(frozenset(('20140101083000', '20140202083000')),
+                         recorder.get_installed_versions())
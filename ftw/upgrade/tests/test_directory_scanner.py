@@ -2,11 +2,17 @@ from contextlib import contextmanager
 from datetime import datetime
 from ftw.builder import Builder
 from ftw.builder import create
+from ftw.upgrade import UpgradeStep
+from ftw.upgrade.directory.manifest import MANIFEST_DIRECTORY_KEY
+from ftw.upgrade.directory.manifest import read_manifest
+from ftw.upgrade.directory.scanner import LazyUpgradeStepClass
 from ftw.upgrade.directory.scanner import Scanner
 from ftw.upgrade.exceptions import UpgradeStepDefinitionError
 from ftw.upgrade.tests.base import UpgradeTestCase
 from six.moves import map
+from zope.interface import implementedBy
 
+import os
 import six
 import unittest
 
@@ -130,6 +136,167 @@ class TestDirectoryScanner(UpgradeTestCase):
             "The upgrade step file (.*)upgrade.py has more than one upgrade class."  # noqa: E501
         )
 
+    @unittest.skipIf(
+        six.PY2, "Upgrade step code is loaded when scanning in Python2.7"
+    )
+    def test_upgrade_step_code_is_imported_on_first_use(self):
+        code = '\n'.join((
+                'from ftw.upgrade import UpgradeStep',
+                'NOT_IMPORTED_WHEN_SCANNING = 1 / 0',
+                'class Foo(UpgradeStep):',
+                '    """Add an action.',
+                '    """',
+                '    deferrable = True'))
+
+        self.profile.with_upgrade(Builder('ftw upgrade step')
+                                  .to(datetime(2011, 1, 1, 8))
+                                  .with_code(code))
+
+        with self.scanned() as upgrade_infos:
+            upgrade_info, = upgrade_infos
+            self.assertEqual('Add an action.', upgrade_info['title'])
+            self.assertIsInstance(upgrade_info['callable'],
+                                  LazyUpgradeStepClass)
+            self.assertTrue(upgrade_info['callable'].deferrable)
+
+            with self.assertRaises(ZeroDivisionError):
+                upgrade_info['callable'].load()
+
+    @unittest.skipIf(
+        six.PY2, "Upgrade step code is loaded when scanning in Python2.7"
+    )
+    def test_lazy_upgrade_step_class_loads_the_class(self):
+        code = '\n'.join((
+                'from ftw.upgrade import UpgradeStep',
+                'class Foo(UpgradeStep):',
+                '    pass'))
+
+        self.profile.with_upgrade(Builder('ftw upgrade step')
+                                  .to(datetime(2011, 1, 1, 8))
+                                  .with_code(code))
+
+        with self.scanned() as upgrade_infos:
+            upgrade_info, = upgrade_infos
+            self.assertEqual('Foo', upgrade_info['title'])
+            self.assertFalse(upgrade_info['callable'].deferrable)
+
+            upgrade_class = upgrade_info['callable'].load()
+            self.assertEqual('Foo', upgrade_class.__name__)
+            self.assertTrue(issubclass(upgrade_class, UpgradeStep))
+            self.assertIs(upgrade_class, upgrade_info['callable'].load())
+
+    @unittest.skipIf(
+        six.PY2, "Upgrade step code is loaded when scanning in Python2.7"
+    )
+    def test_decorated_upgrade_step_code_is_imported_when_scanning(self):
+        code = '\n'.join((
+                'from ftw.upgrade import UpgradeStep',
+                'from zope.interface import implementer',
+                'from zope.interface import Interface',
+                '@implementer(Interface)',
+                'class Foo(UpgradeStep):',
+                '    pass'))
+
+        self.profile.with_upgrade(Builder('ftw upgrade step')
+                                  .to(datetime(2011, 1, 1, 8))
+                                  .with_code(code))
+
+        with self.scanned() as upgrade_infos:
+            upgrade_info, = upgrade_infos
+            self.assertNotIsInstance(upgrade_info['callable'],
+                                     LazyUpgradeStepClass)
+            self.assertTrue(issubclass(upgrade_info['callable'], UpgradeStep))
+
+    @unittest.skipIf(
+        six.PY2, "Upgrade step code is loaded when scanning in Python2.7"
+    )
+    def test_rebound_upgrade_step_class_is_imported_when_scanning(self):
+        code = '\n'.join((
+                'from ftw.upgrade import UpgradeStep',
+                'class Foo(UpgradeStep):',
+                '    pass',
+                'Foo = None'))
+
+        self.profile.with_upgrade(Builder('ftw upgrade step')
+                                  .to(datetime(2011, 1, 1, 8))
+                                  .with_code(code))
+
+        with create(self.package) as package:
+            with self.assertRaises(UpgradeStepDefinitionError):
+                self.scan(package)
+
+    @unittest.skipIf(
+        six.PY2, "Upgrade step code is loaded when scanning in Python2.7"
+    )
+    def test_classes_with_unknown_bases_are_validated_when_scanning(self):
+        code = '\n'.join((
+                'from ftw.upgrade import UpgradeStep',
+                'from ftw.upgrade.step import UpgradeStep as Base',
+                'class Foo(UpgradeStep):',
+                '    pass',
+                'class Bar(Base):',
+                '    pass'))
+
+        self.profile.with_upgrade(Builder('ftw upgrade step')
+                                  .to(datetime(2011, 1, 1, 8))
+                                  .with_code(code))
+
+        with create(self.package) as package:
+            with self.assertRaises(UpgradeStepDefinitionError):
+                self.scan(package)
+
+    @unittest.skipIf(
+        six.PY2, "Upgrade step code is loaded when scanning in Python2.7"
+    )
+    def test_lazy_upgrade_step_class_implements_interfaces_of_the_class(self):
+        self.profile.with_upgrade(Builder('ftw upgrade step')
+                                  .to(datetime(2011, 1, 1, 8))
+                                  .named('add an action'))
+
+        with self.scanned() as upgrade_infos:
+            upgrade_info, = upgrade_infos
+            lazy_class = upgrade_info['callable']
+            self.assertIsInstance(lazy_class, LazyUpgradeStepClass)
+            self.assertEqual(list(implementedBy(UpgradeStep)),
+                             list(lazy_class.implemented))
+            self.assertEqual(implementedBy(lazy_class.load()),
+                             lazy_class.implemented)
+
+    @unittest.skipIf(
+        six.PY2, "Upgrade step code is loaded when scanning in Python2.7"
+    )
+    def test_unchanged_directories_are_read_from_the_manifest(self):
+        self.profile.with_upgrade(Builder('ftw upgrade step')
+                                  .to(datetime(2011, 1, 1, 8))
+                                  .named('add an action'))
+
+        os.environ[MANIFEST_DIRECTORY_KEY] = self.layer['temp_directory'] \
+            .joinpath('manifests')
+        self.addCleanup(os.environ.pop, MANIFEST_DIRECTORY_KEY)
+
+        with create(self.package) as package:
+            upgrades = package.package_path.joinpath('upgrades')
+            self.assertIsNone(read_manifest(upgrades))
+            self.assertEqual(['Add an action.'],
+                             [info['title'] for info in self.scan(package)])
+
+            entries = read_manifest(upgrades)
+            self.assertEqual(['Add an action.'],
+                             [entry['title'] for entry in entries])
+
+            upgrade_info, = Scanner('the.package.upgrades', upgrades).scan(
+                entries)
+            self.assertEqual('20110101080000', upgrade_info['target-version'])
+            self.assertEqual('AddAnAction', upgrade_info['callable'].__name__)
+
+            upgrade_path = upgrades.joinpath('20110101080000_add_an_action',
+                                             'upgrade.py')
+            upgrade_path.write_text(upgrade_path.text().replace(
+                'Add an action.', 'Add another action.'))
+            self.assertIsNone(read_manifest(upgrades))
+            self.assertEqual(['Add another action.'],
+                             [info['title'] for info in self.scan(package)])
+
     def test_does_not_fail_when_no_upgrades_present(self):
         self.package.with_zcml_include('ftw.upgrade', file='meta.zcml')
         self.package.with_zcml_node('upgrade-step:directory',
@@ -0,0 +1,92 @@
+from ftw.builder import Builder
+from ftw.upgrade.durations import ANNOTATION_KEY
+from ftw.upgrade.durations import MAX_MEASUREMENTS
+from ftw.upgrade.durations import UpgradeDurationHistory
+from ftw.upgrade.interfaces import IExecutioner
+from ftw.upgrade.tests.base import UpgradeTestCase
+from zope.annotation import IAnnotations
+from zope.component import queryAdapter
+
+
+class TestUpgradeDurationHistory(UpgradeTestCase):
+
+    def test_expected_duration_is_none_without_measurements(self):
+        history = UpgradeDurationHistory(self.portal)
+        self.assertIsNone(history.get_expected_duration('1@foo:default'))
+        self.assertNotIn(ANNOTATION_KEY, IAnnotations(self.portal))
+
+    def test_expected_duration_is_median_of_measurements(self):
+        history = UpgradeDurationHistory(self.portal)
+        history.record('1@foo:default', 10)
+        self.assertEqual(10, history.get_expected_duration('1@foo:default'))
+
+        history.record('1@foo:default', 30)
+        self.assertEqual(20, history.get_expected_duration('1@foo:default'))
+
+        history.record('1@foo:default', 12)
+        self.assertEqual(12, history.get_expected_duration('1@foo:default'))
+
+    def test_only_the_latest_measurements_are_kept(self):
+        history = UpgradeDurationHistory(self.portal)
+        for duration in range(MAX_MEASUREMENTS + 2):
+            history.record('1@foo:default', duration, objects=duration * 10)
+
+        measurements = history.get_measurements('1@foo:default')
+        self.assertEqual(list(range(2, MAX_MEASUREMENTS + 2)),
+                         [item['duration'] for item in measurements])
+        self.assertEqual(60, measurements[-1]['objects'])
+
+    def test_matching_durations_are_not_stored(self):
+        history = UpgradeDurationHistory(self.portal)
+        self.assertTrue(history.record('1@foo:default', 100))
+        self.assertFalse(history.record('1@foo:default', 105))
+        self.assertTrue(history.record('1@foo:default', 120))
+        self.assertEqual([100, 120],
+                         [item['duration'] for item
+                          in history.get_measurements('1@foo:default')])
+
+    def test_measurements_of_other_fingerprints_are_used_as_fallback(self):
+        history = UpgradeDurationHistory(self.portal)
+        history._fingerprint = u'/other:5'
+        history.record('1@foo:default', 100)
+        history._fingerprint = None
+
+        self.assertEqual(100, history.get_expected_duration('1@foo:default'))
+
+        history.record('1@foo:default', 5)
+        self.assertEqual(5, history.get_expected_duration('1@foo:default'))
+
+    def test_estimate(self):
+        history = UpgradeDurationHistory(self.portal)
+        history.record('1@foo:default', 60)
+        history.record('2@foo:default', 30)
+        self.assertEqual(
+            (90, ['3@foo:default']),
+            history.estimate(['1@foo:default', '2@foo:default',
+                              '3@foo:default']))
+
+    def test_executioner_records_durations_and_logs_expected_duration(self):
+        self.package.with_profile(Builder('genericsetup profile')
+                                   .with_upgrade(Builder('plone upgrade step')
+                                                 .upgrading('1000', to='1001'))
+                                   .with_upgrade(Builder('plone upgrade step')
+                                                 .upgrading('1001', to='1002')))
+
+        with self.package_created():
+            self.install_profile('the.package:default', version='1000')
+            history = UpgradeDurationHistory(self.portal)
+            history.record('1002@the.package:default', 125)
+
+            self.setup_logging()
+            executioner = queryAdapter(self.portal_setup, IExecutioner)
+            executioner.install_upgrades_by_api_ids(
+                '1001@the.package:default', '1002@the.package:default')
+
+            self.assertEqual(
+                'Expected duration of 2 upgrade steps: 2 minutes, 5 seconds'
+                ' (1 upgrade steps without measurements)',
+                self.get_log()[0])
+            self.assertEqual(
+                1, len(history.get_measurements('1001@the.package:default')))
+            self.assertEqual(
+                2, len(history.get_measurements('1002@the.package:default')))
@@ -4,6 +4,7 @@ from ftw.builder import create
 from ftw.upgrade import UpgradeStep
 from ftw.upgrade.executioner import Executioner
 from ftw.upgrade.indexing import HAS_INDEXING
+from ftw.upgrade.indexing import processQueue
 from ftw.upgrade.interfaces import IExecutioner
 from ftw.upgrade.tests.base import UpgradeTestCase
 from Products.CMFCore.utils import getToolByName
@@ -12,6 +13,10 @@ from unittest import skipIf
 from zope.component import queryAdapter
 from zope.interface.verify import verifyClass
 
+import os
+import pstats
+import shutil
+import tempfile
 import transaction
 
 
@@ -62,6 +67,33 @@ class TestExecutioner(UpgradeTestCase):
             executioner.install_upgrades_by_api_ids('1002@the.package:default')
             self.assertTrue(self.portal.upgrade_step_executed)
 
+    def test_profiling_writes_stats_per_upgrade_step(self):
+        self.package.with_profile(Builder('genericsetup profile')
+                                   .with_upgrade(Builder('plone upgrade step')
+                                                 .upgrading('1000', to='1001'))
+                                   .with_upgrade(Builder('plone upgrade step')
+                                                 .upgrading('1001', to='1002')))
+
+        log_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, log_dir)
+
+        with self.package_created():
+            self.install_profile('the.package:default', version='1000')
+            executioner = queryAdapter(self.portal_setup, IExecutioner)
+            executioner.log_dir = log_dir
+            executioner.install_upgrades_by_api_ids(
+                '1001@the.package:default', '1002@the.package:default',
+                profiling=True)
+
+        names = sorted(name for name in os.listdir(log_dir)
+                       if name.endswith('.pstats'))
+        self.assertEqual(2, len(names), names)
+        self.assertTrue(names[0].endswith('-1001@the.package_default.pstats'),
+                        names[0])
+        self.assertTrue(names[1].endswith('-1002@the.package_default.pstats'),
+                        names[1])
+        pstats.Stats(os.path.join(log_dir, names[0]))
+
     def test_transaction_note(self):
         self.package.with_profile(
             Builder('genericsetup profile')
@@ -323,6 +355,51 @@ class TestExecutioner(UpgradeTestCase):
                  u'Current memory usage in MB (RSS): XXX'],
                 self.get_log())
 
+    def test_deferred_reindexing_is_merged_across_upgrade_steps(self):
+        self.grant('Manager')
+        folders = [create(Builder('folder').titled(u'Old Title')),
+                   create(Builder('folder').titled(u'Old Title'))]
+        processQueue()
+        for folder in folders:
+            folder.title = u'New Title'
+            folder.description = u'New Description'
+
+        class ReindexTitle(UpgradeStep):
+            def __call__(self):
+                for obj in self.objects({'portal_type': 'Folder'}, 'Title'):
+                    self.defer_reindex_object(obj, idxs=['Title'])
+                self.defer_rebuild_index('getId')
+
+        class ReindexDescription(UpgradeStep):
+            def __call__(self):
+                for obj in self.objects({'portal_type': 'Folder'},
+                                        'Description'):
+                    self.defer_reindex_object(obj, idxs=['Description'])
+                self.defer_rebuild_index('getId')
+
+        self.package.with_profile(
+            Builder('genericsetup profile')
+            .with_upgrade(Builder('ftw upgrade step')
+                          .to(datetime(2011, 11, 11, 11, 11))
+                          .calling(ReindexTitle))
+            .with_upgrade(Builder('ftw upgrade step')
+                          .to(datetime(2012, 12, 12, 12, 12))
+                          .calling(ReindexDescription)))
+
+        with self.package_created():
+            self.install_profile('the.package:default', version='1000')
+            self.setup_logging()
+            self.install_profile_upgrades('the.package:default')
+
+        self.assertIn(
+            'Deferred reindexing: reindexed 2 objects and rebuilt 1 indexes'
+            ' for 6 requests (3 redundant operations eliminated)',
+            self.get_log())
+        catalog = getToolByName(self.portal, 'portal_catalog')
+        brains = catalog.unrestrictedSearchResults(Title=u'New')
+        self.assertEqual([u'New Description', u'New Description'],
+                         [brain.Description for brain in brains])
+
     def test_installed_version_if_upgrade_fails_with_intermediate_commit(self):
         class Upgrade(UpgradeStep):
             def __call__(self):
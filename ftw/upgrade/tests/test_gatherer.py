@@ -4,8 +4,12 @@ from ftw.upgrade import UpgradeStep
 from ftw.upgrade.exceptions import CyclicDependencies
 from ftw.upgrade.exceptions import UpgradeNotFound
 from ftw.upgrade.gatherer import extend_auto_upgrades_with_human_formatted_date_version
+from ftw.upgrade.gatherer import flatten_upgrades
+from ftw.upgrade.gatherer import get_api_id
 from ftw.upgrade.gatherer import UpgradeInformationGatherer
 from ftw.upgrade.interfaces import IUpgradeInformationGatherer
+from ftw.upgrade.interfaces import IUpgradeStepRecorder
+from ftw.upgrade.snapshot import get_upgrade_snapshot
 from ftw.upgrade.tests.base import UpgradeTestCase
 from Products.CMFPlone.utils import getFSVersionTuple
 from unittest import TestCase
@@ -41,6 +45,32 @@ class TestUpgradeInformationGatherer(UpgradeTestCase):
                     'the.package:default': {'proposed': ['1002'],
                                             'done': ['1001']}})
 
+    def test_listing_matches_the_listing_of_portal_setup(self):
+        self.package.with_profile(Builder('genericsetup profile')
+                                  .with_upgrade(Builder('plone upgrade step')
+                                                .upgrading('1000', to='1001'))
+                                  .with_upgrade(Builder('plone upgrade step')
+                                                .upgrading('1001', to='1002'))
+                                  .with_upgrade(Builder('plone upgrade step')
+                                                .upgrading('1002', to='1003')))
+
+        with self.package_created():
+            self.install_profile('the.package:default', '1001')
+            listed_ids = [
+                upgrade['id'] for upgrade in flatten_upgrades(
+                    self.portal_setup.listUpgrades('the.package:default'))]
+            self.assertEqual(2, len(listed_ids))
+
+            gatherer = queryAdapter(self.portal_setup, IUpgradeInformationGatherer)
+            version = self.portal_setup.getLastVersionForProfile(
+                'the.package:default')
+            self.assertEqual(
+                listed_ids,
+                [upgrade['id'] for upgrade in flatten_upgrades(
+                    self.portal_setup.listUpgrades('the.package:default',
+                                                   show_old=True))
+                 if gatherer._is_listed_for_version(upgrade, version)])
+
     def test_filtering_proposed_upgrades(self):
         self.package.with_profile(Builder('genericsetup profile')
                                   .with_upgrade(Builder('plone upgrade step')
@@ -467,6 +497,23 @@ class TestUpgradeInformationGatherer(UpgradeTestCase):
                 gatherer.get_upgrades_by_api_ids('20120202000000@the.package:default',
                                                  '20110101000000@the.package:default'))
 
+    def test_get_upgrades_by_api_ids_only_gathers_requested_profiles(self):
+        self.package.with_profile(
+            Builder('genericsetup profile')
+            .with_upgrade(Builder('ftw upgrade step').to(datetime(2011, 1, 1))))
+
+        with self.package_created():
+            self.install_profile('the.package:default')
+
+            gatherer = queryAdapter(self.portal_setup, IUpgradeInformationGatherer)
+            gatherer.get_upgrades_by_api_ids('20110101000000@the.package:default')
+            snapshot = get_upgrade_snapshot(self.portal_setup)
+            self.assertEqual(
+                [('api-ids', 'the.package:default', True),
+                 ('profile', 'the.package:default', True)],
+                sorted(key for key in snapshot._data
+                       if key[0] in ('api-ids', 'profile', 'profiles')))
+
     def test_get_upgrades_by_api_ids_raises_upgrade_not_found(self):
         gatherer = queryAdapter(self.portal_setup, IUpgradeInformationGatherer)
         with self.assertRaises(UpgradeNotFound) as cm:
@@ -475,6 +522,85 @@ class TestUpgradeInformationGatherer(UpgradeTestCase):
         self.assertEqual('The upgrade "foo@bar:default" could not be found.',
                          str(cm.exception))
 
+    def test_gathered_profiles_are_memoized_per_transaction(self):
+        self.package.with_profile(Builder('genericsetup profile')
+                                  .with_upgrade(self.default_upgrade()))
+
+        with self.package_created():
+            self.install_profile('the.package:default', version='1000')
+            gatherer = queryAdapter(self.portal_setup, IUpgradeInformationGatherer)
+            self.assertIs(gatherer._get_snapshot_profiles(),
+                          gatherer._get_snapshot_profiles())
+
+            other_gatherer = queryAdapter(self.portal_setup,
+                                          IUpgradeInformationGatherer)
+            self.assertIs(gatherer._get_snapshot_profiles(),
+                          other_gatherer._get_snapshot_profiles())
+
+    def test_snapshot_is_looked_up_once_per_gathering(self):
+        self.package.with_profile(
+            Builder('genericsetup profile')
+            .with_upgrade(Builder('ftw upgrade step').to(datetime(2011, 1, 1))))
+
+        with self.package_created():
+            self.install_profile('the.package:default', version='1000')
+            gatherer = queryAdapter(self.portal_setup, IUpgradeInformationGatherer)
+            lookups = []
+            get_snapshot = gatherer._get_snapshot
+            gatherer._get_snapshot = lambda: lookups.append(1) or get_snapshot()
+
+            gatherer.get_profiles()
+            self.assertEqual(1, len(lookups))
+
+            gatherer.get_upgrades_by_api_ids(
+                '20110101000000@the.package:default')
+            self.assertEqual(2, len(lookups))
+
+    def test_modifying_gathered_profiles_does_not_change_memoized_data(self):
+        self.package.with_profile(Builder('genericsetup profile')
+                                  .with_upgrade(self.default_upgrade()))
+
+        with self.package_created():
+            self.install_profile('the.package:default', version='1000')
+            profile = self.get_profiles_by_ids()['the.package:default']
+            profile['upgrades'][0]['proposed'] = False
+            del profile['upgrades'][:]
+
+            self.assert_gathered_upgrades({
+                'the.package:default': {'proposed': ['1001']}})
+
+    def test_memoized_profiles_are_refreshed_when_versions_change(self):
+        self.package.with_profile(Builder('genericsetup profile')
+                                  .with_upgrade(self.default_upgrade()))
+
+        with self.package_created():
+            self.install_profile('the.package:default', version='1000')
+            self.assert_gathered_upgrades({
+                'the.package:default': {'proposed': ['1001'], 'done': []}})
+
+            self.portal_setup.setLastVersionForProfile(
+                'the.package:default', (u'1001',))
+            self.assert_gathered_upgrades({
+                'the.package:default': {'proposed': [], 'done': ['1001']}})
+
+    def test_memoized_profiles_are_refreshed_when_recorder_changes(self):
+        self.package.with_profile(
+            Builder('genericsetup profile')
+            .with_upgrade(Builder('ftw upgrade step').to(datetime(2011, 1, 1)))
+            .with_upgrade(Builder('ftw upgrade step').to(datetime(2012, 1, 1))))
+
+        with self.package_created():
+            self.install_profile('the.package:default')
+            self.assert_gathered_upgrades({
+                'the.package:default': {'orphan': []}})
+
+            recorder = getMultiAdapter((self.portal, 'the.package:default'),
+                                       IUpgradeStepRecorder)
+            recorder.clear()
+            recorder.mark_as_installed('20120101000000')
+            self.assert_gathered_upgrades({
+                'the.package:default': {'orphan': ['20110101000000']}})
+
     def get_listed_profiles(self, filter_package='the.package'):
         gatherer = queryAdapter(self.portal_setup, IUpgradeInformationGatherer)
         result = gatherer.get_profiles()
@@ -542,3 +668,16 @@ class TestExtendAutoUpgradesWithHumanFormattedDateVersion(TestCase):
         profiles = [{'upgrades': [upgrade_step]}]
         output = extend_auto_upgrades_with_human_formatted_date_version(profiles)
         return output[0]['upgrades'][0]
+
+
+class TestGetApiId(TestCase):
+
+    def test_api_id_consists_of_destination_version_and_profile(self):
+        self.assertEqual('1001@the.package:default',
+                         get_api_id('the.package:default', ('1001',)))
+        self.assertEqual('1.2@the.package:default',
+                         get_api_id('the.package:default', ('1', '2')))
+
+    def test_upgrade_steps_without_destination_have_the_version_all(self):
+        self.assertEqual('all@the.package:default',
+                         get_api_id('the.package:default', None))
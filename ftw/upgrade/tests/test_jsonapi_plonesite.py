@@ -306,7 +306,8 @@ class TestPloneSiteJsonApi(JsonApiTestCase):
                  'deferrable': False,
                  'done': False,
                  'orphan': False,
-                 'outdated_fs_version': False},
+                 'outdated_fs_version': False,
+                 'expected_duration': None},
                 browser.json)
 
             self.assert_json_contains(
@@ -318,7 +319,8 @@ class TestPloneSiteJsonApi(JsonApiTestCase):
                  'deferrable': False,
                  'done': False,
                  'orphan': False,
-                 'outdated_fs_version': False},
+                 'outdated_fs_version': False,
+                 'expected_duration': None},
                 browser.json)
 
     @browsing
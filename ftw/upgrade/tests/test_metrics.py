@@ -0,0 +1,119 @@
+from ftw.testing.layer import TEMP_DIRECTORY
+from ftw.upgrade.metrics import count_metric
+from ftw.upgrade.metrics import get_active_metrics
+from ftw.upgrade.metrics import get_profile_stats_path
+from ftw.upgrade.metrics import MetricsWriter
+from ftw.upgrade.metrics import record_savepoint
+from ftw.upgrade.metrics import StepMetrics
+from ftw.upgrade.metrics import StepProfiler
+from unittest import TestCase
+
+import json
+import os
+import pstats
+import six
+
+
+class DummyConnection(object):
+
+    def __init__(self, *transfer_counts):
+        self.transfer_counts = list(transfer_counts)
+
+    def getTransferCounts(self, clear=False):
+        return self.transfer_counts.pop(0)
+
+
+class TestStepMetrics(TestCase):
+
+    def test_record_contains_step_metrics(self):
+        connection = DummyConnection((10, 2), (15, 3))
+        with StepMetrics(connection, api_id='1@foo:default') as metrics:
+            pass
+
+        record = metrics.record
+        self.assertEqual('1@foo:default', record['api_id'])
+        self.assertEqual(5, record['zodb_loads'])
+        self.assertEqual(1, record['zodb_stores'])
+        self.assertFalse(record['failed'])
+        self.assertGreaterEqual(record['wall_time'], 0)
+        self.assertGreaterEqual(record['cpu_time'], 0)
+        self.assertGreaterEqual(record['rss_peak'], record['rss_before'])
+        self.assertGreaterEqual(record['rss_peak'], record['rss_after'])
+
+    def test_zodb_counts_are_none_without_connection(self):
+        with StepMetrics() as metrics:
+            pass
+
+        self.assertIsNone(metrics.record['zodb_loads'])
+        self.assertIsNone(metrics.record['zodb_stores'])
+
+    def test_counters_are_reported_to_the_active_metrics(self):
+        self.assertIsNone(get_active_metrics())
+
+        with StepMetrics() as metrics:
+            self.assertIs(metrics, get_active_metrics())
+            count_metric('catalog_reindex')
+            count_metric('catalog_reindex')
+            count_metric('indexing_queue_processed', 20)
+            record_savepoint()
+
+        self.assertIsNone(get_active_metrics())
+        self.assertEqual(2, metrics.record['catalog_reindex'])
+        self.assertEqual(20, metrics.record['indexing_queue_processed'])
+        self.assertEqual(1, metrics.record['savepoints'])
+        self.assertEqual(0, metrics.record['catalog_unindex'])
+
+    def test_counting_without_active_metrics_is_ignored(self):
+        count_metric('catalog_reindex')
+        record_savepoint()
+
+    def test_failing_step_is_recorded(self):
+        metrics = StepMetrics()
+        with self.assertRaises(ValueError):
+            with metrics:
+                raise ValueError()
+
+        self.assertTrue(metrics.record['failed'])
+        self.assertIsNone(get_active_metrics())
+
+
+class TestMetricsWriter(TestCase):
+    layer = TEMP_DIRECTORY
+
+    def test_records_are_appended_as_json_lines(self):
+        path = self.layer['temp_directory'].joinpath('metrics.jsonl')
+        writer = MetricsWriter(path)
+        writer.write({'api_id': '1@foo:default'})
+        writer.write({'api_id': '2@foo:default'})
+        writer.close()
+
+        writer.write({'api_id': '3@foo:default'})
+        writer.close()
+
+        self.assertEqual(
+            ['1@foo:default', '2@foo:default', '3@foo:default'],
+            [json.loads(line)['api_id'] for line in path.lines()])
+
+    def test_writing_without_path_is_ignored(self):
+        writer = MetricsWriter(None)
+        writer.write({'api_id': '1@foo:default'})
+        writer.close()
+
+
+class TestStepProfiler(TestCase):
+    layer = TEMP_DIRECTORY
+
+    def test_profile_stats_are_written(self):
+        path = get_profile_stats_path(self.layer['temp_directory'],
+                                      '1001@foo:default')
+        with StepProfiler(path):
+            sorted(range(100))
+
+        self.assertTrue(os.path.isfile(path))
+        self.assertIn('sorted', str(pstats.Stats(path).stats))
+
+    def test_profile_stats_path_is_safe(self):
+        path = get_profile_stats_path('/var/log', '1001@foo.bar:default')
+        self.assertEqual('/var/log', os.path.dirname(path))
+        six.assertRegex(self, os.path.basename(path),
+                        r'^upgrade-profile-\d{14}-1001@foo.bar_default.pstats$')
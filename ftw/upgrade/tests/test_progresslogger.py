@@ -1,15 +1,36 @@
+from ftw.upgrade import progresslogger
 from ftw.upgrade.progresslogger import ProgressLogger
 from six import StringIO
 from six.moves import range
-from time import sleep
 from unittest import TestCase
 
 import logging
+import re
+
+
+class FakeClock(object):
+    """Replaces ``time`` of the progresslogger module, so that the tests do
+    not depend on the actual timing.
+    """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
 
 
 class TestProgressLogger(TestCase):
 
     def setUp(self):
+        self.clock = FakeClock()
+        original_time = progresslogger.time
+        progresslogger.time = self.clock
+        self.addCleanup(setattr, progresslogger, 'time', original_time)
+
         self.log = StringIO()
         self.logger = logging.getLogger('ftw.upgrade')
         self.logger.setLevel(logging.DEBUG)
@@ -21,19 +42,27 @@ class TestProgressLogger(TestCase):
         self.log.seek(0)
         return self.log.read().strip().split('\n')
 
+    def read_log_without_statistics(self):
+        """Returns the log lines without the (timing dependent) throughput
+        and latency statistics.
+        """
+        return [re.sub(r' \[.*\]$', '', line) for line in self.read_log()
+                if not line.startswith(('Latency histogram of',
+                                        'Slowest items of'))]
+
     def test_succeeding_logging(self):
         with ProgressLogger('Foo', 5, logger=self.logger,
                             timeout=0.03) as step:
             for i in range(5):
                 step()
-                sleep(0.0151)
+                self.clock.sleep(0.0151)
 
         self.assertEqual(['STARTING Foo',
                           '1 of 5 (20%): Foo',
                           '3 of 5 (60%): Foo',
                           '5 of 5 (100%): Foo',
                           'DONE Foo'],
-                         self.read_log())
+                         self.read_log_without_statistics())
 
     def test_failing_logging(self):
         timeout = 0
@@ -55,7 +84,7 @@ class TestProgressLogger(TestCase):
                           '2 of 5 (40%): Bar',
                           '3 of 5 (60%): Bar',
                           'FAILED Bar (ValueError: baz) at item nr. 3'],
-                         self.read_log())
+                         self.read_log_without_statistics())
 
     def test_accepts_iterable_object(self):
         items = list(range(5))
@@ -98,3 +127,38 @@ class TestProgressLogger(TestCase):
                           '1 of 5 (20%): Foo',
                           'FAILED Foo (GeneratorExit: ) at 4'],
                          self.read_log())
+
+    def test_logs_throughput_and_eta(self):
+        with ProgressLogger('Foo', 100, logger=self.logger,
+                            timeout=1) as step:
+            for i in range(3):
+                step()
+                self.clock.sleep(2)
+
+        self.assertEqual(
+            ['1 of 100 (1%): Foo',
+             '2 of 100 (2%): Foo [0.5 items/s, ETA 3 minutes, 16 seconds]',
+             '3 of 100 (3%): Foo [0.5 items/s, ETA 3 minutes, 14 seconds]'],
+            self.read_log()[1:4])
+
+    def test_done_message_reports_statistics_of_long_processes(self):
+        items = ['a', 'b', 'c']
+        for item in ProgressLogger('Foo', items, logger=self.logger,
+                                   timeout=1, slowest=2):
+            if item == 'b':
+                self.clock.sleep(2)
+
+        self.assertEqual(
+            ['STARTING Foo',
+             '1 of 3 (33%): Foo',
+             '2 of 3 (66%): Foo [0.5 items/s, ETA 2 seconds]',
+             'DONE Foo [3 items in 2 seconds, 1.5 items/s]',
+             'Latency histogram of Foo: <1ms: 2, <10s: 1',
+             "Slowest items of Foo: 'b' (2.000s), 'a' (0.000s)"],
+            self.read_log())
+
+    def test_short_processes_are_not_reported(self):
+        for _item in ProgressLogger('Foo', [1, 2], logger=self.logger):
+            pass
+
+        self.assertEqual('DONE Foo', self.read_log()[-1])
@@ -1,4 +1,5 @@
 from ftw.upgrade.testing import UPGRADE_FUNCTIONAL_TESTING
+from ftw.upgrade.utils import AdaptiveSavepointIterator
 from ftw.upgrade.utils import SavepointIterator
 from unittest import TestCase
 
@@ -17,6 +18,7 @@ class TestSavepointIterator(TestCase):
     def tearDown(self):
         self.txn.abort()
         os.environ.pop('UPGRADE_SAVEPOINT_THRESHOLD', None)
+        os.environ.pop('UPGRADE_SAVEPOINT_MEMORY_BUDGET', None)
 
     def test_creates_savepoints(self):
         self.assertEqual(
@@ -80,3 +82,67 @@ class TestSavepointIterator(TestCase):
         with self.assertRaises(ValueError) as cm:
             SavepointIterator.get_default_threshold()
         self.assertEqual("Invalid savepoint threshold 'foo'", str(cm.exception))
+
+    def test_configure_adaptive_threshold_with_environ_variable(self):
+        os.environ['UPGRADE_SAVEPOINT_THRESHOLD'] = 'auto'
+        self.assertEqual('auto', SavepointIterator.get_default_threshold())
+        self.assertIsInstance(SavepointIterator.build(self.iterable),
+                              AdaptiveSavepointIterator)
+
+
+class TestAdaptiveSavepointIterator(TestCase):
+    layer = UPGRADE_FUNCTIONAL_TESTING
+
+    def setUp(self):
+        super(TestAdaptiveSavepointIterator, self).setUp()
+        self.txn = transaction.get()
+
+    def tearDown(self):
+        self.txn.abort()
+        os.environ.pop('UPGRADE_SAVEPOINT_MEMORY_BUDGET', None)
+
+    def test_creates_savepoints(self):
+        iterator = SavepointIterator.build([1, 2, 3], threshold='auto')
+        self.assertIsInstance(iterator, AdaptiveSavepointIterator)
+        self.assertEqual([1, 2, 3], list(iterator))
+        self.assertEqual(1, self.txn._savepoint_index)
+
+    def test_threshold_shrinks_when_memory_budget_is_exceeded(self):
+        iterator = AdaptiveSavepointIterator([], memory_budget=100)
+        self.assertEqual(50, iterator.adapt_threshold(100, 200, None))
+
+    def test_threshold_shrinks_when_too_many_objects_are_modified(self):
+        iterator = AdaptiveSavepointIterator([], memory_budget=100)
+        self.assertEqual(
+            25, iterator.adapt_threshold(
+                100, 0, iterator.max_dirty_objects * 4))
+
+    def test_threshold_grows_at_most_by_factor_two(self):
+        iterator = AdaptiveSavepointIterator([], memory_budget=100)
+        self.assertEqual(200, iterator.adapt_threshold(100, 1, 10))
+        self.assertEqual(200, iterator.adapt_threshold(100, 0, None))
+
+    def test_threshold_is_limited(self):
+        iterator = AdaptiveSavepointIterator([], memory_budget=100)
+        self.assertEqual(iterator.min_threshold,
+                         iterator.adapt_threshold(100, 100000, None))
+
+        iterator.threshold = iterator.max_threshold
+        self.assertEqual(iterator.max_threshold,
+                         iterator.adapt_threshold(100, 0, None))
+
+    def test_default_memory_budget_is_256(self):
+        self.assertEqual(
+            256, AdaptiveSavepointIterator.get_default_memory_budget())
+
+    def test_configure_memory_budget_with_environ_variable(self):
+        os.environ['UPGRADE_SAVEPOINT_MEMORY_BUDGET'] = '512'
+        self.assertEqual(
+            512, AdaptiveSavepointIterator.get_default_memory_budget())
+
+    def test_invalid_memory_budget_configuration(self):
+        os.environ['UPGRADE_SAVEPOINT_MEMORY_BUDGET'] = '0'
+        with self.assertRaises(ValueError) as cm:
+            AdaptiveSavepointIterator.get_default_memory_budget()
+        self.assertEqual("Invalid savepoint memory budget 0",
+                         str(cm.exception))
@@ -0,0 +1,76 @@
+from ftw.testing import MockTestCase
+from ftw.upgrade.snapshot import get_installer
+from ftw.upgrade.snapshot import get_upgrade_snapshot
+from ftw.upgrade.snapshot import InstalledProductsResolver
+from ftw.upgrade.snapshot import invalidate_upgrade_snapshot
+
+import transaction
+
+
+class TestUpgradeSnapshot(MockTestCase):
+
+    def setUp(self):
+        super(TestUpgradeSnapshot, self).setUp()
+        transaction.begin()
+
+    def tearDown(self):
+        transaction.abort()
+        super(TestUpgradeSnapshot, self).tearDown()
+
+    def test_snapshot_is_reused_within_a_transaction(self):
+        portal_setup = self.create_dummy(_profile_upgrade_versions={})
+        self.assertIs(get_upgrade_snapshot(portal_setup),
+                      get_upgrade_snapshot(portal_setup))
+
+    def test_values_are_computed_once(self):
+        portal_setup = self.create_dummy(_profile_upgrade_versions={})
+        factory = self.mock()
+        factory.return_value = 'value'
+
+        snapshot = get_upgrade_snapshot(portal_setup)
+        self.assertEqual('value', snapshot.get('key', factory))
+        self.assertEqual('value', snapshot.get('key', factory))
+        self.assertEqual(1, factory.call_count)
+
+    def test_snapshot_is_replaced_when_versions_change(self):
+        portal_setup = self.create_dummy(_profile_upgrade_versions={})
+        snapshot = get_upgrade_snapshot(portal_setup)
+        portal_setup._profile_upgrade_versions = {'foo:default': ('1',)}
+        self.assertIsNot(snapshot, get_upgrade_snapshot(portal_setup))
+
+    def test_snapshot_is_replaced_in_a_new_transaction(self):
+        portal_setup = self.create_dummy(_profile_upgrade_versions={})
+        snapshot = get_upgrade_snapshot(portal_setup)
+        transaction.abort()
+        self.assertIsNot(snapshot, get_upgrade_snapshot(portal_setup))
+
+    def test_invalidate_snapshot(self):
+        portal_setup = self.create_dummy(_profile_upgrade_versions={})
+        snapshot = get_upgrade_snapshot(portal_setup)
+        invalidate_upgrade_snapshot()
+        self.assertIsNot(snapshot, get_upgrade_snapshot(portal_setup))
+
+
+class TestInstalledProductsResolver(MockTestCase):
+
+    def test_installer_answers_are_memoized(self):
+        installer = self.mock()
+        if get_installer is not None:
+            installer.is_product_installable.return_value = True
+            installer.is_product_installed.return_value = False
+            calls = (installer.is_product_installable,
+                     installer.is_product_installed)
+        else:
+            installer.isProductInstallable.return_value = True
+            installer.isProductInstalled.return_value = False
+            calls = (installer.isProductInstallable,
+                     installer.isProductInstalled)
+
+        resolver = InstalledProductsResolver(self.create_dummy())
+        resolver._installer = installer
+
+        for _ in range(3):
+            self.assertTrue(resolver.is_product_installable('the.package'))
+            self.assertFalse(resolver.is_product_installed('the.package'))
+
+        self.assertEqual([1, 1], [call.call_count for call in calls])
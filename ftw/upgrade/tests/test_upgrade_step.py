@@ -5,12 +5,18 @@ from DateTime import DateTime
 from ftw.builder import Builder
 from ftw.builder import create
 from ftw.upgrade import UpgradeStep
+from ftw.upgrade.cursor import IterationCursor
+from ftw.upgrade.deferred import DeferredReindexing
 from ftw.upgrade.exceptions import NoAssociatedProfileError
 from ftw.upgrade.indexing import HAS_INDEXING
 from ftw.upgrade.indexing import processQueue
 from ftw.upgrade.interfaces import IDuringUpgrade
 from ftw.upgrade.interfaces import IUpgradeStep
+from ftw.upgrade.metrics import StepMetrics
+from ftw.upgrade.progresslogger import ProgressLogger
 from ftw.upgrade.tests.base import UpgradeTestCase
+from ftw.upgrade.utils import get_subobject
+from ftw.upgrade.utils import optimize_memory_usage
 from plone.app.testing import setRoles
 from plone.app.testing import TEST_USER_ID
 from plone.browserlayer.utils import register_layer
@@ -22,6 +28,7 @@ from zope.interface import Interface
 from zope.interface.verify import verifyClass
 
 import pkg_resources
+import transaction
 
 try:
     from Products.CMFPlone.utils import get_installer
@@ -110,6 +117,22 @@ class TestUpgradeStep(UpgradeTestCase):
                           'DONE Log message'],
                          self.get_log())
 
+    def test_objects_are_counted_in_the_step_metrics(self):
+        create(Builder('folder'))
+        create(Builder('folder'))
+
+        class Step(UpgradeStep):
+            def __call__(self):
+                for obj in self.objects({'portal_type': 'Folder'}, 'Objects'):
+                    pass
+                for _ in ProgressLogger('Other items', range(3)):
+                    pass
+
+        with StepMetrics() as metrics:
+            Step(self.portal_setup)
+
+        self.assertEqual(2, metrics.record['processed_objects'])
+
     def test_objects_modifying_catalog_does_not_reduce_result_set(self):
         old_date = DateTime(2010, 1, 1)
         new_date = DateTime(2012, 3, 3)
@@ -132,6 +155,105 @@ class TestUpgradeStep(UpgradeTestCase):
             4, data['processed_folders'],
             'Updating catalog reduced result set while iterating over it!!!')
 
+    def test_objects_committed_in_batches_are_skipped_when_resumed(self):
+        for title in (u'A', u'B', u'C', u'D', u'E'):
+            create(Builder('folder').titled(title))
+        transaction.commit()
+
+        processed = []
+        data = {'fail_at': 'D'}
+
+        class Step(UpgradeStep):
+            def __call__(self):
+                for obj in self.objects({'portal_type': 'Folder'},
+                                        'Update folders',
+                                        commit_every=2):
+                    if obj.Title() == data['fail_at']:
+                        raise ValueError('Failing at {0}'.format(obj.Title()))
+                    obj.setDescription(u'Updated')
+                    processed.append(obj.Title())
+
+        identity = {'base_profile': u'profile-the.package:default',
+                    'target_version': '1001'}
+
+        with self.assertRaises(ValueError):
+            Step(self.portal_setup, **identity)
+        transaction.abort()
+
+        self.assertEqual(['A', 'B', 'C'], processed)
+        self.assertEqual(u'Updated', self.portal.get('b').Description())
+        self.assertEqual(u'', self.portal.get('c').Description())
+
+        data['fail_at'] = None
+        del processed[:]
+        Step(self.portal_setup, **identity)
+        self.assertEqual(['C', 'D', 'E'], processed)
+        self.assertIn('Resuming Update folders after /plone/b', self.get_log())
+
+        cursor = IterationCursor(
+            self.portal,
+            u'profile-the.package:default@1001:Update folders')
+        self.assertIsNone(cursor.get())
+
+    def test_cursors_are_not_shared_between_upgrade_steps(self):
+        for title in (u'A', u'B', u'C', u'D', u'E'):
+            create(Builder('folder').titled(title))
+        transaction.commit()
+
+        processed = []
+        data = {'fail_at': 'D'}
+
+        class Upgrade(UpgradeStep):
+            def __call__(self):
+                for obj in self.objects({'portal_type': 'Folder'},
+                                        'Update folders',
+                                        commit_every=2):
+                    if obj.Title() == data['fail_at']:
+                        raise ValueError('Failing at {0}'.format(obj.Title()))
+                    processed.append(obj.Title())
+
+        with self.assertRaises(ValueError):
+            Upgrade(self.portal_setup,
+                    base_profile=u'profile-the.package:default',
+                    target_version='1001')
+        transaction.abort()
+
+        # An upgrade step with the same class name and message, but of
+        # another profile, does not resume the failed iteration.
+        data['fail_at'] = None
+        del processed[:]
+        Upgrade(self.portal_setup,
+                base_profile=u'profile-other.package:default',
+                target_version='1001')
+        self.assertEqual(['A', 'B', 'C', 'D', 'E'], processed)
+
+    def test_cursor_is_removed_when_leaving_the_batches_early(self):
+        for title in (u'A', u'B', u'C', u'D', u'E'):
+            create(Builder('folder').titled(title))
+        transaction.commit()
+
+        processed = []
+
+        class Step(UpgradeStep):
+            def __call__(self):
+                for obj in self.objects({'portal_type': 'Folder'},
+                                        'Update folders',
+                                        commit_every=2):
+                    if obj.Title() == 'D':
+                        break
+                    processed.append(obj.Title())
+
+        Step(self.portal_setup)
+        self.assertEqual(['A', 'B', 'C'], processed)
+
+        cursor = IterationCursor(self.portal, '{0}.Step:Update folders'.format(
+            Step.__module__))
+        self.assertIsNone(cursor.get())
+
+        del processed[:]
+        Step(self.portal_setup)
+        self.assertEqual(['A', 'B', 'C'], processed)
+
     def test_brains_method_yields_brains_with_logging(self):
         testcase = self
         create(Builder('folder').titled(u'Foo'))
@@ -202,6 +324,55 @@ class TestUpgradeStep(UpgradeTestCase):
 
         Step(self.portal_setup)
 
+    def test_catalog_rebuild_indexes(self):
+        testcase = self
+
+        class Step(UpgradeStep):
+            def __call__(self):
+                ctool = self.getToolByName('portal_catalog')
+                names = ['modified', 'created']
+                for name in names:
+                    self.catalog_remove_index(name)
+                    self.catalog_add_index(name, 'DateIndex')
+                    testcase.assertEqual(
+                        0, ctool._catalog.getIndex(name).indexSize())
+
+                self.catalog_rebuild_indexes(names, logger=testcase.logger)
+                for name in names:
+                    testcase.assertEqual(
+                        1, ctool._catalog.getIndex(name).indexSize())
+
+                with testcase.assertRaises(ValueError):
+                    self.catalog_rebuild_indexes(['modified', 'foo'])
+
+        create(Builder('folder')
+               .titled(u'Rebuild Index Test Obj'))
+
+        Step(self.portal_setup)
+        self.assertEqual(['STARTING Reindexing indexes modified, created',
+                          '1 of 1 (100%): Reindexing indexes modified, created',
+                          'DONE Reindexing indexes modified, created'],
+                         self.get_log())
+
+    def test_catalog_rebuild_indexes_covers_all_cataloged_objects(self):
+        testcase = self
+        folder = create(Builder('folder'))
+        create(Builder('document').within(folder))
+        create(Builder('document').within(folder))
+
+        class Step(UpgradeStep):
+            def __call__(self):
+                self.catalog_remove_index('getId')
+                self.catalog_add_index('getId', 'FieldIndex')
+                index = self.catalog._catalog.getIndex('getId')
+                testcase.assertEqual(0, index.indexSize())
+
+                self.catalog_rebuild_indexes(['getId'])
+                testcase.assertEqual(3, index.indexSize())
+                testcase.assertEqual(len(self.catalog), index.indexSize())
+
+        Step(self.portal_setup)
+
     def test_catalog_reindex_objects(self):
         testcase = self
         create(Builder('folder'))
@@ -223,6 +394,171 @@ class TestUpgradeStep(UpgradeTestCase):
 
         Step(self.portal_setup)
 
+    def test_catalog_reindex_objects_does_not_modify_objects(self):
+        folder = create(Builder('folder').titled(u'Old Title'))
+        processQueue()
+        folder.title = u'New Title'
+        transaction.commit()
+
+        class Step(UpgradeStep):
+            def __call__(self):
+                self.catalog_reindex_objects({'UID': folder.UID()})
+
+        Step(self.portal_setup)
+        self.assertFalse(folder._p_changed)
+        brain, = self.portal.portal_catalog.unrestrictedSearchResults(
+            UID=folder.UID())
+        self.assertEqual(u'New Title', brain.Title)
+
+    def test_catalog_reindex_objects_only_changed(self):
+        testcase = self
+        changed = create(Builder('folder').titled(u'Old Title'))
+        create(Builder('folder').titled(u'Unchanged'))
+        processQueue()
+        changed.title = u'New Title'
+        transaction.commit()
+
+        class Step(UpgradeStep):
+            def __call__(self):
+                testcase.assertEqual(
+                    {'objects': 2,
+                     'index_writes': 1,
+                     'index_writes_avoided': 3,
+                     'metadata_writes': 1,
+                     'metadata_writes_avoided': 1},
+                    self.catalog_reindex_objects({'portal_type': 'Folder'},
+                                                 idxs=['Title', 'getId'],
+                                                 only_changed=True))
+
+        Step(self.portal_setup)
+        brain, = self.portal.portal_catalog.unrestrictedSearchResults(
+            Title=u'New')
+        self.assertEqual(u'New Title', brain.Title)
+
+    def test_catalog_writes_of_only_changed_are_counted_in_the_metrics(self):
+        changed = create(Builder('folder').titled(u'Old Title'))
+        create(Builder('folder').titled(u'Unchanged'))
+        processQueue()
+        changed.title = u'New Title'
+
+        class Step(UpgradeStep):
+            def __call__(self):
+                self.catalog_reindex_objects({'portal_type': 'Folder'},
+                                             idxs=['Title'],
+                                             only_changed=True)
+
+        with StepMetrics() as metrics:
+            Step(self.portal_setup)
+
+        self.assertEqual(1, metrics.record['catalog_reindex'])
+
+    def test_catalog_reindex_objects_only_changed_ignores_unknown_indexes(self):
+        testcase = self
+        folder = create(Builder('folder').titled(u'Unchanged Title'))
+        processQueue()
+        folder.description = u'New Description'
+        transaction.commit()
+
+        class Step(UpgradeStep):
+            def __call__(self):
+                testcase.assertEqual(
+                    {'objects': 1,
+                     'index_writes': 0,
+                     'index_writes_avoided': 1,
+                     'metadata_writes': 1,
+                     'metadata_writes_avoided': 0},
+                    self.catalog_reindex_objects({'portal_type': 'Folder'},
+                                                 idxs=['Title', 'unknown'],
+                                                 only_changed=True))
+
+        Step(self.portal_setup)
+
+    def test_deferred_reindexing_is_immediate_without_upgrade_run(self):
+        folder = create(Builder('folder').titled(u'Old Title'))
+        processQueue()
+        folder.title = u'New Title'
+
+        class Step(UpgradeStep):
+            def __call__(self):
+                self.defer_reindex_object(folder, idxs=['Title'])
+
+        Step(self.portal_setup)
+        brain, = self.portal.portal_catalog.unrestrictedSearchResults(
+            Title=u'New')
+        self.assertEqual(u'New Title', brain.Title)
+
+    def test_deferred_reindexing_is_flushed_before_batch_commits(self):
+        testcase = self
+        folders = [create(Builder('folder').titled(u'Old Title')),
+                   create(Builder('folder').titled(u'Old Title'))]
+        processQueue()
+        for folder in folders:
+            folder.title = u'New Title'
+        transaction.commit()
+
+        class Step(UpgradeStep):
+            def __call__(self):
+                self.catalog_reindex_objects({'portal_type': 'Folder'},
+                                             idxs=['Title'],
+                                             deferred=True,
+                                             commit_every=1)
+                testcase.assertEqual(
+                    2, len(self.catalog.unrestrictedSearchResults(
+                        Title=u'New')))
+
+        with DeferredReindexing(self.portal) as reindexing:
+            Step(self.portal_setup)
+            self.assertEqual(0, reindexing.flush()['requests'])
+
+    def test_deferred_reindexing_finds_moved_objects(self):
+        self.grant('Manager')
+        create(Builder('folder').titled(u'Old Title'))
+        create(Builder('folder').titled(u'Removed'))
+        processQueue()
+        transaction.commit()
+
+        with DeferredReindexing(self.portal) as reindexing:
+            reindexing.reindex_object(self.portal.get('old-title'),
+                                      idxs=['Title'])
+            reindexing.reindex_brain(
+                self.portal.portal_catalog.unrestrictedSearchResults(
+                    Title=u'Removed')[0],
+                idxs=['Title'])
+            self.portal.manage_renameObject('old-title', 'renamed')
+            self.portal.manage_delObjects(['removed'])
+            stats = reindexing.flush()
+
+        self.assertEqual(1, stats['reindexed_objects'])
+        self.assertEqual(1, stats['unresolved'])
+        self.assertEqual(0, stats['eliminated'])
+        self.assertIn('Deferred reindexing: the object /plone/removed',
+                      self.get_log())
+
+    def test_catalog_update_metadata(self):
+        testcase = self
+        folder = create(Builder('folder').titled(u'Old Title')
+                        .having(description=u'Old Description'))
+        processQueue()
+        folder.title = u'New Title'
+        folder.description = u'New Description'
+
+        class Step(UpgradeStep):
+            def __call__(self):
+                self.catalog_update_metadata({'portal_type': 'Folder'},
+                                             columns=['Title'])
+
+                with testcase.assertRaises(ValueError):
+                    self.catalog_update_metadata({}, columns=['foo'])
+
+        Step(self.portal_setup)
+        catalog = self.portal.portal_catalog
+        brain, = catalog.unrestrictedSearchResults(UID=folder.UID())
+        self.assertEqual(u'New Title', brain.Title)
+        self.assertEqual(u'Old Description', brain.Description)
+        # The indexes are not updated.
+        self.assertEqual(
+            [], list(catalog.unrestrictedSearchResults(Title=u'New')))
+
     def test_catalog_reindex_objects_keeps_modification_date(self):
         testcase = self
         folder = create(Builder('folder'))
@@ -379,6 +715,203 @@ class TestUpgradeStep(UpgradeTestCase):
 
         Step(self.portal_setup)
 
+    def test_catalog_unrestricted_search_streaming(self):
+        testcase = self
+
+        folder = create(Builder('folder'))
+        create(Builder('document').titled(u'Page One').within(folder))
+        create(Builder('document').titled(u'Page Two').within(folder))
+
+        folder_path = '/'.join(folder.getPhysicalPath())
+
+        class Step(UpgradeStep):
+            def __call__(self):
+                query = {'path': folder_path,
+                         'portal_type': 'Document'}
+                brains = self.catalog_unrestricted_search(
+                    query, streaming=True)
+                testcase.assertEqual(2, len(brains))
+                testcase.assertEqual(
+                    {'page-one', 'page-two'},
+                    {brain.id for brain in brains})
+
+                objects = self.catalog_unrestricted_search(
+                    query, full_objects=True, streaming=True)
+                testcase.assertEqual(2, len(objects))
+                testcase.assertEqual(
+                    {'page-one', 'page-two'},
+                    {obj.id for obj in objects})
+
+        Step(self.portal_setup)
+
+    def test_streaming_objects_skips_records_removed_while_iterating(self):
+        create(Builder('folder').titled(u'A'))
+        create(Builder('folder').titled(u'B'))
+        create(Builder('folder').titled(u'C'))
+
+        data = {'processed': []}
+
+        class Step(UpgradeStep):
+            def __call__(self):
+                for obj in self.objects({'portal_type': 'Folder',
+                                         'sort_on': 'id'},
+                                        'Update folders',
+                                        streaming=True):
+                    data['processed'].append(obj.getId())
+                    if obj.getId() == 'a':
+                        self.catalog.uncatalog_object(
+                            '/'.join(self.portal.get('b').getPhysicalPath()))
+
+        Step(self.portal_setup)
+        self.assertEqual(['a', 'c'], data['processed'])
+
+    def test_streaming_objects_while_reindexing_the_queried_index(self):
+        self.set_workflow_chain(for_type='Folder',
+                                to_workflow='simple_publication_workflow')
+        for title in (u'A', u'B', u'C'):
+            create(Builder('folder').titled(title))
+        processQueue()
+
+        data = {'processed': []}
+
+        class Step(UpgradeStep):
+            def __call__(self):
+                wftool = self.getToolByName('portal_workflow')
+                for obj in self.objects({'review_state': 'private'},
+                                        'Publish folders',
+                                        streaming=True):
+                    data['processed'].append(obj.getId())
+                    wftool.doActionFor(obj, 'publish')
+                    self.catalog.reindexObject(obj, idxs=['review_state'],
+                                               update_metadata=0)
+
+        Step(self.portal_setup)
+        self.assertEqual(['a', 'b', 'c'], sorted(data['processed']))
+
+    def test_objects_prefetches_upcoming_objects(self):
+        folders = [create(Builder('folder').titled(title))
+                   for title in (u'A', u'B', u'C')]
+        transaction.commit()
+
+        connection = self.portal._p_jar
+        connection.cacheMinimize()
+        prefetched = []
+        connection.prefetch = prefetched.extend
+
+        data = {'processed': []}
+
+        class Step(UpgradeStep):
+            def __call__(self):
+                for obj in self.objects({'portal_type': 'Folder',
+                                         'sort_on': 'id'},
+                                        'Update folders',
+                                        prefetch=2):
+                    data['processed'].append(obj.getId())
+
+        try:
+            Step(self.portal_setup)
+        finally:
+            del connection.prefetch
+
+        self.assertEqual(['a', 'b', 'c'], data['processed'])
+        self.assertEqual({folder._p_oid for folder in folders},
+                         set(prefetched))
+
+    def test_catalog_unrestricted_search_ordered_by_path_and_oid(self):
+        testcase = self
+
+        folder_b = create(Builder('folder').titled(u'B'))
+        folder_a = create(Builder('folder').titled(u'A'))
+        page = create(Builder('document').titled(u'Page').within(folder_b))
+        transaction.commit()
+
+        def path(obj):
+            return '/'.join(obj.getPhysicalPath())
+
+        by_oid = [path(obj) for obj in sorted(
+            (folder_a, folder_b, page), key=lambda obj: obj._p_oid)]
+
+        class Step(UpgradeStep):
+            def __call__(self):
+                query = {'portal_type': ['Folder', 'Document']}
+                for streaming in (False, True):
+                    testcase.assertEqual(
+                        ['/plone/a', '/plone/b', '/plone/b/page'],
+                        [brain.getPath() for brain in
+                         self.catalog_unrestricted_search(
+                             query, streaming=streaming, order='path')])
+                    testcase.assertEqual(
+                        by_oid,
+                        [path(obj) for obj in
+                         self.catalog_unrestricted_search(
+                             query, full_objects=True, streaming=streaming,
+                             order='oid')])
+
+                with testcase.assertRaises(ValueError):
+                    self.catalog_unrestricted_search(query, order='id')
+
+        Step(self.portal_setup)
+
+    def test_catalog_unrestricted_get_object_caches_containers(self):
+        testcase = self
+        folder = create(Builder('folder'))
+        page = create(Builder('document').within(folder))
+
+        class Step(UpgradeStep):
+            def __call__(self):
+                brain, = self.catalog.unrestrictedSearchResults(
+                    UID=page.UID())
+                obj = self.catalog_unrestricted_get_object(brain)
+                testcase.assertEqual(page.getPhysicalPath(),
+                                     obj.getPhysicalPath())
+                testcase.assertEqual(folder.getPhysicalPath(),
+                                     aq_parent(aq_inner(obj)).getPhysicalPath())
+
+                containers = self.safe_object_getter.containers
+                testcase.assertEqual(1, len(containers))
+                testcase.assertEqual(
+                    folder.getPhysicalPath(),
+                    containers.get('/plone/folder').getPhysicalPath())
+
+                optimize_memory_usage()
+                testcase.assertEqual(0, len(containers))
+
+        Step(self.portal_setup)
+
+    def test_cached_containers_are_dropped_when_moved(self):
+        testcase = self
+        self.grant('Manager')
+        folder = create(Builder('folder'))
+        page = create(Builder('document').within(folder))
+
+        class Step(UpgradeStep):
+            def __call__(self):
+                brain, = self.catalog.unrestrictedSearchResults(
+                    UID=page.UID())
+                self.catalog_unrestricted_get_object(brain)
+                containers = self.safe_object_getter.containers
+                testcase.assertEqual(1, len(containers))
+
+                self.portal.manage_renameObject('folder', 'renamed')
+                testcase.assertEqual(0, len(containers))
+
+                brain, = self.catalog.unrestrictedSearchResults(
+                    UID=page.UID())
+                obj = self.catalog_unrestricted_get_object(brain)
+                testcase.assertEqual(
+                    ('', 'plone', 'renamed', page.getId()),
+                    obj.getPhysicalPath())
+
+        Step(self.portal_setup)
+
+    def test_get_subobject_ignores_container_attributes(self):
+        folder = create(Builder('folder'))
+        page = create(Builder('document').within(folder))
+        self.assertIsNotNone(folder._getOb('objectIds', None))
+        self.assertIsNone(get_subobject(folder, 'objectIds'))
+        self.assertEqual(page.getPhysicalPath(),
+                         get_subobject(folder, page.getId()).getPhysicalPath())
+
     def test_catalog_unrestricted_search_filters_nonexisting_objects(self):
         """From time to time there are brains in the catalog for which the
         object no longer exists.
@@ -943,6 +1476,22 @@ class TestUpgradeStep(UpgradeTestCase):
 
         self.assert_permission_not_acquired('Modify portal content', folder)
 
+    def test_update_workflow_security_with_streaming(self):
+        self.set_workflow_chain(for_type='Folder',
+                                to_workflow='plone_workflow')
+        folder = create(Builder('folder'))
+        folder.manage_permission('Modify portal content', roles=[],
+                                 acquire=True)
+        self.assert_permission_acquired('Modify portal content', folder)
+
+        class Step(UpgradeStep):
+            def __call__(self):
+                self.update_workflow_security(['plone_workflow'],
+                                              streaming=True)
+        Step(self.portal_setup)
+
+        self.assert_permission_not_acquired('Modify portal content', folder)
+
     def test_update_workflow_security_reindexes_security(self):
         self.set_workflow_chain(for_type='Folder',
                                 to_workflow='plone_workflow')
@@ -1,13 +1,15 @@
 from ftw.testing import MockTestCase
 from ftw.testing.layer import TEMP_DIRECTORY
 from ftw.upgrade.exceptions import CyclicDependencies
+from ftw.upgrade.tempfileauth import get_tempfile_authentication_directory
 from ftw.upgrade.utils import _is_memory_full
 from ftw.upgrade.utils import find_cyclic_dependencies
 from ftw.upgrade.utils import format_duration
+from ftw.upgrade.utils import get_profile_dependency_graph
 from ftw.upgrade.utils import get_sorted_profile_ids
-from ftw.upgrade.utils import get_tempfile_authentication_directory
 from ftw.upgrade.utils import is_memory_critical
 from ftw.upgrade.utils import LOAD_LIMITS
+from ftw.upgrade.utils import ProfileDependencyGraph
 from ftw.upgrade.utils import SizedGenerator
 from ftw.upgrade.utils import subject_from_docstring
 from ftw.upgrade.utils import topological_sort
@@ -17,6 +19,7 @@ from unittest import TestCase
 
 import six
 import stat
+import transaction
 
 
 class TestTopologicalSort(TestCase):
@@ -99,6 +102,76 @@ class TestFindCyclicDependencies(TestCase):
             [set(('foo', 'bar', 'baz'))],
             list(map(set, find_cyclic_dependencies(dependencies))))
 
+    def test_dependencies_of_cyclic_dependencies_are_not_included(self):
+        dependencies = (
+            ('foo', 'bar'),
+            ('bar', 'foo'),
+            ('bar', 'baz'),
+            ('baz', 'qux'),
+            )
+
+        self.assertEqual(
+            [set(('foo', 'bar'))],
+            list(map(set, find_cyclic_dependencies(dependencies))))
+
+    def test_self_dependencies_are_cyclic(self):
+        self.assertEqual(
+            [['foo']],
+            find_cyclic_dependencies((('foo', 'foo'), ('bar', 'foo'))))
+
+
+class TestProfileDependencyGraph(MockTestCase):
+
+    def test_rank_of_profiles(self):
+        graph = ProfileDependencyGraph([
+            {'id': 'baz', 'dependencies': ['profile-foo', 'profile-bar']},
+            {'id': 'foo'},
+            {'id': 'bar', 'ftw.upgrade:dependencies': ['foo']}])
+
+        self.assertEqual(['foo', 'bar', 'baz'], graph.get_sorted_profile_ids())
+        self.assertEqual([0, 1, 2], list(map(graph.get_rank,
+                                             ('foo', 'bar', 'baz'))))
+        self.assertEqual(-1, graph.get_rank('unknown'))
+
+    def test_unknown_dependencies_are_ignored(self):
+        graph = ProfileDependencyGraph([
+            {'id': 'foo', 'dependencies': ['profile-unknown']}])
+        self.assertEqual([], graph.dependencies)
+        self.assertEqual(['foo'], graph.get_sorted_profile_ids())
+
+    def test_cyclic_dependencies_raise_when_sorting(self):
+        graph = ProfileDependencyGraph([
+            {'id': 'foo', 'dependencies': ['profile-bar']},
+            {'id': 'bar', 'dependencies': ['profile-foo']}])
+
+        with self.assertRaises(CyclicDependencies):
+            graph.get_sorted_profile_ids()
+
+        with self.assertRaises(CyclicDependencies):
+            graph.get_rank('foo')
+
+    def test_graph_is_memoized_per_transaction(self):
+        listProfileInfo = self.mock()
+        listProfileInfo.return_value = [
+            {'id': 'bar', 'dependencies': ['profile-foo']},
+            {'id': 'foo'}]
+        portal_setup = self.create_dummy()
+        portal_setup.listProfileInfo = listProfileInfo
+
+        transaction.begin()
+        try:
+            self.assertIs(get_profile_dependency_graph(portal_setup),
+                          get_profile_dependency_graph(portal_setup))
+            self.assertEqual(['foo', 'bar'],
+                             get_sorted_profile_ids(portal_setup))
+            self.assertEqual(1, listProfileInfo.call_count)
+
+            transaction.abort()
+            get_profile_dependency_graph(portal_setup)
+            self.assertEqual(2, listProfileInfo.call_count)
+        finally:
+            transaction.abort()
+
 
 class TestSizedGenerator(TestCase):
 
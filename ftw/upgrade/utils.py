@@ -1,41 +1,138 @@
 from AccessControl.SecurityInfo import ClassSecurityInformation
+from Acquisition import aq_base
 from App.config import getConfiguration
-from collections import defaultdict
+from collections import OrderedDict
 from contextlib import contextmanager
-from copy import deepcopy
+from ftw.upgrade.formatting import format_duration  # noqa
+from ftw.upgrade.directory.profiles import is_upgrade_step_profile
 from ftw.upgrade.exceptions import CyclicDependencies
-from path import Path
+from ftw.upgrade.metrics import record_savepoint
+from ftw.upgrade.snapshot import get_upgrade_snapshot
+from itertools import islice
+from operator import itemgetter
+from Products.ZCatalog.Lazy import LazyMap
 from six.moves import map
 from zExceptions import NotFound
 from zope.component.hooks import getSite
 from zope.component.hooks import setSite
 import gc
 import logging
-import math
 import os
 import psutil
 import re
-import stat
-import tarjan.tc
 import transaction
+import weakref
+
+
+# The container caches of all object getters, cleared when the memory usage
+# is optimized.
+_container_caches = weakref.WeakSet()
+
+
+class ContainerCache(object):
+    """A bounded LRU cache of acquisition wrapped containers, keyed by path.
+
+    The caches are cleared whenever the memory usage is optimized (see
+    ``optimize_memory_usage``), so that the cached containers do not keep
+    the ZODB pickle cache from garbage collecting them.
+    The containers of moved, renamed or removed objects are dropped (see
+    ``invalidate_container_caches``).
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._containers = OrderedDict()
+        _container_caches.add(self)
+
+    def get(self, path):
+        container = self._containers.pop(path, None)
+        if container is not None:
+            self._containers[path] = container
+        return container
+
+    def set(self, path, container):
+        self._containers.pop(path, None)
+        self._containers[path] = container
+        while len(self._containers) > self.size:
+            self._containers.popitem(last=False)
+
+    def invalidate(self, path):
+        """Drops the container at ``path`` and the containers within it.
+        """
+        prefix = path + '/'
+        for key in [key for key in self._containers
+                    if key == path or key.startswith(prefix)]:
+            del self._containers[key]
+
+    def clear(self):
+        self._containers.clear()
+
+    def __len__(self):
+        return len(self._containers)
+
+
+def clear_container_caches():
+    for cache in list(_container_caches):
+        cache.clear()
+
+
+def invalidate_container_caches(obj, event):
+    """Drops the cached containers at the old path of a moved, renamed or
+    removed object from all container caches.
+    """
+    if event.oldParent is None:
+        return
+    path = '/'.join(event.oldParent.getPhysicalPath() + (event.oldName,))
+    for cache in list(_container_caches):
+        cache.invalidate(path)
+
+
+def get_subobject(container, name):
+    """Returns the subobject ``name`` of the ``container`` with ``_getOb``,
+    without loading it, or None.
+    Attributes of the container which are not subobjects (e.g. methods of
+    the container class with the same name) are not returned.
+    """
+    base = aq_base(container)
+    if getattr(base, '_getOb', None) is None:
+        return None
+    has_object = getattr(base, 'hasObject', None)
+    if has_object is not None:
+        if not has_object(name):
+            return None
+    elif name not in base.objectIds():
+        return None
+    return container._getOb(name, None)
 
 
 class SafeObjectGetter(object):
+    """Resolves brains to their objects.
+
+    Instead of traversing from the portal for each brain, the parent
+    containers are cached (``max_cached_containers``) and the objects are
+    looked up with ``_getOb`` on their parent.
+    Objects which cannot be looked up that way are traversed.
+    """
 
     security = ClassSecurityInformation()
 
-    def __init__(self, portal, catalog, log):
+    def __init__(self, portal, catalog, log, max_cached_containers=100):
         self.catalog = catalog
         self.portal = portal
         self.errors = []
         self.log = log
+        self.containers = ContainerCache(max_cached_containers)
+        self._portal_path = '/'.join(portal.getPhysicalPath())
 
     security.declarePrivate('catalog_unrestricted_get_object')
     def catalog_unrestricted_get_object(self, brain):
         """Returns the unrestricted object of a brain.
         """
         try:
-            return self.portal.unrestrictedTraverse(brain.getPath())
+            obj = self._get_from_container(brain.getPath())
+            if obj is None:
+                obj = self.portal.unrestrictedTraverse(brain.getPath())
+            return obj
         except (AttributeError, KeyError, NotFound):
             self.log.warning('The object of the brain with rid {!r} no longer'
                              ' exists at the path {!r}; removing the brain.'.format(
@@ -45,6 +142,48 @@ class SafeObjectGetter(object):
             self.catalog.uncatalog_object(brain.getPath())
             return None
 
+    security.declarePrivate('unrestricted_get_object_by_path')
+    def unrestricted_get_object_by_path(self, path):
+        """Returns the unrestricted object at ``path`` or None.
+        """
+        obj = self._get_from_container(path)
+        if obj is None:
+            obj = self.portal.unrestrictedTraverse(path, None)
+        return obj
+
+    def _get_from_container(self, path):
+        """Looks up the object at ``path`` with ``_getOb`` on its cached
+        parent container. Returns None when this is not possible.
+        """
+        parent_path, _, name = path.rpartition('/')
+        if not parent_path or not name:
+            return None
+
+        container = self._get_container(parent_path)
+        if container is None:
+            return None
+        obj = get_subobject(container, name)
+        if obj is None:
+            # The cached container may be stale, e.g. when it was replaced
+            # without events.
+            self.containers.invalidate(parent_path)
+        return obj
+
+    def _get_container(self, path):
+        if path == self._portal_path:
+            return self.portal
+
+        container = self.containers.get(path)
+        if container is not None:
+            return container
+
+        container = self._get_from_container(path)
+        if container is None:
+            container = self.portal.unrestrictedTraverse(path, None)
+        if container is not None:
+            self.containers.set(path, container)
+        return container
+
 
 def topological_sort(items, partial_order):
     """Perform topological sort.
@@ -118,18 +257,146 @@ def topological_sort(items, partial_order):
 
 
 def find_cyclic_dependencies(dependencies):
-    deps = defaultdict(list)
+    """Returns a list of groups of nodes which depend on each other.
+    The groups are the strongly connected components of the dependency graph
+    (Tarjan's algorithm) which contain a cycle.
+    """
+    deps = {}
     for first, second in dependencies:
-        deps[first].append(second)
+        deps.setdefault(first, []).append(second)
+        deps.setdefault(second, [])
 
+    index = {}
+    lowlink = {}
+    stack = []
+    on_stack = set()
     cyclic_dependencies = []
-    for name, closure in tarjan.tc.tc(deps).items():
-        if name in closure and closure not in cyclic_dependencies:
-            cyclic_dependencies.append(closure)
+
+    for root in list(deps):
+        if root in index:
+            continue
+
+        # Iterative depth-first search, avoiding recursion limits on large
+        # dependency graphs.
+        index[root] = lowlink[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(deps[root]))]
+
+        while work:
+            node, children = work[-1]
+            for child in children:
+                if child not in index:
+                    index[child] = lowlink[child] = len(index)
+                    stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, iter(deps[child])))
+                    break
+                elif child in on_stack:
+                    lowlink[node] = min(lowlink[node], index[child])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+
+                if lowlink[node] != index[node]:
+                    continue
+
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack.discard(member)
+                    component.append(member)
+                    if member == node:
+                        break
+
+                if len(component) > 1 or node in deps[node]:
+                    cyclic_dependencies.append(component)
 
     return cyclic_dependencies
 
 
+class ProfileDependencyGraph(object):
+    """The dependency graph of all Generic Setup profiles.
+
+    The graph is built with a single pass over the profile infos and
+    provides a rank index, so that sorting by dependencies does not need to
+    look up positions in lists.
+    The profiles of upgrade steps of upgrade step directories are not part of
+    the graph.
+    """
+
+    def __init__(self, profiles):
+        profile_ids = []
+        known_ids = set()
+        profile_dependencies = []
+
+        for profile in profiles:
+            if is_upgrade_step_profile(profile['id']):
+                continue
+
+            profile_ids.append(profile['id'])
+            known_ids.add(profile['id'])
+            profile_dependencies.append(
+                (profile['id'],
+                 list(profile.get('dependencies') or [])
+                 + list(profile.get('ftw.upgrade:dependencies') or [])))
+
+        self.dependencies = []
+        for profile_id, dependencies in profile_dependencies:
+            for dependency in dependencies:
+                dependency = re.sub('^profile-', '', dependency)
+                if dependency in known_ids:
+                    self.dependencies.append((profile_id, dependency))
+
+        order = topological_sort(profile_ids, self.dependencies)
+        if order is None:
+            self.sorted_profile_ids = None
+            self.cyclic_dependencies = find_cyclic_dependencies(
+                self.dependencies)
+            self.rank = {}
+        else:
+            self.sorted_profile_ids = tuple(reversed(order))
+            self.cyclic_dependencies = []
+            self.rank = dict((profile_id, position) for (position, profile_id)
+                             in enumerate(self.sorted_profile_ids))
+
+    def get_sorted_profile_ids(self):
+        """Returns a list of profile ids, sorted so that dependencies are
+        listed before the profiles depending on it.
+        Raises CyclicDependencies when the profiles cannot be sorted.
+        """
+        self.verify()
+        return list(self.sorted_profile_ids)
+
+    def get_rank(self, profile_id, default=-1):
+        """Returns the position of the profile in the sorted profile ids.
+        Raises CyclicDependencies when the profiles cannot be sorted.
+        """
+        self.verify()
+        return self.rank.get(profile_id, default)
+
+    def verify(self):
+        if self.sorted_profile_ids is None:
+            raise CyclicDependencies(list(self.dependencies),
+                                     self.cyclic_dependencies)
+
+
+def get_profile_dependency_graph(portal_setup, snapshot=None):
+    """Returns the ProfileDependencyGraph for the profiles of the passed
+    portal_setup tool.
+    The graph is memoized in the upgrade snapshot of the current
+    transaction, which is replaced when profiles are registered.
+    Callers which already hold the snapshot should pass it as ``snapshot``.
+    """
+    if snapshot is None:
+        snapshot = get_upgrade_snapshot(portal_setup)
+    return snapshot.get(
+        'dependency-graph',
+        lambda: ProfileDependencyGraph(portal_setup.listProfileInfo()))
+
+
 class SizedGenerator(object):
 
     def __init__(self, generator, length):
@@ -143,6 +410,235 @@ class SizedGenerator(object):
         return self._length
 
 
+class StreamingBrains(object):
+    """Iterates over catalog results without keeping the brains in memory.
+
+    The lazy catalog results instantiate the brains on access and keep them
+    until the results are garbage collected, which adds up when iterating
+    over millions of results.
+    The streaming brains instantiate each brain from the record ids of the
+    results and drop it after use.
+    Records which were removed from the catalog in the meantime are skipped.
+    The length is the ``actual_result_count`` of the results.
+
+    Only ``LazyMap`` results, as returned by catalog queries, are streamed;
+    their record ids and brain factory are the private ``_seq`` and ``_func``
+    attributes. Other results (e.g. ``LazyCat`` of merged results or
+    ``LazyValues``) are iterated as they are, which instantiates and keeps
+    their brains.
+
+    When an ``order_key`` function is passed, the brains are ordered by the
+    return value of ``order_key`` called with the record id of each brain.
+    Only the record ids are sorted, not the brains.
+    With ``start_after``, only the brains whose order key is greater than
+    ``start_after`` are returned; the length is then the amount of those
+    brains.
+    """
+
+    def __init__(self, results, order_key=None, start_after=None):
+        if start_after is not None and order_key is None:
+            raise ValueError('"start_after" requires an "order_key".')
+        self.results = results
+        self.order_key = order_key
+        self.start_after = start_after
+        self._sequence = None
+
+    def __iter__(self):
+        sequence = self._get_sequence()
+        if not isinstance(self.results, LazyMap):
+            # E.g. empty or merged results.
+            for brain in sequence:
+                yield brain
+            return
+
+        # pylint: disable=W0212
+        func = self.results._func
+        # pylint: enable=W0212
+        for key in sequence:
+            try:
+                brain = func(key)
+            except KeyError:
+                continue
+            yield brain
+
+    def __len__(self):
+        if self.start_after is not None:
+            return len(self._get_sequence())
+        count = getattr(self.results, 'actual_result_count', None)
+        if count is None:
+            return len(self.results)
+        return count
+
+    def _get_sequence(self):
+        """Returns the ordered record ids of ``LazyMap`` results, or the
+        ordered brains of other results.
+        """
+        if self._sequence is not None:
+            return self._sequence
+
+        if isinstance(self.results, LazyMap):
+            # The record ids are copied, since they may be the internal set
+            # of an index, which changes when the iterated objects are
+            # reindexed.
+            # pylint: disable=W0212
+            sequence = list(self.results._seq)
+            # pylint: enable=W0212
+            order_key = self.order_key
+        else:
+            sequence = self.results
+            order_key = self.order_key and (
+                lambda brain: self.order_key(brain.getRID()))
+
+        if order_key is not None:
+            keyed = sorted(((order_key(item), index, item)
+                            for index, item in enumerate(sequence)),
+                           key=itemgetter(0, 1))
+            sequence = [item for (key, _, item) in keyed
+                        if self.start_after is None or key > self.start_after]
+        self._sequence = sequence
+        return sequence
+
+
+class GhostResolver(object):
+    """Looks up objects by their path without loading them.
+
+    The objects are looked up with ``_getOb`` on their containers, which
+    returns the persistent objects as ghosts, so that only the containers
+    on the way are loaded.
+    The containers are cached by path (see ``ContainerCache``), at most
+    ``max_cached_containers`` containers.
+    """
+
+    def __init__(self, portal, max_cached_containers=1000):
+        self.portal = portal
+        self.max_cached_containers = max_cached_containers
+        self._portal_path = tuple(portal.getPhysicalPath())
+        self._containers = ContainerCache(max_cached_containers)
+
+    def relative_path(self, path):
+        """Returns the ``path`` string as tuple relative to the portal or
+        None when the path is not within the portal.
+        """
+        path = tuple(path.split('/'))
+        if path[:len(self._portal_path)] != self._portal_path \
+           or len(path) == len(self._portal_path):
+            return None
+        return path[len(self._portal_path):]
+
+    def get(self, path):
+        """Returns the object at the ``path`` (a tuple relative to the portal)
+        without loading it, or None when it does not exist.
+        """
+        container = self.portal
+        if len(path) > 1:
+            container = self.get_container(path[:-1])
+            if container is None:
+                return None
+
+        return get_subobject(container, path[-1])
+
+    def get_container(self, path):
+        key = '/'.join(self._portal_path + path)
+        container = self._containers.get(key)
+        if container is None:
+            container = self.get(path)
+            if container is not None:
+                self._containers.set(key, container)
+        return container
+
+    def get_oid(self, path):
+        """Returns the oid of the object at the ``path`` string or an
+        empty string when there is no such persistent object.
+        """
+        relative_path = self.relative_path(path)
+        if relative_path is None:
+            return b''
+        return getattr(self.get(relative_path), '_p_oid', None) or b''
+
+
+class PrefetchingIterator(object):
+    """Iterates over brains and lets the ZODB prefetch the objects of the
+    upcoming brains.
+
+    The brains are processed in windows of ``read_ahead`` brains.
+    Before the brains of a window are yielded, the objects of the next
+    window are looked up as ghosts, without loading their state, and their
+    oids are passed to ``prefetch`` of the ZODB connection.
+    Storages supporting prefetching (e.g. ZEO or RelStorage) load them in
+    the background or in a single round trip while the current window is
+    processed.
+    The containers on the way to the objects are prefetched level by level
+    before the objects are looked up in them.
+    Connections or storages without prefetch support are not affected.
+    """
+
+    def __init__(self, brains, portal, read_ahead):
+        self.brains = brains
+        self.portal = portal
+        self.read_ahead = read_ahead
+        self._resolver = None
+
+        if not read_ahead or read_ahead < 1:
+            raise ValueError("Read ahead must be a positive value")
+
+    def __iter__(self):
+        prefetch = getattr(getattr(self.portal, '_p_jar', None),
+                           'prefetch', None)
+        iterator = iter(self.brains)
+        window = list(islice(iterator, self.read_ahead))
+        if prefetch is None:
+            for brain in window:
+                yield brain
+            for brain in iterator:
+                yield brain
+            return
+
+        self._resolver = GhostResolver(self.portal)
+        self.prefetch(prefetch, window)
+        while window:
+            upcoming = list(islice(iterator, self.read_ahead))
+            self.prefetch(prefetch, upcoming)
+            for brain in window:
+                yield brain
+            window = upcoming
+
+    def __len__(self):
+        return self.brains.__len__()
+
+    def prefetch(self, prefetch, brains):
+        """Looks up the objects of the ``brains`` and their containers as
+        ghosts and passes the oids of those not yet loaded to ``prefetch``.
+        """
+        paths = set(self._resolver.relative_path(brain.getPath())
+                    for brain in brains)
+        paths.discard(None)
+        containers = set(path[:depth] for path in paths
+                         for depth in range(1, len(path)))
+        depth = 1
+        while True:
+            level = [path for path in paths | containers
+                     if len(path) == depth]
+            if not level:
+                break
+
+            ghosts = []
+            for path in level:
+                if path in containers:
+                    ghosts.append(self._resolver.get_container(path))
+                else:
+                    ghosts.append(self._resolver.get(path))
+
+            oids = [ghost._p_oid for ghost in ghosts
+                    if getattr(ghost, '_p_oid', None) is not None
+                    and getattr(ghost, '_p_changed', False) is None]
+            if oids:
+                prefetch(oids)
+            depth += 1
+
+
+ADAPTIVE_SAVEPOINT_THRESHOLD = 'auto'
+
+
 class SavepointIterator(object):
     """An iterator that creates a savepoint every n items.
 
@@ -177,7 +673,9 @@ class SavepointIterator(object):
         if threshold is None:
             threshold = cls.get_default_threshold()
 
-        if threshold:
+        if threshold == ADAPTIVE_SAVEPOINT_THRESHOLD:
+            return AdaptiveSavepointIterator(iterable, logger=logger)
+        elif threshold:
             return SavepointIterator(iterable, threshold, logger)
         else:
             return iterable
@@ -189,6 +687,8 @@ class SavepointIterator(object):
         The savepoint iterator threshold can be configured with an environment
         variable ``UPGRADE_SAVEPOINT_THRESHOLD``.
         When set to ``"None"``, savepoints are disabled.
+        When set to ``"auto"``, the threshold is adapted to the memory usage
+        (see ``AdaptiveSavepointIterator``).
         """
         value = os.environ.get('UPGRADE_SAVEPOINT_THRESHOLD', None)
         if value is None:
@@ -200,6 +700,9 @@ class SavepointIterator(object):
             # threshold disabled
             return None
 
+        if value == ADAPTIVE_SAVEPOINT_THRESHOLD:
+            return ADAPTIVE_SAVEPOINT_THRESHOLD
+
         try:
             value = int(value)
         except ValueError:
@@ -211,6 +714,110 @@ class SavepointIterator(object):
             raise ValueError('Invalid savepoint threshold {!r}'.format(value))
 
 
+class AdaptiveSavepointIterator(SavepointIterator):
+    """A savepoint iterator which adapts the amount of items between two
+    savepoints to the cost of the items.
+
+    At each savepoint, the growth of the process memory (RSS) and the amount
+    of modified objects since the last savepoint are measured.
+    The next interval is chosen so that the memory growth stays within the
+    memory budget and the amount of modified objects stays below
+    ``max_dirty_objects``.
+    Expensive items (e.g. objects with blobs or large folders) thus get
+    savepoints more often than cheap items (e.g. brains).
+    The interval shrinks immediately but grows at most by factor two per
+    savepoint, so that a series of cheap items does not lead to a huge
+    interval.
+    """
+
+    initial_threshold = 100
+    min_threshold = 10
+    max_threshold = 10000
+    max_dirty_objects = 10000
+
+    def __init__(self, iterable, memory_budget=None, logger=None):
+        super(AdaptiveSavepointIterator, self).__init__(
+            iterable, self.initial_threshold, logger)
+        if memory_budget is None:
+            memory_budget = self.get_default_memory_budget()
+        if not memory_budget or memory_budget <= 0:
+            raise ValueError("Memory budget must be a positive value")
+        self.memory_budget = memory_budget
+
+    def __iter__(self):
+        next_savepoint = 0
+        last_savepoint = 0
+        last_rss = None
+        for i, item in enumerate(self.iterable):
+            if i == next_savepoint:
+                dirty_objects = get_dirty_objects_count()
+                if last_rss is not None:
+                    self.threshold = self.adapt_threshold(
+                        i - last_savepoint,
+                        get_memory_usage() - last_rss,
+                        dirty_objects)
+
+                optimize_memory_usage(self.logger)
+                self.logger.info(
+                    "Created savepoint at %s items (next after %s items)" % (
+                        i, self.threshold))
+                log_memory_usage(self.logger)
+                last_rss = get_memory_usage()
+                last_savepoint = i
+                next_savepoint = i + self.threshold
+            yield item
+
+    def adapt_threshold(self, items, rss_growth, dirty_objects):
+        """Returns the amount of items until the next savepoint, given that
+        the last ``items`` items grew the memory usage by ``rss_growth`` MB
+        and modified ``dirty_objects`` objects (None when unknown).
+        """
+        candidates = [self.threshold * 2]
+        if rss_growth > 0:
+            candidates.append(int(items * self.memory_budget / rss_growth))
+        if dirty_objects:
+            candidates.append(
+                int(items * self.max_dirty_objects / dirty_objects))
+        return max(self.min_threshold,
+                   min(min(candidates), self.max_threshold))
+
+    @staticmethod
+    def get_default_memory_budget():
+        """Returns the memory budget in MB, which the process memory may grow
+        between two savepoints.
+
+        The memory budget can be configured with an environment variable
+        ``UPGRADE_SAVEPOINT_MEMORY_BUDGET``, the default is 256 MB.
+        """
+        value = os.environ.get('UPGRADE_SAVEPOINT_MEMORY_BUDGET', None)
+        if value is None:
+            return 256
+
+        try:
+            value = int(value.strip())
+        except ValueError:
+            raise ValueError('Invalid savepoint memory budget {!r}'.format(
+                value))
+
+        if value > 0:
+            return value
+        else:
+            raise ValueError('Invalid savepoint memory budget {!r}'.format(
+                value))
+
+
+def get_dirty_objects_count():
+    """Returns the amount of objects modified since the last savepoint
+    in the ZODB connection of the current site or None.
+    """
+    site = getSite()
+    connection = getattr(site, '_p_jar', None)
+    registered = getattr(connection, '_registered_objects', None)
+    if registered is None:
+        return None
+    return len(registered)
+
+
 def get_memory_usage():
     mem_info = psutil.Process().memory_info()
     return mem_info.rss / 1024.0 ** 2.0
@@ -257,6 +864,9 @@ def optimize_memory_usage(logger=None):
     again from the ZODB.
     """
     transaction.savepoint(optimistic=True)
+    record_savepoint()
+    # Release the cached containers, so that they can be garbage collected.
+    clear_container_caches()
     # By calling `cacheGC` on the connection, the pickle cache gets a
     # chance to respect the configured zodb cache size by garbage
     # collecting "older" objects (LRU).
@@ -280,59 +890,7 @@ def get_sorted_profile_ids(portal_setup):
     If there are circular dependencies a CyclicDependencies exception
     is thrown.
     """
-    profile_ids = []
-    dependencies = []
-
-    for profile in portal_setup.listProfileInfo():
-        profile_ids.append(profile['id'])
-
-    for profile in portal_setup.listProfileInfo():
-        for dependency in (list(profile.get('dependencies') or []) +
-                           list(profile.get('ftw.upgrade:dependencies') or [])):
-            dependency = re.sub('^profile-', '', dependency)
-            if dependency in profile_ids:
-                dependencies.append((profile['id'], dependency))
-
-    order = topological_sort(profile_ids, dependencies)
-
-    if order is None:
-        raise CyclicDependencies(
-            dependencies,
-            find_cyclic_dependencies(deepcopy(dependencies)))
-    else:
-        return list(reversed(order))
-
-
-def format_duration(seconds):
-    """Makes a duration in seconds human readable.
-    Supports hours, minutes and seconds.
-    """
-
-    seconds = math.ceil(seconds)
-    hours, remainder = divmod(seconds, 60 * 60)
-    minutes, seconds = divmod(remainder, 60)
-
-    result = []
-
-    if hours == 1:
-        result.append('1 hour')
-    elif hours > 1:
-        result.append('%i hours' % hours)
-
-    if minutes == 1:
-        result.append('1 minute')
-    elif minutes > 1:
-        result.append('%i minutes' % minutes)
-
-    if seconds == 1:
-        result.append('1 second')
-    elif seconds > 1:
-        result.append('%i seconds' % seconds)
-
-    if len(result) == 0:
-        return '0 seconds'
-    else:
-        return ', '.join(result)
+    return get_profile_dependency_graph(portal_setup).get_sorted_profile_ids()
 
 
 def subject_from_docstring(docstring):
@@ -351,27 +909,6 @@ def subject_from_docstring(docstring):
     return ' '.join(lines).strip()
 
 
-def get_tempfile_authentication_directory(directory=None):
-    """Finds the buildout directory and returns the absolute path to the
-    relative directory var/ftw.upgrade-authentication/.
-    If the directory does not exist it is created.
-    """
-    directory = Path(directory) or Path.getcwd()
-    if not directory.joinpath('bin', 'buildout').isfile():
-        return get_tempfile_authentication_directory(directory.parent)
-
-    auth_directory = directory.joinpath('var', 'ftw.upgrade-authentication')
-    if not auth_directory.isdir():
-        auth_directory.mkdir(mode=0o770)
-
-    # Verify that "others" do not have any permissions on this directory.
-    if auth_directory.stat().st_mode & stat.S_IRWXO:
-        raise ValueError('{0} has invalid mode: "others" should not have '
-                         'any permissions'.format(auth_directory))
-
-    return auth_directory
-
-
 class StartsWithLogFilter(logging.Filter):
     """Filter messages that start with criteria."""
 
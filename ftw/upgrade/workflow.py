@@ -4,6 +4,7 @@ from ftw.upgrade.helpers import update_security_for
 from ftw.upgrade.utils import SafeObjectGetter
 from ftw.upgrade.utils import SavepointIterator
 from ftw.upgrade.utils import SizedGenerator
+from ftw.upgrade.utils import StreamingBrains
 from Products.CMFCore.utils import getToolByName
 from six.moves import map
 from six.moves import zip
@@ -163,9 +164,11 @@ class WorkflowSecurityUpdater(object):
         self.portal = getSite()
         self.catalog = getToolByName(self.portal, 'portal_catalog')
 
-    def update(self, changed_workflows, reindex_security=True, savepoints=None):
+    def update(self, changed_workflows, reindex_security=True, savepoints=None,
+               streaming=False):
         types = self.get_suspected_types(changed_workflows)
-        objects = SavepointIterator.build(self.lookup_objects(types), savepoints)
+        objects = SavepointIterator.build(
+            self.lookup_objects(types, streaming=streaming), savepoints)
         for obj in objects:
             if self.obj_has_workflow(obj, changed_workflows):
                 update_security_for(obj, reindex_security=reindex_security)
@@ -176,9 +179,13 @@ class WorkflowSecurityUpdater(object):
             self._safe_object_getter = SafeObjectGetter(self.portal, self.catalog, LOG)
         return self._safe_object_getter
 
-    def lookup_objects(self, types):
+    def lookup_objects(self, types, streaming=False):
         query = {'portal_type': types}
-        brains = tuple(self.catalog.unrestrictedSearchResults(query))
+        brains = self.catalog.unrestrictedSearchResults(query)
+        if streaming:
+            brains = StreamingBrains(brains)
+        else:
+            brains = tuple(brains)
 
         generator = SizedGenerator(
             (self.safe_object_getter.catalog_unrestricted_get_object(brain)
@@ -64,7 +64,6 @@ setup(name='ftw.upgrade',
         'requests',
         'setuptools',
         'six >= 1.12.0',
-        'tarjan',
         'psutil',
 
         # Zope